@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Account, Contact, Lead, Deal, Campaign, Task
+from .models import User, Account, Contact, Lead, Deal, Campaign, Task, OutboxEmail
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
@@ -20,4 +20,4 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
-admin.site.register([Account, Contact, Lead, Deal, Campaign, Task])
+admin.site.register([Account, Contact, Lead, Deal, Campaign, Task, OutboxEmail])
@@ -0,0 +1,53 @@
+"""
+Base class for async views that spend their time waiting on the Graph API or the database
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+
+def json_response(data, status_code=status.HTTP_200_OK) -> HttpResponse:
+    """Render like a DRF Response so clients see the same bytes as before."""
+    return HttpResponse(JSONRenderer().render(data), content_type="application/json", status=status_code)
+
+
+def _authenticate(request):
+    """Return (user or None, APIException or None) using the API's JWT authentication."""
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except exceptions.APIException as exc:
+        return None, exc
+    return (result[0] if result else None), None
+
+
+class AsyncAPIView(View):
+    """
+    DRF views are synchronous, so a view that awaits Graph holds a whole
+    worker thread. Subclasses define async handlers instead; this class does
+    the parts of APIView they need by hand: JWT authentication (401 with the
+    same body as DRF), csrf exemption and DRF-rendered JSON.
+    Under ASGI the handlers run on the event loop; under WSGI Django still
+    runs them, one request per thread as before.
+    """
+
+    authentication_required = True
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        user, error = await sync_to_async(_authenticate)(request)
+        if user is None and self.authentication_required:
+            error = error or exceptions.NotAuthenticated()
+            data = error.detail if isinstance(error.detail, (list, dict)) else {"detail": error.detail}
+            response = json_response(data, status_code=error.status_code)
+            response["WWW-Authenticate"] = 'Bearer realm="api"'
+            return response
+        request.user = user or AnonymousUser()
+        return await super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,294 @@
+"""
+Endpoint benchmarks: latency, query count and allocations per API endpoint, the dashboard
+and the Facebook sync against replayed Graph fixtures
+"""
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from typing import Callable, Dict, List, Optional
+
+import django
+from django.db import connections, transaction
+from django.db.models import Count
+from django.contrib.auth import authenticate, login
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.test import Client, RequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from .facebook_service import FacebookGraphAPI, FacebookSyncService
+from .graph_backends import ReplayBackend, generate_fixtures
+from .middleware import QueryRecorder
+from .models import Account, Campaign, Contact, Deal, FacebookIntegration, Lead, Task, User
+
+
+class Rollback(Exception):
+    pass
+
+
+def summarize(latencies: List[float], queries: List[int], peaks: List[int]) -> Dict:
+    ordered = sorted(latencies)
+    return {
+        "runs": len(ordered),
+        "latency_ms": {
+            "min": round(ordered[0] * 1000, 3),
+            "p50": round(statistics.median(ordered) * 1000, 3),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3),
+            "mean": round(statistics.fmean(ordered) * 1000, 3),
+        },
+        "queries": max(queries),
+        "alloc_peak_kb": round(max(peaks) / 1024, 1),
+    }
+
+
+def measure(func: Callable[[], object], repeat: int, warmup: int = 1) -> Dict:
+    """
+    Run func repeat times. Latency comes from runs without tracemalloc,
+    which slows Python code several times; allocations from one extra
+    traced run. Queries are counted on every connection.
+    """
+    for _ in range(warmup):
+        func()
+    latencies, queries = [], []
+    for _ in range(repeat):
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+        queries.append(recorder.count)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    if started_tracing:
+        tracemalloc.stop()
+    return summarize(latencies, queries, [peak])
+
+
+class BenchmarkSuite:
+    """
+    Times every router endpoint (list and detail), the dashboard and the
+    change feed as a superadmin and as the busiest employee, plus a full
+    FacebookSyncService run against replayed synthetic Graph data inside a
+    rolled-back transaction. The response cache is off unless asked for, so
+    repeated runs measure the real work.
+    """
+
+    def __init__(self, repeat: int = 10, use_cache: bool = False, only: Optional[List[str]] = None):
+        self.repeat = repeat
+        self.use_cache = use_cache
+        self.only = only
+
+    def wanted(self, name: str) -> bool:
+        return not self.only or any(part in name for part in self.only)
+
+    def users(self) -> Dict[str, User]:
+        users = {}
+        superadmin = User.objects.filter(role=User.Role.SUPERADMIN).first()
+        if superadmin:
+            users["superadmin"] = superadmin
+        busiest = (Lead.objects.exclude(owner=None).values("owner").order_by()
+                   .annotate(n=Count("pk")).order_by("-n").first())
+        if busiest:
+            users["employee"] = User.objects.get(pk=busiest["owner"])
+        return users
+
+    def endpoints(self) -> List[tuple]:
+        """(name, list url, detail route) for the dashboard, the change feed and every router list."""
+        from crm.urls import router
+
+        endpoints = [("dashboard", reverse("dashboard"), None), ("changes", reverse("changes"), None)]
+        for prefix, viewset, basename in router.registry:
+            if basename.startswith("facebook"):
+                continue
+            endpoints.append((f"{basename}-list", reverse(f"{basename}-list"), f"{basename}-detail"))
+        return endpoints
+
+    def run(self) -> Dict:
+        results = {}
+        with override_settings(CRM_RESPONSE_CACHE=self.use_cache, CRM_SQL_SAMPLE_RATE=0):
+            for role, user in self.users().items():
+                client = Client(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+
+                def get(url):
+                    response = client.get(url)
+                    if response.status_code >= 400:
+                        raise RuntimeError(f"GET {url} returned {response.status_code}")
+                    return response
+
+                for name, url, detail in self.endpoints():
+                    if self.wanted(f"{role}:{name}"):
+                        results[f"{role}:{name}"] = {"url": url, **measure(lambda: get(url), self.repeat)}
+                    if detail is None or not self.wanted(f"{role}:{detail}"):
+                        continue
+                    # Detail of the first listed row, when the object permissions allow it
+                    page = get(url).json()
+                    rows = page.get("results", []) if isinstance(page, dict) else page
+                    detail_url = reverse(detail, args=[rows[0]["id"]]) if rows else None
+                    if detail_url and client.get(detail_url).status_code < 400:
+                        results[f"{role}:{detail}"] = {"url": detail_url,
+                                                       **measure(lambda: get(detail_url), self.repeat)}
+            if self.wanted("facebook_sync"):
+                results["facebook_sync"] = self.measure_sync()
+        return {"meta": self.meta(), "results": results}
+
+    def measure_sync(self) -> Dict:
+        user = User.objects.filter(role=User.Role.SUPERADMIN).first() or User.objects.first()
+        with tempfile.TemporaryDirectory() as directory:
+            generate_fixtures(directory, forms=3, leads=150, campaigns=20)
+            backend = ReplayBackend(directory)
+            result = {}
+            try:
+                with transaction.atomic():
+                    integration = FacebookIntegration.objects.create(user=user, access_token="replay")
+
+                    def sync():
+                        service = FacebookSyncService(integration)
+                        service.api = FacebookGraphAPI(integration.access_token, backend=backend)
+                        return service.sync_all(user)
+
+                    result = measure(sync, max(1, self.repeat // 2))
+                    result["graph_calls"] = backend.calls
+                    raise Rollback
+            except Rollback:
+                pass
+        return result
+
+    @staticmethod
+    def meta() -> Dict:
+        connection = connections["default"]
+        return {
+            "recorded_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "rows": {model._meta.model_name: model.objects.count()
+                     for model in (User, Account, Contact, Campaign, Lead, Deal, Task)},
+        }
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    """
+    Regressions of current against baseline: p50 latency or allocation peak
+    more than tolerance times the baseline, or more queries.
+    """
+    regressions = []
+    for name, now in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        if now["latency_ms"]["p50"] > before["latency_ms"]["p50"] * tolerance:
+            regressions.append(f"{name}: p50 {before['latency_ms']['p50']} -> {now['latency_ms']['p50']} ms")
+        if now["queries"] > before["queries"]:
+            regressions.append(f"{name}: queries {before['queries']} -> {now['queries']}")
+        if now["alloc_peak_kb"] > before["alloc_peak_kb"] * tolerance:
+            regressions.append(f"{name}: alloc peak {before['alloc_peak_kb']} -> {now['alloc_peak_kb']} KiB")
+    return regressions
+
+
+def run_sync(backend, user: User, keep: bool = False) -> Dict:
+    """
+    One FacebookSyncService.sync_all for user against backend, rolled back
+    unless keep: duration, Graph calls, queries and rows synced.
+    """
+    recorder = QueryRecorder()
+    report = {}
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            stack.enter_context(transaction.atomic())
+            integration = FacebookIntegration.objects.create(user=user, access_token="replay")
+            service = FacebookSyncService(integration)
+            service.api = FacebookGraphAPI(integration.access_token, backend=backend)
+            start = time.perf_counter()
+            results = service.sync_all(user)
+            elapsed = time.perf_counter() - start
+            report = {
+                "seconds": round(elapsed, 3),
+                "graph_calls": getattr(backend, "calls", None),
+                "throttled": getattr(backend, "throttled", None),
+                "queries": recorder.count,
+                "db_seconds": round(recorder.duration, 3),
+                "rows": {entity: rows["rows"] if entity == "insights" else len(rows)
+                         for entity, rows in results.items()},
+                "leads_per_second": round(len(results["leads"]) / elapsed) if elapsed else 0,
+            }
+            if not keep:
+                raise Rollback
+    except Rollback:
+        pass
+    return report
+
+
+class LegacyLoginView(TokenObtainPairView):
+    """The login pipeline before LoginView: a second authenticate() and always a session."""
+
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        user = authenticate(email=request.data.get("email"), password=request.data.get("password"))
+        if user:
+            login(request, user)
+        return response
+
+
+def bench_login(logins: int = 20, iterations: Optional[int] = None) -> Dict:
+    """
+    Logins per second, CPU and queries per login for the legacy pipeline,
+    LoginView with a session and LoginView in JWT-only mode, each behind
+    SessionMiddleware (which saves the session), for one user inside a
+    rolled-back transaction.
+    """
+    from .views_auth import LoginView
+
+    overrides = {"CRM_SQL_SAMPLE_RATE": 0}
+    if iterations:
+        overrides["CRM_PASSWORD_ITERATIONS"] = iterations
+    modes = {
+        "legacy": (LegacyLoginView.as_view(), {}),
+        "session": (LoginView.as_view(), {"session": True}),
+        "jwt_only": (LoginView.as_view(), {"session": False}),
+    }
+    factory = RequestFactory()
+    results = {}
+    with override_settings(**overrides):
+        try:
+            with transaction.atomic():
+                email, password = "bench-login@example.com", "bench-password-1"
+                User.objects.create_user(email, password)
+                for mode, (view, extra) in modes.items():
+                    handler = SessionMiddleware(view)
+                    recorder = QueryRecorder()
+                    with ExitStack() as stack:
+                        for alias in connections:
+                            stack.enter_context(connections[alias].execute_wrapper(recorder))
+                        wall, cpu = time.perf_counter(), time.process_time()
+                        for _ in range(logins):
+                            request = factory.post("/api/auth/login/", {"email": email, "password": password, **extra},
+                                                   content_type="application/json")
+                            response = handler(request)
+                            if response.status_code != 200:
+                                raise RuntimeError(f"{mode} login returned {response.status_code}")
+                        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                    results[mode] = {
+                        "logins_per_second": round(logins / wall, 2),
+                        "cpu_ms_per_login": round(cpu / logins * 1000, 2),
+                        "queries_per_login": round(recorder.count / logins, 1),
+                    }
+                raise Rollback
+        except Rollback:
+            pass
+        return {"iterations": settings.CRM_PASSWORD_ITERATIONS, "logins": logins, "results": results}
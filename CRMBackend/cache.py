@@ -0,0 +1,143 @@
+"""
+Response cache for the CRM viewsets, invalidated by per-model generations
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+from .db_router import cache_timeout
+from .metrics import CACHE_LOOKUPS
+from .models import Account, User
+
+GENERATION_KEY = "crm:gen:{}"
+
+
+def _generation_key(model) -> str:
+    return GENERATION_KEY.format(model._meta.label_lower)
+
+
+def bump_generation(model) -> None:
+    """
+    Give the model a new generation. A fresh random token is used rather than
+    an increment so concurrent writers on backends without an atomic incr()
+    (file, locmem across threads) can never end up on an earlier value.
+    """
+    cache.set(_generation_key(model), uuid.uuid4().hex, timeout=None)
+
+
+def invalidate_model(model) -> None:
+    """Bump now for readers in this transaction and again once it commits."""
+    bump_generation(model)
+    transaction.on_commit(lambda: bump_generation(model))
+
+
+def get_generations(models) -> list:
+    keys = [_generation_key(model) for model in models]
+    found = cache.get_many(keys)
+    generations = []
+    for key in keys:
+        if key not in found:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            found[key] = cache.get(key)
+        generations.append(found[key] or "")
+    return generations
+
+
+def request_scope(user) -> str:
+    """
+    Everything about the user that IsAdminOrOwner looks at: role, region,
+    allowed accounts and, for employees, the user itself. The allowed
+    account ids are cached per user generation so a hit needs no query.
+    """
+    if user.role == user.Role.SUPERADMIN:
+        return user.role
+    key = f"crm:scope:{user.pk}:{get_generations([User])[0]}"
+    allowed = cache.get(key)
+    if allowed is None:
+        allowed = ",".join(str(pk) for pk in sorted(user.allowed_accounts.values_list("pk", flat=True)))
+        cache.set(key, allowed, settings.CRM_RESPONSE_CACHE_TIMEOUT)
+    scope = f"{user.role}:{user.region or ''}:{allowed}"
+    if user.role == user.Role.EMPLOYEE:
+        scope += f":{user.pk}"
+    return scope
+
+
+def cache_dependencies(model) -> tuple:
+    """
+    The model itself, every model it points to (SET_NULL and cascades change
+    these columns without a signal on this model) and Account, which drives
+    the role scoping.
+    """
+    related = {
+        field.related_model
+        for field in model._meta.get_fields()
+        if field.concrete and field.is_relation and field.related_model is not None
+    }
+    related.discard(model)
+    related.add(Account)
+    return (model,) + tuple(sorted(related, key=lambda m: m._meta.label_lower))
+
+
+class CachedResponseMixin:
+    """
+    Caches rendered list and retrieve responses. The key combines the
+    request scope, URL with query params, negotiated format and the generations
+    of every model the response depends on, so any save, delete or m2m
+    change to those models makes the old entries unreachable. Queryset
+    update() sends no signal: RollupQuerySet invalidates its model itself,
+    and other bulk writers must call invalidate_model().
+    """
+
+    cached_actions = ("list", "retrieve")
+
+    def response_cache_key(self, request):
+        parts = [
+            self.basename,
+            self.action,
+            request.build_absolute_uri(),
+            request.accepted_media_type or "",
+            request_scope(request.user),
+        ]
+        parts.extend(get_generations(cache_dependencies(self.queryset.model)))
+        digest = hashlib.md5("|".join(parts).encode(), usedforsecurity=False).hexdigest()
+        return f"crm:resp:{self.basename}:{digest}"
+
+    def _use_response_cache(self, request):
+        return (
+            settings.CRM_RESPONSE_CACHE
+            and request.method == "GET"
+            and self.action in self.cached_actions
+            and request.user.is_authenticated
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_or(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_or(super().retrieve, request, *args, **kwargs)
+
+    def _cached_or(self, handler, request, *args, **kwargs):
+        if not self._use_response_cache(request):
+            return handler(request, *args, **kwargs)
+        key = self.response_cache_key(request)
+        hit = cache.get(key)
+        if hit is not None:
+            CACHE_LOOKUPS.labels("response", "hit").inc()
+            content_type, content = hit
+            return HttpResponse(content, content_type=content_type)
+        CACHE_LOOKUPS.labels("response", "miss").inc()
+        request._crm_response_cache_key = key
+        return handler(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(request, "_crm_response_cache_key", None)
+        if key and response.status_code == 200 and not response.streaming:
+            if hasattr(response, "render"):
+                response.render()
+            cache.set(key, (response["Content-Type"], response.content), cache_timeout(settings.CRM_RESPONSE_CACHE_TIMEOUT))
+        return response
@@ -0,0 +1,205 @@
+"""
+Delta-sync change feed: /api/changes/?since=<token>
+"""
+import base64
+import itertools
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Max, Subquery
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .fast_serializers import compile_row_plan
+from .models import Account, Campaign, ChangeLogEntry, Contact, Deal, Lead, Task
+from .permissions import scope_queryset
+from .serializers import (
+    AccountSerializer,
+    CampaignSerializer,
+    ContactSerializer,
+    DealSerializer,
+    LeadSerializer,
+    TaskSerializer,
+)
+
+# entity name in the feed -> (model, serializer)
+SYNCED_ENTITIES = {
+    "accounts": (Account, AccountSerializer),
+    "contacts": (Contact, ContactSerializer),
+    "leads": (Lead, LeadSerializer),
+    "deals": (Deal, DealSerializer),
+    "campaigns": (Campaign, CampaignSerializer),
+    "tasks": (Task, TaskSerializer),
+}
+ENTITY_NAMES = {model: name for name, (model, _) in SYNCED_ENTITIES.items()}
+
+
+def record_change(model, object_id, op) -> None:
+    entity = ENTITY_NAMES.get(model)
+    if entity:
+        ChangeLogEntry.objects.create(entity=entity, object_id=object_id, op=op)
+
+
+def record_changes(model, object_ids, op) -> None:
+    """Log many rows at once, for bulk paths that send no signals."""
+    entity = ENTITY_NAMES.get(model)
+    if not entity:
+        return
+    now = timezone.now()
+    ChangeLogEntry.objects.bulk_create(
+        [ChangeLogEntry(entity=entity, object_id=pk, op=op, changed_at=now) for pk in object_ids],
+        batch_size=1000,
+    )
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def encode_token(position: int, as_of: float) -> str:
+    """as_of: time up to which the client has seen every change."""
+    raw = f"{position}.{int(as_of)}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_token(token: str):
+    """Return (position, as_of) or raise InvalidToken."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        position, as_of = raw.split(".")
+        return int(position), int(as_of)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidToken(token)
+
+
+def compact_change_log(retention_days: int) -> dict:
+    """
+    Drop entries older than the retention window (tokens that old are
+    refused, so nobody can ask for them) and entries superseded by a later
+    entry for the same row, which a client reading past them would get anyway.
+    """
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    expired, _ = ChangeLogEntry.objects.filter(changed_at__lt=cutoff).delete()
+    latest = ChangeLogEntry.objects.values("entity", "object_id").annotate(last=Max("id")).values("last")
+    superseded, _ = ChangeLogEntry.objects.exclude(id__in=Subquery(latest)).delete()
+    return {"expired": expired, "superseded": superseded}
+
+
+def settled_cutoff() -> float:
+    """
+    Time before which every change log entry is taken to be committed.
+    Ids are allocated at insert but become visible at commit, so an entry
+    can show up after one with a higher id; the feed only moves its
+    position past entries older than CRM_CHANGELOG_SETTLE_SECONDS.
+    """
+    return time.time() - settings.CRM_CHANGELOG_SETTLE_SECONDS
+
+
+def settled_position(cutoff: float) -> int:
+    """Id of the newest entry written before cutoff: where a client starts after a full load."""
+    before = datetime.fromtimestamp(cutoff, tz=dt_timezone.utc)
+    return ChangeLogEntry.objects.filter(changed_at__lt=before).aggregate(last=Max("id"))["last"] or 0
+
+
+def _serialize(model, serializer_class, user, ids):
+    queryset = scope_queryset(model.objects.filter(pk__in=ids), user).order_by("pk")
+    plan = compile_row_plan(serializer_class())
+    if plan is not None:
+        return plan.convert(queryset.values_list(*plan.attnames))
+    return serializer_class(queryset, many=True).data
+
+
+class ChangesView(APIView):
+    """
+    Returns the rows created, updated and deleted since an opaque token.
+
+    Without ?since= the response only carries the current token, to be taken
+    right after a full load. Created/updated rows are returned in full and
+    filtered by the same role scoping as exports; deletions are returned as
+    ids for every entity the client asked for, since the row they scoped by
+    is gone. Changed rows the user can no longer see (e.g. reassigned to
+    another owner) are listed under "deleted" too, so the client drops them.
+    Tokens older than CRM_CHANGELOG_RETENTION_DAYS get 410 and the
+    client must reload. Tokens remember how far the client has caught up, so
+    paging slowly through an old backlog expires the same way.
+
+    Entries from the last CRM_CHANGELOG_SETTLE_SECONDS are returned but the
+    token stays before them (see settled_cutoff), so they come again on the
+    next call along with any entry that committed late between them.
+    Returning a row twice is harmless: the feed carries its current state.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        entities = request.query_params.get("entities")
+        entities = [e for e in entities.split(",") if e in SYNCED_ENTITIES] if entities else list(SYNCED_ENTITIES)
+        try:
+            limit = min(int(request.query_params.get("limit", 500)), 5000)
+        except ValueError:
+            return Response({"detail": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"detail": "limit must be at least 1"}, status=status.HTTP_400_BAD_REQUEST)
+
+        cutoff = settled_cutoff()
+        since = request.query_params.get("since")
+        if not since:
+            return Response({"token": encode_token(settled_position(cutoff), cutoff), "more": False, "changes": {}})
+        try:
+            position, as_of = decode_token(since)
+        except InvalidToken:
+            return Response({"detail": "invalid token"}, status=status.HTTP_400_BAD_REQUEST)
+        if as_of < time.time() - settings.CRM_CHANGELOG_RETENTION_DAYS * 86400:
+            return Response({"detail": "token expired, full reload required"}, status=status.HTTP_410_GONE)
+
+        entries = list(
+            ChangeLogEntry.objects.filter(id__gt=position, entity__in=entities)
+            .order_by("id")
+            .values_list("id", "entity", "object_id", "op", "changed_at")[: limit + 1]
+        )
+        more = len(entries) > limit
+        entries = entries[:limit]
+        settled = list(itertools.takewhile(lambda entry: entry[4].timestamp() < cutoff, entries))
+        as_of = cutoff
+        if settled:
+            position = settled[-1][0]
+        if more:
+            if len(settled) == len(entries):
+                # Only caught up to the last entry returned, not to now.
+                as_of = entries[-1][4].timestamp()
+            else:
+                # The rest is too recent to move past; the client polls again later.
+                more = False
+
+        # Collapse several entries for one row into its net change.
+        net = {}
+        for _, entity, object_id, op, _ in entries:
+            first_op = net.get((entity, object_id), (op, op))[0]
+            net[(entity, object_id)] = (first_op, op)
+
+        changes = {}
+        for entity in entities:
+            created, updated, deleted = [], [], []
+            for (name, object_id), (first_op, last_op) in net.items():
+                if name != entity:
+                    continue
+                if last_op == "D":
+                    deleted.append(object_id)
+                elif first_op == "C":
+                    created.append(object_id)
+                else:
+                    updated.append(object_id)
+            if not (created or updated or deleted):
+                continue
+            model, serializer_class = SYNCED_ENTITIES[entity]
+            created_rows = _serialize(model, serializer_class, request.user, created) if created else []
+            updated_rows = _serialize(model, serializer_class, request.user, updated) if updated else []
+            visible = {row["id"] for row in created_rows} | {row["id"] for row in updated_rows}
+            deleted.extend(pk for pk in created + updated if pk not in visible)
+            changes[entity] = {"created": created_rows, "updated": updated_rows, "deleted": sorted(deleted)}
+
+        return Response({"token": encode_token(position, as_of), "more": more, "changes": changes})
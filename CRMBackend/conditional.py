@@ -0,0 +1,98 @@
+"""
+ETag / If-None-Match support for the CRM API, based on updated_at row versions
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .cache import cache_dependencies, get_generations, request_scope
+from .db_router import cache_timeout
+from .metrics import CACHE_LOOKUPS
+
+
+def _digest(*parts) -> str:
+    return hashlib.md5("|".join(str(p) for p in parts).encode(), usedforsecurity=False).hexdigest()
+
+
+def memoized_etag(request, models, compute, memo_extra=(), timeout=None) -> str:
+    """
+    ETag for this request, computed once per generation of the models it
+    depends on. The value itself only depends on row versions, so every
+    worker arrives at the same ETag whatever cache backend is used.
+    """
+    url = request.build_absolute_uri()
+    media_type = getattr(request, "accepted_media_type", None) or ""  # absent on plain async views
+    scope = request_scope(request.user)
+    memo_key = "crm:etag:" + _digest(url, media_type, scope, *memo_extra, *get_generations(models))
+    etag = cache.get(memo_key)
+    if etag is None:
+        CACHE_LOOKUPS.labels("etag", "miss").inc()
+        etag = quote_etag(_digest(url, media_type, scope, *compute()))
+        cache.set(memo_key, etag, cache_timeout(settings.CRM_RESPONSE_CACHE_TIMEOUT if timeout is None else timeout))
+    else:
+        CACHE_LOOKUPS.labels("etag", "hit").inc()
+    return etag
+
+
+def queryset_version(queryset):
+    """Row count and newest updated_at of a (filtered) queryset: one aggregate query."""
+    version = queryset.aggregate(count=Count("pk"), latest=Max("updated_at"))
+    return version["count"], version["latest"].isoformat() if version["latest"] else ""
+
+
+def conditional_response(request, etag, handler, *args, **kwargs):
+    """Answer 304 when If-None-Match matches, otherwise call the handler and tag its response."""
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    response = handler(request, *args, **kwargs)
+    if response.status_code == 200:
+        response["ETag"] = etag
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETags to list and retrieve. Lists are versioned by the count and
+    max(updated_at) of the filtered queryset, details by the row's
+    updated_at, so a matching If-None-Match is answered with 304 before
+    anything is serialized.
+    """
+
+    def list(self, request, *args, **kwargs):
+        etag = memoized_etag(
+            request,
+            cache_dependencies(self.queryset.model),
+            lambda: queryset_version(self.filter_queryset(self.get_queryset())),
+        )
+        return conditional_response(request, etag, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        def compute():
+            instance = self.get_object()  # runs the object permission check
+            return (instance.pk, instance.updated_at.isoformat())
+
+        etag = memoized_etag(request, cache_dependencies(self.queryset.model), compute)
+        return conditional_response(request, etag, super().retrieve, *args, **kwargs)
+
+
+def dashboard_etag(request, models):
+    """
+    The dashboard mixes totals with rolling 7/30 day windows, so besides the
+    row versions of every model the ETag includes the current minute.
+    """
+    minute = timezone.now().strftime("%Y%m%d%H%M")
+    superuser = request.user.is_superuser  # the dashboard treats is_superuser like SUPERADMIN
+
+    def compute():
+        parts = [minute, superuser]
+        for model in models:
+            parts.extend(queryset_version(model.objects.all()))
+        return parts
+
+    return memoized_etag(request, models, compute, memo_extra=(minute, superuser), timeout=60)
@@ -0,0 +1,172 @@
+"""
+Read replica routing: safe API requests read from replicas, with read-your-writes stickiness and a lag check
+"""
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from django.utils.functional import SimpleLazyObject, empty
+
+from .metrics import DB_REPLICA_LAG
+
+logger = logging.getLogger("crm.db")
+
+PRIMARY = "default"
+
+# Routing of the request being served; None outside requests and for unsafe methods
+_routing: ContextVar[Optional["ReplicaReads"]] = ContextVar("crm_replica_reads", default=None)
+
+# alias -> (checked at, lag in seconds or None when the replica could not be reached), per process
+_lag: Dict[str, Tuple[float, Optional[float]]] = {}
+
+_LAG_SQL = {
+    # Zero when everything received has been replayed, so an idle primary does not read as lag
+    "postgresql": (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    ),
+}
+
+
+def replica_lag(alias: str) -> Optional[float]:
+    """
+    Replication lag of alias in seconds, measured at most every
+    CRM_DB_REPLICA_LAG_CHECK_SECONDS; None when the replica is unreachable.
+    Backends without replication (SQLite) report no lag.
+    """
+    now = time.monotonic()
+    checked_at, lag = _lag.get(alias, (None, None))
+    if checked_at is not None and now - checked_at < settings.CRM_DB_REPLICA_LAG_CHECK_SECONDS:
+        return lag
+    connection = connections[alias]
+    sql = _LAG_SQL.get(connection.vendor)
+    try:
+        if sql is None:
+            lag = 0.0
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+                value = cursor.fetchone()[0]
+            # NULL on a server that is not a standby: nothing to wait for
+            lag = float(value or 0)
+    except DatabaseError as exc:
+        logger.warning("Replica %s unavailable, reading from the primary: %s", alias, exc)
+        lag = None
+    _lag[alias] = (now, lag)
+    DB_REPLICA_LAG.labels(alias).set(-1 if lag is None else lag)
+    return lag
+
+
+def healthy_replicas() -> List[str]:
+    limit = settings.CRM_DB_MAX_REPLICA_LAG_SECONDS
+    return [alias for alias in settings.CRM_DB_REPLICAS if (lag := replica_lag(alias)) is not None and lag <= limit]
+
+
+def _pin_key(user_id) -> str:
+    return f"crm:db-pin:{user_id}"
+
+
+def pin_to_primary(user_id) -> None:
+    """Route the user's reads to the primary for CRM_DB_STICKY_SECONDS, so they see their own writes."""
+    cache.set(_pin_key(user_id), 1, settings.CRM_DB_STICKY_SECONDS)
+
+
+def _known_user_id(request):
+    """The request user's id if authentication already ran; never triggers the lookup itself."""
+    user = request.__dict__.get("user")
+    if isinstance(user, SimpleLazyObject):
+        user = None if user._wrapped is empty else user._wrapped
+    if user is None or not getattr(user, "is_authenticated", False):
+        return None
+    return user.pk
+
+
+class ReplicaReads:
+    """
+    Read routing for one safe request: a single replica for the whole
+    request, or the primary once the user turns out to be pinned.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.pinned = None
+        self.replica = None
+
+    def db_for_read(self) -> str:
+        if self.pinned is None:
+            user_id = _known_user_id(self.request)
+            if user_id is not None:
+                self.pinned = bool(cache.get(_pin_key(user_id)))
+        if self.pinned:
+            return PRIMARY
+        if self.replica is None:
+            replicas = healthy_replicas()
+            self.replica = random.choice(replicas) if replicas else PRIMARY
+        return self.replica
+
+
+def cache_timeout(timeout):
+    """
+    timeout for caching something built from this request's reads: at most
+    CRM_DB_MAX_REPLICA_LAG_SECONDS when they came from a replica, which may
+    not have caught up with the write that invalidated the previous entry.
+    """
+    routing = _routing.get()
+    if routing is None or routing.pinned or routing.replica in (None, PRIMARY):
+        return timeout
+    limit = max(1, int(settings.CRM_DB_MAX_REPLICA_LAG_SECONDS))
+    return limit if timeout is None else min(timeout, limit)
+
+
+def replica_eligible(request) -> bool:
+    return (
+        bool(settings.CRM_DB_REPLICAS)
+        and request.method in ("GET", "HEAD", "OPTIONS")
+        and request.path.startswith(tuple(settings.CRM_DB_REPLICA_PATHS))
+    )
+
+
+def start_request(request):
+    """Set up routing for request; returns the token for end_request."""
+    return _routing.set(ReplicaReads(request) if replica_eligible(request) else None)
+
+
+def end_request(request, response, token) -> None:
+    """Undo start_request; a successful write pins the user to the primary."""
+    _routing.reset(token)
+    if response is None or not settings.CRM_DB_REPLICAS:
+        return
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        user_id = _known_user_id(request)
+        if user_id is not None:
+            pin_to_primary(user_id)
+
+
+class ReplicaRouter:
+    """
+    Writes, migrations and everything outside a replica-eligible request go
+    to the primary. Reads of safe requests under CRM_DB_REPLICA_PATHS go to
+    a replica within CRM_DB_MAX_REPLICA_LAG_SECONDS, unless the user wrote
+    recently or a transaction is open on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        return routing.db_for_read()
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
@@ -0,0 +1,154 @@
+"""
+Contact deduplication: candidate pairs by blocking on the match keys, scoring, and batched merges
+"""
+import itertools
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from .cache import invalidate_model
+from .changes import record_changes
+from .matching import KEY_FIELDS, fold, match_keys
+from .models import Contact, Deal, Lead
+
+logger = logging.getLogger("crm.dedup")
+
+# What sharing each key says about two contacts of one account
+KEY_WEIGHTS = {"email_key": 0.6, "phone_key": 0.4, "name_key": 0.2}
+# Extra weight when the names are equal after case and accent folding, not just alike
+SAME_NAME_WEIGHT = 0.2
+# Blank contact fields a merge fills from the duplicates
+FILLED_FIELDS = ("last_name", "email", "phone", "position", "facebook_user_id")
+# Foreign keys to Contact that a merge repoints to the surviving contact
+REFERENCES = ((Lead, "contact"), (Deal, "contact"))
+
+
+def find_contact(account, email: Optional[str] = None, phone: Optional[str] = None) -> Optional[Contact]:
+    """The account's oldest contact with the same normalized email, else the same phone."""
+    keys = match_keys(email=email, phone=phone)
+    for field in ("email_key", "phone_key"):
+        if keys[field]:
+            contact = Contact.objects.filter(account=account, **{field: keys[field]}).order_by("pk").first()
+            if contact is not None:
+                return contact
+    return None
+
+
+def score(a: Dict, b: Dict) -> float:
+    """Likelihood in 0..1 that two contact rows (dicts of the key columns and names) are one person."""
+    total = sum(weight for field, weight in KEY_WEIGHTS.items() if a[field] and a[field] == b[field])
+    if a["full_name"] and a["full_name"] == b["full_name"]:
+        total += SAME_NAME_WEIGHT
+    return min(total, 1.0)
+
+
+def candidate_pairs(contacts=None, max_block: Optional[int] = None) -> Tuple[Dict[int, Dict], set]:
+    """
+    (rows by pk, pairs of pks) of contacts sharing an account and a
+    non-empty key. Each key is read once in (account, key) order, along its
+    index, and only contacts in the same block are compared, so the work
+    grows with the contacts plus the pairs rather than their square. Blocks
+    above max_block (default CRM_DEDUP_MAX_BLOCK) are skipped: a shared
+    switchboard number or a common name says little.
+    """
+    contacts = Contact.objects.all() if contacts is None else contacts
+    max_block = settings.CRM_DEDUP_MAX_BLOCK if max_block is None else max_block
+    rows: Dict[int, Dict] = {}
+    pairs = set()
+    for field in KEY_FIELDS:
+        stream = (
+            contacts.exclude(**{field: ""}).order_by("account_id", field, "pk")
+            .values("pk", "account_id", "first_name", "last_name", *KEY_FIELDS).iterator(chunk_size=5000)
+        )
+        for (_, key), block in itertools.groupby(stream, key=lambda row: (row["account_id"], row[field])):
+            block = list(block)
+            if len(block) < 2:
+                continue
+            if len(block) > max_block:
+                logger.info("Skipping %d contacts sharing %s %r", len(block), field, key)
+                continue
+            for row in block:
+                if row["pk"] not in rows:
+                    row["full_name"] = " ".join(filter(None, (fold(row["first_name"]), fold(row["last_name"]))))
+                    rows[row["pk"]] = row
+            pairs.update(itertools.combinations([row["pk"] for row in block], 2))
+    return rows, pairs
+
+
+def duplicate_groups(contacts=None, threshold: Optional[float] = None,
+                     max_block: Optional[int] = None) -> List[List[int]]:
+    """
+    Groups of contact pks judged to be one person, each oldest first (the
+    contact a merge keeps). Pairs scoring at least threshold (default
+    CRM_DEDUP_THRESHOLD) are joined transitively.
+    """
+    threshold = settings.CRM_DEDUP_THRESHOLD if threshold is None else threshold
+    rows, pairs = candidate_pairs(contacts, max_block)
+    parent = {}
+
+    def root(pk):
+        while parent.get(pk, pk) != pk:
+            parent[pk] = parent.get(parent[pk], parent[pk])
+            pk = parent[pk]
+        return pk
+
+    for a, b in pairs:
+        if score(rows[a], rows[b]) >= threshold:
+            ra, rb = root(a), root(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+    groups: Dict[int, List[int]] = {}
+    for pk in parent:
+        groups.setdefault(root(pk), []).append(pk)
+    return sorted(sorted({*members, group}) for group, members in groups.items())
+
+
+def merge_groups(groups: Iterable[List[int]], batch_size: int = 500) -> Dict[str, int]:
+    """
+    Merge each group into its first contact, batch_size groups per
+    transaction: blank fields of the survivor are filled from the
+    duplicates, leads and deals pointing at a duplicate are repointed with
+    one UPDATE per foreign key and batch, and the duplicates are deleted.
+    Tasks reference contacts only through leads and deals, so they follow.
+    """
+    result = {"groups": 0, "merged": 0, "leads": 0, "deals": 0}
+    groups = iter(groups)
+    for batch in iter(lambda: list(itertools.islice(groups, batch_size)), []):
+        with transaction.atomic():
+            pks = sorted({pk for group in batch for pk in group})
+            contacts = Contact.objects.select_for_update().in_bulk(pks)
+            survivors = {}
+            for group in batch:
+                present = [pk for pk in group if pk in contacts]
+                if len(present) < 2:
+                    continue
+                survivor = contacts[present[0]]
+                changed = []
+                for pk in present[1:]:
+                    survivors[pk] = survivor.pk
+                    for field in FILLED_FIELDS:
+                        if not getattr(survivor, field) and getattr(contacts[pk], field):
+                            setattr(survivor, field, getattr(contacts[pk], field))
+                            changed.append(field)
+                if changed:
+                    survivor.save(update_fields=[*changed, "updated_at"])
+                result["groups"] += 1
+            if not survivors:
+                continue
+            now = timezone.now()
+            repoint = Case(*[When(contact_id=pk, then=Value(survivor)) for pk, survivor in survivors.items()])
+            for model, field in REFERENCES:
+                rows = model.objects.filter(**{f"{field}__in": list(survivors)})
+                moved = list(rows.values_list("pk", flat=True))
+                if moved:
+                    model.objects.filter(pk__in=moved).update(**{field: repoint, "updated_at": now})
+                    record_changes(model, moved, "U")
+                    invalidate_model(model)
+                result[f"{model._meta.model_name}s"] += len(moved)
+            Contact.objects.filter(pk__in=list(survivors)).delete()
+            result["merged"] += len(survivors)
+    return result
@@ -0,0 +1,214 @@
+"""
+Server-Sent Events stream of CRM changes for the list pages (ASGI only)
+"""
+import asyncio
+import json
+import secrets
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Max
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+
+from .changes import SYNCED_ENTITIES
+from .models import ChangeLogEntry, User
+from .permissions import scope_queryset
+
+TICKET_KEY = "crm:events-ticket:{}"
+# Most entries replayed to a reconnecting client; past that it is told to reload instead
+REPLAY_LIMIT = 5000
+
+
+def _fetch_entries(after_id, limit=1000):
+    return list(
+        ChangeLogEntry.objects.filter(id__gt=after_id)
+        .order_by("id")
+        .values_list("id", "entity", "object_id", "op")[:limit]
+    )
+
+
+def _latest_id():
+    return ChangeLogEntry.objects.aggregate(last=Max("id"))["last"] or 0
+
+
+class ChangeBroadcaster:
+    """
+    One poller per process reads new change log entries and fans them out
+    to every open stream, so the database sees one small range query per
+    interval however many tabs are connected.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.last_id = None
+        self.task = None
+
+    async def subscribe(self):
+        queue = asyncio.Queue(maxsize=100)
+        if self.task is None or self.task.done():
+            self.last_id = await sync_to_async(_latest_id)()
+            self.subscribers.add(queue)
+            self.task = asyncio.get_running_loop().create_task(self._poll())
+        else:
+            self.subscribers.add(queue)
+        return queue, self.last_id
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    async def _poll(self):
+        while self.subscribers:
+            await asyncio.sleep(settings.CRM_EVENTS_POLL_SECONDS)
+            entries = await sync_to_async(_fetch_entries)(self.last_id)
+            if not entries:
+                continue
+            self.last_id = entries[-1][0]
+            for queue in list(self.subscribers):
+                try:
+                    queue.put_nowait(entries)
+                except asyncio.QueueFull:
+                    # A stalled client is dropped; it reconnects with Last-Event-ID.
+                    self.subscribers.discard(queue)
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+        self.task = None
+
+
+broadcaster = ChangeBroadcaster()
+
+
+def visible_events(user, entities, entries):
+    """
+    Reduce entries to (event id, entity, object id, op) the user may see.
+    Deletions are passed through like in the change feed.
+    """
+    latest = {}
+    for entry_id, entity, object_id, op in entries:
+        if entity in entities:
+            latest[(entity, object_id)] = (entry_id, op)
+    by_entity = {}
+    for (entity, object_id), (_, op) in latest.items():
+        if op != "D":
+            by_entity.setdefault(entity, set()).add(object_id)
+    visible = {}
+    for entity, ids in by_entity.items():
+        model = SYNCED_ENTITIES[entity][0]
+        visible[entity] = set(scope_queryset(model.objects.filter(pk__in=ids), user).values_list("pk", flat=True))
+    events = [
+        (entry_id, entity, object_id, op)
+        for (entity, object_id), (entry_id, op) in latest.items()
+        if op == "D" or object_id in visible.get(entity, ())
+    ]
+    return sorted(events)
+
+
+class EventTicketView(APIView):
+    """
+    POST /api/events/ticket/ returns a ticket for opening one stream as
+    /api/events/?ticket=. EventSource cannot send headers, and an access
+    token in the URL would end up in access logs; a ticket is random, good
+    for CRM_EVENTS_TICKET_SECONDS and redeemed on first use.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        ticket = secrets.token_urlsafe(32)
+        cache.set(TICKET_KEY.format(ticket), request.user.pk, settings.CRM_EVENTS_TICKET_SECONDS)
+        return Response({"ticket": ticket, "expires_in": settings.CRM_EVENTS_TICKET_SECONDS})
+
+
+def _redeem_ticket(ticket):
+    key = TICKET_KEY.format(ticket)
+    user_id = cache.get(key)
+    # Only the request whose delete removes the key may use it
+    if user_id is None or not cache.delete(key):
+        return None
+    return User.objects.filter(pk=user_id, is_active=True).first()
+
+
+def _authenticate(request):
+    """A ?ticket= from EventTicketView, or the usual Authorization header or cookie."""
+    ticket = request.GET.get("ticket")
+    if ticket:
+        return _redeem_ticket(ticket)
+    header = request.headers.get("Authorization") or request.COOKIES.get("Authorization") or ""
+    if not header.startswith("Bearer "):
+        return None
+    raw = header.split(" ", 1)[1]
+    auth = JWTAuthentication()
+    try:
+        return auth.get_user(auth.get_validated_token(raw))
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+
+
+def _format(event):
+    entry_id, entity, object_id, op = event
+    data = json.dumps({"entity": entity, "id": object_id, "op": op}, separators=(",", ":"))
+    return f"id: {entry_id}\nevent: change\ndata: {data}\n\n"
+
+
+async def _stream(user, entities, last_event_id):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.CRM_EVENTS_MAX_SECONDS
+    queue, position = await broadcaster.subscribe()
+    try:
+        yield "retry: 5000\n\n"
+        # Replay what happened while the client was disconnected.
+        if last_event_id is not None and last_event_id < position:
+            missed = await sync_to_async(_fetch_entries)(last_event_id, limit=REPLAY_LIMIT + 1)
+            missed = [entry for entry in missed if entry[0] <= position]
+            if len(missed) > REPLAY_LIMIT:
+                # Too much to replay: the client reloads its lists and carries on from here
+                yield f"id: {position}\nevent: reset\ndata: {{}}\n\n"
+            else:
+                for event in await sync_to_async(visible_events)(user, entities, missed):
+                    yield _format(event)
+        while loop.time() < deadline:
+            try:
+                entries = await asyncio.wait_for(queue.get(), timeout=settings.CRM_EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if entries is None:
+                break
+            for event in await sync_to_async(visible_events)(user, entities, entries):
+                yield _format(event)
+    finally:
+        broadcaster.unsubscribe(queue)
+
+
+async def events_view(request):
+    """
+    GET /api/events/?entities=leads,deals streams change notifications
+    ({"entity", "id", "op"}) for rows the user can see. Streams close after
+    CRM_EVENTS_MAX_SECONDS and the browser reconnects with Last-Event-ID.
+    If more than REPLAY_LIMIT entries were missed meanwhile, a "reset"
+    event is sent instead and the client reloads its lists.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"detail": "The event stream requires the ASGI server (crm.asgi)."}, status=501)
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+    entities = request.GET.get("entities")
+    entities = {e for e in entities.split(",") if e in SYNCED_ENTITIES} if entities else set(SYNCED_ENTITIES)
+    last_event_id = request.headers.get("Last-Event-ID") or request.GET.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    response = StreamingHttpResponse(_stream(user, entities, last_event_id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,137 @@
+"""
+Streaming CSV / NDJSON export for the CRM viewsets
+"""
+import csv
+import decimal
+import io
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .permissions import scope_queryset
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Lets ?format=csv pass DRF content negotiation; exports are streamed, so
+    only error payloads (e.g. {"detail": ...}) are rendered, as one row.
+    """
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, dict):
+            data = {"detail": data}
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(data.keys())
+        writer.writerow([" ".join(map(str, value)) if isinstance(value, list) else value for value in data.values()])
+        return buffer.getvalue().encode(self.charset)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Lets ?format=ndjson pass DRF content negotiation; exports are streamed,
+    so only error payloads are rendered, as one line.
+    """
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return (ExportJSONEncoder(ensure_ascii=False, separators=(",", ":")).encode(data) + "\n").encode(self.charset)
+
+
+class ExportJSONEncoder(JSONEncoder):
+    """Keeps decimals as strings, matching the API's DecimalField output."""
+
+    def default(self, obj):
+        if isinstance(obj, decimal.Decimal):
+            return str(obj)
+        return super().default(obj)
+
+
+def export_columns(serializer, model):
+    """
+    Return (header, attname) pairs for every readable serializer field that is
+    a concrete column, so exports never leak write-only fields (passwords) and
+    follow the same Facebook-column detection as the API.
+    """
+    concrete = {f.name: f.attname for f in model._meta.concrete_fields}
+    return [
+        (name, concrete[name])
+        for name, field in serializer.fields.items()
+        if not field.write_only and name in concrete
+    ]
+
+
+def iter_rows(queryset, attnames, chunk_size):
+    """Yield value tuples through a server-side cursor, in primary key order."""
+    return queryset.order_by("pk").values_list(*attnames).iterator(chunk_size=chunk_size)
+
+
+def stream_csv(rows, header, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    pending = 0
+    for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+        pending += 1
+        if pending >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def stream_ndjson(rows, header, chunk_size):
+    encoder = ExportJSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(header, row))))
+        if len(lines) >= chunk_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+class ExportMixin:
+    """
+    Adds GET /api/<entity>/export/?format=csv|ndjson to a ModelViewSet.
+
+    The export goes through the viewset's own get_queryset() filters and the
+    IsAdminOrOwner role scoping, and streams rows as they are read instead of
+    building the whole file in memory.
+    """
+
+    export_formats = {
+        "csv": (stream_csv, "text/csv"),
+        "ndjson": (stream_ndjson, "application/x-ndjson"),
+    }
+
+    @action(detail=False, methods=["get"], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        export_format = request.accepted_renderer.format
+        stream, content_type = self.export_formats[export_format]
+
+        queryset = scope_queryset(self.filter_queryset(self.get_queryset()), request.user)
+        columns = export_columns(self.get_serializer(), queryset.model)
+        header = [name for name, _ in columns]
+        chunk_size = settings.CRM_EXPORT_CHUNK_SIZE
+
+        rows = iter_rows(queryset, [attname for _, attname in columns], chunk_size)
+        response = StreamingHttpResponse(stream(rows, header, chunk_size), content_type=content_type)
+        filename = f"{self.basename}-export.{export_format}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
@@ -2,24 +2,17 @@
 Facebook OAuth Callback View - handles redirect from Facebook
 """
 from django.shortcuts import redirect
-from django.contrib.auth.decorators import login_required
-from django.utils.decorators import method_decorator
-from django.views.decorators.csrf import csrf_exempt
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework import status
 from django.utils import timezone
+from .async_views import AsyncAPIView
 from .models import FacebookIntegration
-from .facebook_service import FacebookGraphAPI
+from .facebook_service import AsyncFacebookGraphAPI
 import os
-import requests
 
 
-@method_decorator(csrf_exempt, name='dispatch')
-class FacebookOAuthCallbackView(APIView):
-    """Handle Facebook OAuth callback redirect"""
+class FacebookOAuthCallbackView(AsyncAPIView):
+    """Handle Facebook OAuth callback redirect; async, as it waits on two Graph calls"""
     
-    def get(self, request):
+    async def get(self, request):
         """Handle GET request from Facebook redirect"""
         code = request.GET.get('code')
         error = request.GET.get('error')
@@ -40,17 +33,7 @@ class FacebookOAuthCallbackView(APIView):
                 redirect_uri = request.build_absolute_uri('/api/facebook/callback/')
                 
                 # Exchange code for access token
-                token_url = "https://graph.facebook.com/v18.0/oauth/access_token"
-                token_params = {
-                    "client_id": app_id,
-                    "client_secret": app_secret,
-                    "redirect_uri": redirect_uri,
-                    "code": code
-                }
-                
-                token_response = requests.get(token_url, params=token_params)
-                token_response.raise_for_status()
-                token_data = token_response.json()
+                token_data = await AsyncFacebookGraphAPI.exchange_code(app_id, app_secret, redirect_uri, code)
                 
                 access_token = token_data.get("access_token")
                 expires_in = token_data.get("expires_in", 0)
@@ -59,11 +42,11 @@ class FacebookOAuthCallbackView(APIView):
                     return redirect('/dashboard/facebook/?error=no_token')
                 
                 # Get user info
-                api = FacebookGraphAPI(access_token)
-                user_info = api.get_user_info()
+                async with AsyncFacebookGraphAPI(access_token) as api:
+                    user_info = await api.get_user_info()
                 
                 # Create or update integration
-                FacebookIntegration.objects.update_or_create(
+                await FacebookIntegration.objects.aupdate_or_create(
                     user=request.user,
                     defaults={
                         "access_token": access_token,
@@ -80,6 +63,5 @@ class FacebookOAuthCallbackView(APIView):
                 return redirect(f'/dashboard/facebook/?error=processing_error&message={str(e)}')
         else:
             # Store code in session and redirect to login
-            request.session['facebook_oauth_code'] = code
+            await request.session.aset('facebook_oauth_code', code)
             return redirect('/login/?next=/dashboard/facebook/')
-
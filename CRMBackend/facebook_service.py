@@ -1,51 +1,106 @@
 """
 Facebook Graph API Service for CRM Integration
 """
+import asyncio
+import itertools
+import logging
+import httpx
 import requests
 import json
+import time
 from datetime import datetime, timedelta
+from django.conf import settings
 from django.utils import timezone
 from typing import Dict, List, Optional, Any
 from .models import FacebookIntegration, Account, Contact, Campaign, Lead, Deal, User
+from .metrics import SYNC_ROWS, THROTTLE_CODES, observe_graph_call
+from .graph_backends import GraphBackend, async_client, default_backend
+from .dedup import find_contact
+from .insights import refresh_insights
+
+logger = logging.getLogger("crm.facebook")
+
+
+def _graph_error_code(response) -> Optional[int]:
+    """Graph's error.code from a failed response, used to recognise rate limiting"""
+    if response is None or response.status_code < 400:
+        return None
+    try:
+        return response.json().get("error", {}).get("code")
+    except ValueError:
+        return None
+
+
+def _throttled(response) -> bool:
+    return response.status_code == 429 or _graph_error_code(response) in THROTTLE_CODES
+
+
+def _json_or_raise(endpoint: str, response) -> Dict:
+    """The body of a successful Graph response; an error response raises with Graph's message"""
+    if response.status_code < 400:
+        return response.json()
+    try:
+        message = response.json().get("error", {}).get("message")
+    except ValueError:
+        message = None
+    message = message or f"HTTP {response.status_code}"
+    logger.warning("Facebook API Error on %s: %s", endpoint, message)
+    raise Exception(f"Facebook API Error: {message}")
 
 
 class FacebookGraphAPI:
     """Service class for interacting with Facebook Graph API"""
     
-    BASE_URL = "https://graph.facebook.com/v18.0"
+    BASE_URL = GraphBackend.BASE_URL
+    # Items per page requested from list edges; Graph defaults to 25
+    PAGE_LIMIT = 100
     
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, backend: Optional[GraphBackend] = None):
         self.access_token = access_token
+        self.backend = backend or default_backend()
         self.headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
     
     def _make_request(self, endpoint: str, method: str = "GET", params: Optional[Dict] = None, data: Optional[Dict] = None) -> Dict:
-        """Make a request to Facebook Graph API"""
-        url = f"{self.BASE_URL}/{endpoint}"
+        """Make a request to Facebook Graph API, retrying with backoff when rate limited"""
         request_params = {"access_token": self.access_token}
         if params:
             request_params.update(params)
         
-        try:
-            if method == "GET":
-                response = requests.get(url, params=request_params, headers=self.headers)
-            elif method == "POST":
-                response = requests.post(url, params=request_params, json=data, headers=self.headers)
-            elif method == "DELETE":
-                response = requests.delete(url, params=request_params, headers=self.headers)
-            else:
-                response = requests.request(method, url, params=request_params, json=data, headers=self.headers)
-            
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Facebook API Error: {str(e)}")
-            if hasattr(e.response, 'json'):
-                error_data = e.response.json()
-                raise Exception(f"Facebook API Error: {error_data.get('error', {}).get('message', str(e))}")
-            raise
+        for attempt in itertools.count():
+            started = time.perf_counter()
+            response = None
+            try:
+                response = self.backend.send(method, endpoint, request_params, data, self.headers)
+                if _throttled(response) and attempt < settings.FACEBOOK_GRAPH_MAX_RETRIES:
+                    time.sleep(settings.FACEBOOK_GRAPH_RETRY_BACKOFF * 2 ** attempt)
+                    continue
+                return _json_or_raise(endpoint, response)
+            except requests.exceptions.RequestException as e:
+                logger.warning("Facebook API request to %s failed: %s", endpoint, e)
+                raise
+            finally:
+                observe_graph_call(
+                    endpoint,
+                    time.perf_counter() - started,
+                    response.status_code if response is not None else None,
+                    _graph_error_code(response),
+                )
+    
+    def _get_all(self, endpoint: str, params: Dict) -> List[Dict]:
+        """Every item of a list edge, following the paging cursors"""
+        items = []
+        page_params = {**params, "limit": self.PAGE_LIMIT}
+        while True:
+            response = self._make_request(endpoint, params=page_params)
+            items.extend(response.get("data", []))
+            paging = response.get("paging", {})
+            after = paging.get("cursors", {}).get("after")
+            if not paging.get("next") or not after:
+                return items
+            page_params = {**page_params, "after": after}
     
     def get_user_info(self) -> Dict:
         """Get authenticated user information"""
@@ -53,45 +108,30 @@ class FacebookGraphAPI:
     
     def get_pages(self) -> List[Dict]:
         """Get Facebook Pages managed by the user"""
-        response = self._make_request("me/accounts", params={"fields": "id,name,access_token,category"})
-        return response.get("data", [])
+        return self._get_all("me/accounts", {"fields": "id,name,access_token,category"})
     
     def get_ad_accounts(self) -> List[Dict]:
         """Get Facebook Ad Accounts"""
-        response = self._make_request("me/adaccounts", params={"fields": "id,name,account_id,currency"})
-        return response.get("data", [])
+        return self._get_all("me/adaccounts", {"fields": "id,name,account_id,currency"})
     
     def get_campaigns(self, ad_account_id: str) -> List[Dict]:
         """Get Facebook Ad Campaigns"""
-        response = self._make_request(
+        return self._get_all(
             f"{ad_account_id}/campaigns",
-            params={"fields": "id,name,status,objective,start_time,end_time,daily_budget,lifetime_budget"}
+            {"fields": "id,name,status,objective,start_time,end_time,daily_budget,lifetime_budget"}
         )
-        return response.get("data", [])
     
     def get_ads(self, campaign_id: str) -> List[Dict]:
         """Get Ads in a campaign"""
-        response = self._make_request(
-            f"{campaign_id}/ads",
-            params={"fields": "id,name,status,creative"}
-        )
-        return response.get("data", [])
+        return self._get_all(f"{campaign_id}/ads", {"fields": "id,name,status,creative"})
     
     def get_lead_forms(self, page_id: str) -> List[Dict]:
         """Get Lead Forms for a page"""
-        response = self._make_request(
-            f"{page_id}/leadgen_forms",
-            params={"fields": "id,name,status,leads_count"}
-        )
-        return response.get("data", [])
+        return self._get_all(f"{page_id}/leadgen_forms", {"fields": "id,name,status,leads_count"})
     
     def get_leads(self, lead_form_id: str) -> List[Dict]:
         """Get leads from a lead form"""
-        response = self._make_request(
-            f"{lead_form_id}/leads",
-            params={"fields": "id,created_time,field_data"}
-        )
-        return response.get("data", [])
+        return self._get_all(f"{lead_form_id}/leads", {"fields": "id,created_time,field_data"})
     
     def get_page_insights(self, page_id: str, since: str = None, until: str = None) -> Dict:
         """Get page insights"""
@@ -105,6 +145,134 @@ class FacebookGraphAPI:
             params["until"] = until
         
         return self._make_request(f"{page_id}/insights", params=params)
+    
+    def get_campaign_insights(self, campaign_id: str, since: str, until: str) -> List[Dict]:
+        """Get one row of ad insights per day of since..until (inclusive) for a campaign"""
+        return self._get_all(
+            f"{campaign_id}/insights",
+            {
+                "fields": "spend,impressions,clicks,reach,actions",
+                "time_increment": 1,
+                "time_range": json.dumps({"since": since, "until": until}),
+            }
+        )
+
+
+class AsyncFacebookGraphAPI:
+    """
+    Async counterpart of FacebookGraphAPI for the ASGI views, sending
+    through the same backend (so replay works) with the same retries on
+    throttling. Used as `async with AsyncFacebookGraphAPI(token) as api:`
+    its calls share one connection pool, closed on exit; otherwise each
+    call opens and closes its own.
+    """
+
+    BASE_URL = FacebookGraphAPI.BASE_URL
+    PAGE_LIMIT = FacebookGraphAPI.PAGE_LIMIT
+    # Graph allows a handful of parallel calls per token before throttling
+    MAX_CONCURRENCY = 5
+
+    def __init__(self, access_token: Optional[str], backend: Optional[GraphBackend] = None):
+        self.access_token = access_token
+        self.backend = backend or default_backend()
+        self.client = None
+        self.headers = {"Content-Type": "application/json"}
+        if access_token:
+            self.headers["Authorization"] = f"Bearer {access_token}"
+
+    async def __aenter__(self):
+        self.client = async_client()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        client, self.client = self.client, None
+        await client.aclose()
+
+    async def _make_request(self, endpoint: str, method: str = "GET", params: Optional[Dict] = None, data: Optional[Dict] = None) -> Dict:
+        """Make a request to Facebook Graph API, retrying with backoff when rate limited"""
+        request_params = {"access_token": self.access_token} if self.access_token else {}
+        if params:
+            request_params.update(params)
+
+        for attempt in itertools.count():
+            started = time.perf_counter()
+            response = None
+            try:
+                response = await self.backend.asend(
+                    method, endpoint, request_params, data, self.headers, client=self.client
+                )
+                if _throttled(response) and attempt < settings.FACEBOOK_GRAPH_MAX_RETRIES:
+                    await asyncio.sleep(settings.FACEBOOK_GRAPH_RETRY_BACKOFF * 2 ** attempt)
+                    continue
+                return _json_or_raise(endpoint, response)
+            except (httpx.HTTPError, requests.exceptions.RequestException) as e:
+                logger.warning("Facebook API request to %s failed: %s", endpoint, e)
+                raise
+            finally:
+                observe_graph_call(
+                    endpoint,
+                    time.perf_counter() - started,
+                    response.status_code if response is not None else None,
+                    _graph_error_code(response),
+                )
+
+    async def _get_all(self, endpoint: str, params: Dict) -> List[Dict]:
+        """Every item of a list edge, following the paging cursors"""
+        items = []
+        page_params = {**params, "limit": self.PAGE_LIMIT}
+        while True:
+            response = await self._make_request(endpoint, params=page_params)
+            items.extend(response.get("data", []))
+            paging = response.get("paging", {})
+            after = paging.get("cursors", {}).get("after")
+            if not paging.get("next") or not after:
+                return items
+            page_params = {**page_params, "after": after}
+
+    async def get_user_info(self) -> Dict:
+        """Get authenticated user information"""
+        return await self._make_request("me", params={"fields": "id,name,email"})
+
+    async def get_pages(self) -> List[Dict]:
+        """Get Facebook Pages managed by the user"""
+        return await self._get_all("me/accounts", {"fields": "id,name,access_token,category"})
+
+    async def get_ad_accounts(self) -> List[Dict]:
+        """Get Facebook Ad Accounts"""
+        return await self._get_all("me/adaccounts", {"fields": "id,name,account_id,currency"})
+
+    async def get_lead_forms(self, page_id: str) -> List[Dict]:
+        """Get Lead Forms for a page"""
+        return await self._get_all(f"{page_id}/leadgen_forms", {"fields": "id,name,status,leads_count"})
+
+    async def get_leads(self, lead_form_id: str) -> List[Dict]:
+        """Get leads from a lead form"""
+        return await self._get_all(f"{lead_form_id}/leads", {"fields": "id,created_time,field_data"})
+
+    async def get_page_leads(self, page_id: str) -> List[Dict]:
+        """Get the leads of every lead form of a page, fetching forms concurrently"""
+        lead_forms = await self.get_lead_forms(page_id)
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENCY)
+
+        async def form_leads(form):
+            async with semaphore:
+                return await self.get_leads(form["id"])
+
+        results = await asyncio.gather(*(form_leads(form) for form in lead_forms))
+        return [lead for leads in results for lead in leads]
+
+    @classmethod
+    async def exchange_code(cls, app_id: str, app_secret: str, redirect_uri: str, code: str) -> Dict:
+        """Exchange an OAuth code for a user access token"""
+        return await cls(None)._make_request(
+            "oauth/access_token",
+            params={
+                "client_id": app_id,
+                "client_secret": app_secret,
+                "redirect_uri": redirect_uri,
+                "code": code
+            },
+        )
 
 
 class FacebookSyncService:
@@ -133,6 +301,7 @@ class FacebookSyncService:
                 account.name = page_data.get("name", account.name)
                 account.facebook_synced_at = timezone.now()
                 account.save()
+            SYNC_ROWS.labels("accounts", "created" if created else "updated").inc()
             
             synced_accounts.append(account)
         
@@ -178,6 +347,7 @@ class FacebookSyncService:
                 campaign.end_date = end_date
                 campaign.facebook_synced_at = timezone.now()
                 campaign.save()
+            SYNC_ROWS.labels("campaigns", "created" if created else "updated").inc()
             
             synced_campaigns.append(campaign)
         
@@ -206,17 +376,20 @@ class FacebookSyncService:
                         first_name = lead_info.get("first_name", lead_info.get("full_name", "").split()[0] if lead_info.get("full_name") else "")
                         last_name = lead_info.get("last_name", " ".join(lead_info.get("full_name", "").split()[1:]) if len(lead_info.get("full_name", "").split()) > 1 else "")
                         
-                        contact, _ = Contact.objects.get_or_create(
-                            email=lead_info.get("email"),
-                            account=account,
-                            defaults={
-                                "first_name": first_name,
-                                "last_name": last_name,
-                                "phone": lead_info.get("phone_number", ""),
-                                "facebook_user_id": lead_data.get("id", ""),
-                                "facebook_synced_at": timezone.now()
-                            }
-                        )
+                        # Match on the normalized email, then phone, so case and formatting differences
+                        # do not create duplicates
+                        contact = find_contact(account, lead_info.get("email"), lead_info.get("phone_number"))
+                        if contact is None:
+                            contact = Contact.objects.create(
+                                email=lead_info.get("email"),
+                                account=account,
+                                first_name=first_name,
+                                last_name=last_name,
+                                phone=lead_info.get("phone_number", ""),
+                                facebook_user_id=lead_data.get("id", ""),
+                                facebook_synced_at=timezone.now()
+                            )
+                            SYNC_ROWS.labels("contacts", "created").inc()
                 
                 # Create lead
                 created_time = datetime.fromisoformat(lead_data.get("created_time", "").replace("Z", "+00:00")) if lead_data.get("created_time") else timezone.now()
@@ -235,6 +408,7 @@ class FacebookSyncService:
                         "created_at": created_time
                     }
                 )
+                SYNC_ROWS.labels("leads", "created" if created else "unchanged").inc()
                 
                 synced_leads.append(lead)
         
@@ -245,7 +419,8 @@ class FacebookSyncService:
         results = {
             "accounts": [],
             "campaigns": [],
-            "leads": []
+            "leads": [],
+            "insights": {"objects": 0, "rows": 0, "errors": 0}
         }
         
         try:
@@ -267,12 +442,15 @@ class FacebookSyncService:
             if self.integration.facebook_page_id:
                 results["leads"] = self.sync_leads_from_facebook(self.integration.facebook_page_id, user)
             
+            # Sync the new days of page and ad insights of what was synced above
+            results["insights"] = refresh_insights(self.api, results["accounts"], results["campaigns"])
+            
             # Update integration
             self.integration.last_synced_at = timezone.now()
             self.integration.save()
             
-        except Exception as e:
-            print(f"Sync error: {str(e)}")
+        except Exception:
+            logger.exception("Facebook sync of integration %s failed", self.integration.pk)
             raise
         
         return results
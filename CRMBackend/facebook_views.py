@@ -8,7 +8,8 @@ from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
 from django.conf import settings
 from .models import FacebookIntegration, User
-from .facebook_service import FacebookGraphAPI, FacebookSyncService
+from .async_views import AsyncAPIView, json_response
+from .facebook_service import AsyncFacebookGraphAPI, FacebookGraphAPI, FacebookSyncService
 from .serializers import FacebookIntegrationSerializer
 import os
 
@@ -53,7 +54,8 @@ class FacebookIntegrationViewSet(viewsets.ModelViewSet):
                 "results": {
                     "accounts_synced": len(results["accounts"]),
                     "campaigns_synced": len(results["campaigns"]),
-                    "leads_synced": len(results["leads"])
+                    "leads_synced": len(results["leads"]),
+                    "insight_rows_synced": results["insights"]["rows"]
                 }
             })
         except Exception as e:
@@ -62,36 +64,6 @@ class FacebookIntegrationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
-    @action(detail=True, methods=['get'])
-    def pages(self, request, pk=None):
-        """Get Facebook Pages"""
-        integration = self.get_object()
-        
-        try:
-            api = FacebookGraphAPI(integration.access_token)
-            pages = api.get_pages()
-            return Response({"pages": pages})
-        except Exception as e:
-            return Response(
-                {"error": str(e)},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-    
-    @action(detail=True, methods=['get'])
-    def ad_accounts(self, request, pk=None):
-        """Get Facebook Ad Accounts"""
-        integration = self.get_object()
-        
-        try:
-            api = FacebookGraphAPI(integration.access_token)
-            ad_accounts = api.get_ad_accounts()
-            return Response({"ad_accounts": ad_accounts})
-        except Exception as e:
-            return Response(
-                {"error": str(e)},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-    
     @action(detail=True, methods=['get'])
     def campaigns(self, request, pk=None):
         """Get Facebook Ad Campaigns"""
@@ -114,37 +86,6 @@ class FacebookIntegrationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
-    @action(detail=True, methods=['get'])
-    def leads(self, request, pk=None):
-        """Get Facebook Leads"""
-        integration = self.get_object()
-        page_id = request.query_params.get('page_id')
-        
-        if not page_id:
-            page_id = integration.facebook_page_id
-        
-        if not page_id:
-            return Response(
-                {"error": "page_id is required"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        try:
-            api = FacebookGraphAPI(integration.access_token)
-            lead_forms = api.get_lead_forms(page_id)
-            
-            all_leads = []
-            for form in lead_forms:
-                leads = api.get_leads(form["id"])
-                all_leads.extend(leads)
-            
-            return Response({"leads": all_leads})
-        except Exception as e:
-            return Response(
-                {"error": str(e)},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-    
     @action(detail=True, methods=['post'])
     def disconnect(self, request, pk=None):
         """Disconnect Facebook integration"""
@@ -154,3 +95,54 @@ class FacebookIntegrationViewSet(viewsets.ModelViewSet):
         
         return Response({"message": "Facebook integration disconnected"})
 
+
+class FacebookIntegrationGraphView(AsyncAPIView):
+    """
+    Base for the integration endpoints that only relay Graph API calls
+    (pages, ad_accounts, leads). They are async so a worker keeps serving
+    other requests while Graph answers.
+    """
+
+    async def get(self, request, pk=None):
+        integration = await FacebookIntegration.objects.filter(pk=pk, user=request.user, is_active=True).afirst()
+        if integration is None:
+            return json_response({"detail": "No FacebookIntegration matches the given query."},
+                                 status_code=status.HTTP_404_NOT_FOUND)
+        try:
+            async with AsyncFacebookGraphAPI(integration.access_token) as api:
+                return await self.graph(request, integration, api)
+        except Exception as e:
+            return json_response(
+                {"error": str(e)},
+                status_code=status.HTTP_400_BAD_REQUEST
+            )
+
+    async def graph(self, request, integration, api):
+        raise NotImplementedError
+
+
+class FacebookPagesView(FacebookIntegrationGraphView):
+    """Get Facebook Pages"""
+
+    async def graph(self, request, integration, api):
+        return json_response({"pages": await api.get_pages()})
+
+
+class FacebookAdAccountsView(FacebookIntegrationGraphView):
+    """Get Facebook Ad Accounts"""
+
+    async def graph(self, request, integration, api):
+        return json_response({"ad_accounts": await api.get_ad_accounts()})
+
+
+class FacebookLeadsView(FacebookIntegrationGraphView):
+    """Get Facebook Leads of every lead form of a page; the forms are fetched concurrently"""
+
+    async def graph(self, request, integration, api):
+        page_id = request.GET.get('page_id') or integration.facebook_page_id
+        if not page_id:
+            return json_response(
+                {"error": "page_id is required"},
+                status_code=status.HTTP_400_BAD_REQUEST
+            )
+        return json_response({"leads": await api.get_page_leads(page_id)})
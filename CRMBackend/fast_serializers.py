@@ -0,0 +1,163 @@
+"""
+Fast read path for list actions: builds the same output as the DRF
+ModelSerializers straight from values_list() rows.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.http import HttpResponse
+from rest_framework import ISO_8601, fields as drf_fields, relations
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib renderer is used instead
+    orjson = None
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+    field_timezone = field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    if field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+
+    return convert
+
+
+def _date_converter(field):
+    output_format = getattr(field, "format", api_settings.DATE_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+    return lambda value: value.isoformat()
+
+
+def _choice_converter(field):
+    if all(isinstance(key, str) for key in field.choices):
+        return str
+    return field.to_representation
+
+
+def _identity(value):
+    return value
+
+
+def compile_converter(field):
+    """
+    Return a callable equivalent to field.to_representation for a raw column
+    value, or None when the field cannot be read from a single column.
+    """
+    if isinstance(field, (relations.ManyRelatedField, drf_fields.SerializerMethodField)):
+        return None
+    if isinstance(field, relations.PrimaryKeyRelatedField):
+        return _identity if field.pk_field is None else None
+    if isinstance(field, (relations.RelatedField, drf_fields.HiddenField)) or hasattr(field, "fields"):
+        return None
+    if isinstance(field, drf_fields.DateTimeField):
+        return _datetime_converter(field)
+    if isinstance(field, drf_fields.DateField):
+        return _date_converter(field)
+    if isinstance(field, drf_fields.ChoiceField):
+        return _choice_converter(field)
+    if isinstance(field, drf_fields.BooleanField):
+        return bool
+    if isinstance(field, drf_fields.IntegerField):
+        return int
+    if isinstance(field, drf_fields.CharField):
+        return str
+    return field.to_representation
+
+
+class RowPlan:
+    """Column list plus per-field converters compiled from one serializer."""
+
+    def __init__(self, names, attnames, converters):
+        self.names = names
+        self.attnames = attnames
+        self.converters = converters
+
+    def convert(self, rows):
+        plan = tuple(zip(self.names, self.converters))
+        return [
+            {name: None if value is None else convert(value) for (name, convert), value in zip(plan, row)}
+            for row in rows
+        ]
+
+
+def compile_row_plan(serializer):
+    """Build a RowPlan for a ModelSerializer, or None if any field is unsupported."""
+    model = serializer.Meta.model
+    names, attnames, converters = [], [], []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if len(field.source_attrs) != 1:
+            return None
+        try:
+            model_field = model._meta.get_field(field.source_attrs[0])
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete or model_field.many_to_many:
+            return None
+        converter = compile_converter(field)
+        if converter is None:
+            return None
+        names.append(name)
+        attnames.append(model_field.attname)
+        converters.append(converter)
+    return RowPlan(names, attnames, converters)
+
+
+def render_json(data, renderer, accepted_media_type, renderer_context):
+    """
+    Render with orjson when available. The fast path only produces str, int,
+    bool, None, lists and dicts, for which orjson's compact UTF-8 output is
+    the same as JSONRenderer's, apart from the \\u2028/\\u2029 escaping.
+    """
+    if orjson is None or not (renderer.compact and not renderer.ensure_ascii):
+        return renderer.render(data, accepted_media_type, renderer_context)
+    content = orjson.dumps(data)
+    if b"\xe2\x80\xa8" in content or b"\xe2\x80\xa9" in content:
+        content = content.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+    return content
+
+
+class FastListMixin:
+    """
+    Serves list actions from values_list() rows through a RowPlan instead of
+    instantiating a model and walking every serializer field per row. Falls
+    back to the regular list() for the browsable API, indented output and
+    serializers with fields the plan cannot express (e.g. many-to-many).
+    """
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        accepted_media_type = request.accepted_media_type
+        renderer_context = self.get_renderer_context()
+        if (
+            not settings.CRM_FAST_LIST_SERIALIZATION
+            or type(renderer) is not JSONRenderer
+            or renderer.get_indent(accepted_media_type, renderer_context) is not None
+        ):
+            return super().list(request, *args, **kwargs)
+        plan = compile_row_plan(self.get_serializer())
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*plan.attnames)
+        page = self.paginate_queryset(queryset)
+        rows = plan.convert(page if page is not None else queryset)
+        data = self.get_paginated_response(rows).data if page is not None else rows
+        return HttpResponse(
+            render_json(data, renderer, accepted_media_type, renderer_context),
+            content_type=renderer.media_type,
+        )
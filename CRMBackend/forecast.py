@@ -0,0 +1,228 @@
+"""
+Revenue forecast: stage-weighted deal value per close month, computed in the database
+"""
+import hashlib
+import time
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import TruncMonth
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .cache import request_scope
+from .db_router import cache_timeout
+from .metrics import CACHE_LOOKUPS
+from .models import Deal
+from .permissions import scope_queryset
+
+STAGES = [stage for stage, _ in Deal.STAGE]
+CLOSED_STAGES = ("WON", "LOST")
+
+# ?group_by= -> (key column, label column)
+GROUPINGS = {
+    "owner": ("owner", "owner__email"),
+    "region": ("account__region", None),
+    "campaign": ("campaign", "campaign__name"),
+}
+
+
+def parse_probabilities(value: str) -> Dict[str, float]:
+    """'PROSPECT:0.1,PROPOSAL:0.5' -> {stage: probability}; unknown stages or values outside 0..1 raise ValueError."""
+    probabilities = {}
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        stage, _, probability = part.partition(":")
+        stage = stage.strip().upper()
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage {stage!r}")
+        probabilities[stage] = float(probability)
+        if not 0 <= probabilities[stage] <= 1:
+            raise ValueError(f"Probability of {stage} must be between 0 and 1")
+    return probabilities
+
+
+def parse_month(value: str) -> date:
+    year, _, month = value.partition("-")
+    return date(int(year), int(month), 1)
+
+
+def _month(value) -> Optional[str]:
+    return value.strftime("%Y-%m") if value else None
+
+
+def forecast_rows(deals, group_by: Optional[str], probabilities: Dict[str, float]) -> List[Dict]:
+    """
+    One grouped query: per close month (and group), the deal count, open
+    pipeline, won value and stage-weighted expected value.
+    """
+    columns = list(filter(None, GROUPINGS[group_by])) if group_by else []
+    weighted = Sum(
+        Case(
+            *[When(stage=stage, then=F("amount") * Value(Decimal(str(p)))) for stage, p in probabilities.items()],
+            default=Value(Decimal(0)),
+            output_field=DecimalField(max_digits=20, decimal_places=4),
+        )
+    )
+    rows = (
+        deals.exclude(close_date=None)
+        .annotate(month=TruncMonth("close_date"))
+        .order_by()
+        .values("month", *columns)
+        .annotate(
+            deals=Count("id"),
+            pipeline=Sum("amount", filter=~Q(stage__in=CLOSED_STAGES)),
+            won=Sum("amount", filter=Q(stage="WON")),
+            expected=weighted,
+        )
+    )
+    return [_row(group_by, row) for row in rows]
+
+
+def _row(group_by, row) -> Dict:
+    result = {"month": _month(row["month"])}
+    if group_by:
+        key, label = GROUPINGS[group_by]
+        result[group_by] = row[key]
+        if label:
+            result["label"] = row[label]
+    result.update({
+        "deals": row["deals"],
+        "pipeline": round(float(row["pipeline"] or 0), 2),
+        "won": round(float(row["won"] or 0), 2),
+        "expected": round(float(row["expected"] or 0), 2),
+    })
+    return result
+
+
+def snapshot_rows(deals, group_by: Optional[str]) -> List[Dict]:
+    """Per close month, group and stage: deal count and value. Weighting is left to weigh_snapshot()."""
+    columns = list(filter(None, GROUPINGS[group_by])) if group_by else []
+    return [
+        {**row, "month": _month(row["month"]), "amount": row["amount"] or Decimal(0)}
+        for row in deals.exclude(close_date=None)
+        .annotate(month=TruncMonth("close_date"))
+        .order_by()
+        .values("month", "stage", *columns)
+        .annotate(deals=Count("id"), amount=Sum("amount"))
+    ]
+
+
+def weigh_snapshot(rows: List[Dict], group_by: Optional[str], probabilities: Dict[str, float]) -> List[Dict]:
+    """forecast_rows() output from a snapshot, for any probabilities, without touching the database."""
+    key = GROUPINGS[group_by][0] if group_by else None
+    weights = {stage: Decimal(str(p)) for stage, p in probabilities.items()}
+    merged = {}
+    for row in rows:
+        group = (row["month"], row[key] if key else None)
+        total = merged.get(group)
+        if total is None:
+            total = merged[group] = {"month": row["month"], "deals": 0, "pipeline": Decimal(0), "won": Decimal(0),
+                                     "expected": Decimal(0)}
+            if group_by:
+                total[group_by] = row[key]
+                label = GROUPINGS[group_by][1]
+                if label:
+                    total["label"] = row[label]
+        total["deals"] += row["deals"]
+        if row["stage"] not in CLOSED_STAGES:
+            total["pipeline"] += row["amount"]
+        if row["stage"] == "WON":
+            total["won"] += row["amount"]
+        total["expected"] += row["amount"] * weights.get(row["stage"], 0)
+    for total in merged.values():
+        for field in ("pipeline", "won", "expected"):
+            total[field] = round(float(total[field]), 2)
+    return list(merged.values())
+
+
+def cached_snapshot(request, deals, group_by: Optional[str]):
+    """
+    (rows, built at) of the snapshot for the user's scope and grouping,
+    rebuilt at most every CRM_FORECAST_SNAPSHOT_SECONDS. Writes do not
+    invalidate it: it trades that staleness for a cache read per request.
+    """
+    digest = hashlib.md5(f"{request_scope(request.user)}|{group_by}".encode(), usedforsecurity=False).hexdigest()
+    key = f"crm:forecast:{digest}"
+    hit = cache.get(key)
+    if hit is not None:
+        CACHE_LOOKUPS.labels("forecast", "hit").inc()
+        return hit
+    CACHE_LOOKUPS.labels("forecast", "miss").inc()
+    snapshot = (snapshot_rows(deals, group_by), time.time())
+    cache.set(key, snapshot, cache_timeout(settings.CRM_FORECAST_SNAPSHOT_SECONDS))
+    return snapshot
+
+
+class ForecastView(APIView):
+    """
+    Stage-weighted expected revenue per month of Deal.close_date.
+
+    ?group_by=owner|region|campaign splits each month; ?from=YYYY-MM and
+    ?to=YYYY-MM bound the months (default: all); ?probabilities=STAGE:p,...
+    overrides CRM_FORECAST_STAGE_PROBABILITIES for the stages given. Deals
+    are scoped like the deal list. ?snapshot=1 answers from a per-scope
+    aggregate cached for CRM_FORECAST_SNAPSHOT_SECONDS instead of querying,
+    for large books of business where a few minutes of lag is acceptable.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        group_by = params.get("group_by") or None
+        if group_by is not None and group_by not in GROUPINGS:
+            return Response({"detail": f"group_by must be one of {', '.join(GROUPINGS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            probabilities = {**settings.CRM_FORECAST_STAGE_PROBABILITIES,
+                             **parse_probabilities(params.get("probabilities", ""))}
+        except ValueError as exc:
+            return Response({"detail": f"probabilities: {exc}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start = parse_month(params["from"]) if params.get("from") else None
+            end = parse_month(params["to"]) if params.get("to") else None
+        except ValueError:
+            return Response({"detail": "from and to must be YYYY-MM"}, status=status.HTTP_400_BAD_REQUEST)
+
+        deals = scope_queryset(Deal.objects.all(), request.user)
+        snapshot_at = None
+        if params.get("snapshot") in ("1", "true", "True"):
+            snapshot, built_at = cached_snapshot(request, deals, group_by)
+            rows = weigh_snapshot(snapshot, group_by, probabilities)
+            snapshot_at = datetime.fromtimestamp(built_at, tz=timezone.utc)
+        else:
+            if start:
+                deals = deals.filter(close_date__gte=start)
+            if end:
+                deals = deals.filter(close_date__lt=date(end.year + end.month // 12, end.month % 12 + 1, 1))
+            rows = forecast_rows(deals, group_by, probabilities)
+        rows = [
+            row for row in rows
+            if (start is None or row["month"] >= _month(start)) and (end is None or row["month"] <= _month(end))
+        ]
+        rows.sort(key=lambda row: (row["month"], str(row.get(group_by)) if group_by else ""))
+
+        months = {}
+        for row in rows:
+            month = months.setdefault(row["month"], {"month": row["month"], "deals": 0, "pipeline": 0.0,
+                                                     "won": 0.0, "expected": 0.0})
+            for field in ("deals", "pipeline", "won", "expected"):
+                month[field] += row[field]
+        totals = {field: sum(month[field] for month in months.values())
+                  for field in ("deals", "pipeline", "won", "expected")}
+        for summary in (*months.values(), totals):
+            for field in ("pipeline", "won", "expected"):
+                summary[field] = round(summary[field], 2)
+        return Response({
+            "group_by": group_by,
+            "probabilities": probabilities,
+            "snapshot_at": snapshot_at,
+            "months": list(months.values()),
+            "rows": rows if group_by else [],
+            "totals": totals,
+        })
@@ -0,0 +1,322 @@
+"""
+Transports for FacebookGraphAPI: live HTTP, recording to fixture files, and offline replay
+"""
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import timedelta
+from functools import lru_cache
+from http import HTTPStatus
+from typing import Dict, List, Optional
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+# Parameters that select a page rather than the data, and the credential
+PAGING_PARAMS = {"limit", "after", "before"}
+SECRET_FIELDS = {"access_token", "client_secret"}
+
+
+def _params_key(params: Optional[Dict]) -> str:
+    return json.dumps(
+        {k: v for k, v in sorted((params or {}).items()) if k not in PAGING_PARAMS and k not in SECRET_FIELDS}
+    )
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {k: "REDACTED" if k in SECRET_FIELDS else _redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+def fixture_path(directory: str, method: str, endpoint: str, params: Optional[Dict]) -> str:
+    """One file per method, endpoint and parameters, e.g. GET-123__leads-3f2a9c1e.json."""
+    digest = hashlib.sha1(
+        json.dumps({k: v for k, v in sorted((params or {}).items()) if k not in SECRET_FIELDS}).encode()
+    ).hexdigest()[:8]
+    return os.path.join(directory, f"{method}-{endpoint.replace('/', '__')}-{digest}.json")
+
+
+def make_response(status: int, body: Dict, url: str) -> requests.Response:
+    """A requests.Response carrying body, as if it came from the network."""
+    response = requests.Response()
+    response.status_code = status
+    response.reason = HTTPStatus(status).phrase
+    response._content = json.dumps(body).encode()
+    response.encoding = "utf-8"
+    response.headers["Content-Type"] = "application/json"
+    response.url = url
+    return response
+
+
+class GraphBackend:
+    """Sends one Graph API call and returns the requests.Response."""
+
+    BASE_URL = "https://graph.facebook.com/v18.0"
+
+    def send(self, method: str, endpoint: str, params: Dict, data: Optional[Dict], headers: Dict) -> requests.Response:
+        raise NotImplementedError
+
+    async def asend(self, method: str, endpoint: str, params: Dict, data: Optional[Dict], headers: Dict,
+                    client: Optional[httpx.AsyncClient] = None):
+        """send() for async callers, run in a worker thread; the response has status_code and json()."""
+        return await sync_to_async(self.send, thread_sensitive=False)(method, endpoint, params, data, headers)
+
+
+def async_client() -> httpx.AsyncClient:
+    """A new httpx client for async callers; close it (async with) when done."""
+    return httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=5.0))
+
+
+class HTTPBackend(GraphBackend):
+    """graph.facebook.com over a pooled requests session, or an httpx client for async callers."""
+
+    def __init__(self):
+        self.session = requests.Session()
+
+    def send(self, method, endpoint, params, data, headers):
+        return self.session.request(
+            method, f"{self.BASE_URL}/{endpoint}", params=params, json=data, headers=headers, timeout=30
+        )
+
+    async def asend(self, method, endpoint, params, data, headers, client=None):
+        url = f"{self.BASE_URL}/{endpoint}"
+        if client is not None:
+            return await client.request(method, url, params=params, json=data, headers=headers)
+        async with async_client() as client:
+            return await client.request(method, url, params=params, json=data, headers=headers)
+
+
+class RecordingBackend(HTTPBackend):
+    """
+    Talks to graph.facebook.com and writes every response to a JSON fixture
+    in directory, with access tokens and secrets redacted, for ReplayBackend.
+    """
+
+    # Async calls go through send() too, so they are recorded
+    asend = GraphBackend.asend
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, method, endpoint, params, data, headers):
+        response = super().send(method, endpoint, params, data, headers)
+        try:
+            body = response.json()
+        except ValueError:
+            return response
+        fixture = {
+            "method": method,
+            "endpoint": endpoint,
+            "params": _redact(params),
+            "status": response.status_code,
+            "body": _redact(body),
+        }
+        with open(fixture_path(self.directory, method, endpoint, params), "w") as fh:
+            json.dump(fixture, fh)
+        return response
+
+
+class ReplayBackend(GraphBackend):
+    """
+    Serves Graph responses from fixtures without network access. Recorded
+    pages of one edge are joined back into a single list and served again
+    in pages of the request's limit, at most page_size, with Graph-style
+    paging cursors. latency (seconds) is slept on every call, and
+    throttle_rate is the share of calls answered with Graph's rate limit
+    error (code 17) instead of data.
+    """
+
+    def __init__(self, directory: str, latency: float = 0.0, page_size: int = 100, throttle_rate: float = 0.0,
+                 seed: int = 0):
+        self.directory = directory
+        self.latency = latency
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.throttled = 0
+        self.fixtures = self._load(directory)
+
+    @staticmethod
+    def _load(directory: str) -> Dict:
+        groups = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(directory, name)) as fh:
+                fixture = json.load(fh)
+            key = (fixture["method"], fixture["endpoint"], _params_key(fixture["params"]))
+            groups.setdefault(key, []).append(fixture)
+        return {key: ReplayBackend._join_pages(pages) for key, pages in groups.items()}
+
+    @staticmethod
+    def _join_pages(pages: List[Dict]) -> Dict:
+        """Follow the recorded after cursors from the first page and concatenate their data."""
+        by_after = {page["params"].get("after"): page for page in pages}
+        first = by_after.get(None, pages[0])
+        if "data" not in first["body"]:
+            return first
+        data, page, seen = [], first, set()
+        while page is not None and id(page) not in seen:
+            seen.add(id(page))
+            data.extend(page["body"].get("data", []))
+            paging = page["body"].get("paging", {})
+            page = by_after.get(paging.get("cursors", {}).get("after")) if paging.get("next") else None
+        body = {k: v for k, v in first["body"].items() if k != "paging"}
+        return {**first, "body": {**body, "data": data}}
+
+    def _find(self, method: str, endpoint: str, params: Dict) -> Optional[Dict]:
+        fixture = self.fixtures.get((method, endpoint, _params_key(params)))
+        if fixture is None:
+            # Same edge asked for with other fields
+            fixture = next((f for (m, e, _), f in self.fixtures.items() if m == method and e == endpoint), None)
+        return fixture
+
+    def send(self, method, endpoint, params, data, headers):
+        self.calls += 1
+        url = f"{self.BASE_URL}/{endpoint}"
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttle_rate and self.random.random() < self.throttle_rate:
+            self.throttled += 1
+            return make_response(400, {"error": {
+                "message": "(#17) User request limit reached", "type": "OAuthException", "code": 17,
+            }}, url)
+        fixture = self._find(method, endpoint, params)
+        if fixture is None:
+            return make_response(400, {"error": {
+                "message": f"No fixture for {method} {endpoint}", "type": "GraphMethodException", "code": 100,
+            }}, url)
+        body = fixture["body"]
+        if fixture["status"] >= 400 or "data" not in body:
+            return make_response(fixture["status"], body, url)
+
+        offset = int(params.get("after") or 0)
+        limit = min(int(params.get("limit") or self.page_size), self.page_size)
+        items = body["data"]
+        page = {**body, "data": items[offset:offset + limit]}
+        if offset + limit < len(items):
+            page["paging"] = {
+                "cursors": {"before": str(offset), "after": str(offset + limit)},
+                "next": f"{url}?limit={limit}&after={offset + limit}",
+            }
+        return make_response(fixture["status"], page, url)
+
+
+def write_fixture(directory: str, endpoint: str, body: Dict, params: Optional[Dict] = None, method: str = "GET"):
+    os.makedirs(directory, exist_ok=True)
+    with open(fixture_path(directory, method, endpoint, params), "w") as fh:
+        json.dump({"method": method, "endpoint": endpoint, "params": params or {}, "status": 200, "body": body}, fh)
+
+
+def generate_fixtures(directory: str, pages: int = 1, forms: int = 5, leads: int = 1000, campaigns: int = 50,
+                      ad_accounts: int = 1, days: int = 90, seed: int = 0) -> Dict[str, int]:
+    """
+    Write synthetic fixtures for everything FacebookSyncService.sync_all
+    reads: pages, ad accounts and campaigns, for every page `forms` lead
+    forms sharing `leads` leads between them, and daily page and campaign
+    insights for the last `days` days.
+    """
+    rng = random.Random(seed)
+    created = time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime())
+    today = timezone.localdate()
+    insight_days = [today - timedelta(days=n) for n in range(days - 1, -1, -1)]
+    write_fixture(directory, "me", {"id": "100000000000001", "name": "Replay User", "email": "replay@example.com"})
+    page_ids = [str(200000000000000 + n) for n in range(pages)]
+    write_fixture(directory, "me/accounts", {"data": [
+        {"id": page_id, "name": f"Replay page {n}", "category": rng.choice(("EU", "US", "APAC")),
+         "access_token": "REDACTED"} for n, page_id in enumerate(page_ids)
+    ]})
+    account_ids = [str(300000000000000 + n) for n in range(ad_accounts)]
+    write_fixture(directory, "me/adaccounts", {"data": [
+        {"id": f"act_{account_id}", "account_id": account_id, "name": f"Replay ad account {n}", "currency": "USD"}
+        for n, account_id in enumerate(account_ids)
+    ]})
+    for account_id in account_ids:
+        campaign_ids = [f"{account_id}{n:06d}" for n in range(campaigns)]
+        write_fixture(directory, f"act_{account_id}/campaigns", {"data": [
+            {"id": campaign_id, "name": f"Replay campaign {n}", "status": "ACTIVE",
+             "objective": "LEAD_GENERATION", "start_time": created, "daily_budget": str(rng.randrange(1000, 100000))}
+            for n, campaign_id in enumerate(campaign_ids)
+        ]})
+        for campaign_id in campaign_ids:
+            data = []
+            for day in insight_days:
+                impressions = rng.randrange(500, 50000)
+                clicks = impressions * rng.randrange(5, 40) // 1000
+                data.append({
+                    "date_start": day.isoformat(), "date_stop": day.isoformat(),
+                    "spend": f"{rng.randrange(500, 50000) / 100:.2f}", "impressions": str(impressions),
+                    "clicks": str(clicks), "reach": str(impressions * rng.randrange(60, 95) // 100),
+                    "actions": [{"action_type": "link_click", "value": str(clicks)},
+                                {"action_type": "lead", "value": str(clicks * rng.randrange(0, 20) // 100)}],
+                })
+            write_fixture(directory, f"{campaign_id}/insights", {"data": data})
+    for page_id in page_ids:
+        # Each day's value is reported with the end of that day
+        fans = rng.randrange(1000, 100000)
+        metrics = {"page_fans": [], "page_engaged_users": [], "page_post_engagements": []}
+        for day in insight_days:
+            end_time = f"{(day + timedelta(days=1)).isoformat()}T07:00:00+0000"
+            fans += rng.randrange(-5, 50)
+            engaged = rng.randrange(10, 2000)
+            metrics["page_fans"].append({"value": fans, "end_time": end_time})
+            metrics["page_engaged_users"].append({"value": engaged, "end_time": end_time})
+            metrics["page_post_engagements"].append({"value": engaged * rng.randrange(1, 4), "end_time": end_time})
+        write_fixture(directory, f"{page_id}/insights", {"data": [
+            {"name": name, "period": "day", "values": values, "id": f"{page_id}/insights/{name}/day"}
+            for name, values in metrics.items()
+        ]})
+    lead_count = 0
+    for p, page_id in enumerate(page_ids):
+        form_ids = [f"{400000000000000 + p * 1000 + n}" for n in range(forms)]
+        write_fixture(directory, f"{page_id}/leadgen_forms", {"data": [
+            {"id": form_id, "name": f"Replay form {n}", "status": "ACTIVE", "leads_count": leads // forms}
+            for n, form_id in enumerate(form_ids)
+        ]})
+        for f, form_id in enumerate(form_ids):
+            count = leads // forms + (1 if f < leads % forms else 0)
+            data = []
+            for n in range(count):
+                lead_id = f"{form_id}{n:07d}"
+                data.append({"id": lead_id, "created_time": created, "field_data": [
+                    {"name": "full_name", "values": [f"Replay Lead {lead_id}"]},
+                    {"name": "email", "values": [f"lead{lead_id}@example.com"]},
+                    {"name": "phone_number", "values": [f"+1555{n:07d}"]},
+                ]})
+            write_fixture(directory, f"{form_id}/leads", {"data": data})
+            lead_count += count
+    return {"pages": pages, "ad_accounts": ad_accounts, "campaigns": campaigns * ad_accounts,
+            "forms": forms * pages, "leads": lead_count, "insight_days": days}
+
+
+@lru_cache(maxsize=None)
+def _backend(name: str, directory: str, latency: float, page_size: int, throttle_rate: float) -> GraphBackend:
+    if name == "record":
+        return RecordingBackend(directory)
+    if name == "replay":
+        return ReplayBackend(directory, latency=latency, page_size=page_size, throttle_rate=throttle_rate)
+    if name == "http":
+        return HTTPBackend()
+    raise ValueError(f"Unknown FACEBOOK_GRAPH_BACKEND {name!r}")
+
+
+def default_backend() -> GraphBackend:
+    """The backend chosen in settings, built once per process (replay fixtures are loaded once)."""
+    return _backend(
+        settings.FACEBOOK_GRAPH_BACKEND,
+        settings.FACEBOOK_GRAPH_FIXTURES,
+        settings.FACEBOOK_GRAPH_REPLAY_LATENCY_MS / 1000,
+        settings.FACEBOOK_GRAPH_REPLAY_PAGE_SIZE,
+        settings.FACEBOOK_GRAPH_REPLAY_THROTTLE_RATE,
+    )
@@ -0,0 +1,17 @@
+"""
+Password hashers with a work factor taken from settings
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher at CRM_PASSWORD_ITERATIONS. Stored hashes
+    with another iteration count still verify, and are re-hashed at the
+    configured count on the user's next successful login (must_update).
+    """
+
+    @property
+    def iterations(self):
+        return settings.CRM_PASSWORD_ITERATIONS
@@ -0,0 +1,349 @@
+"""
+Streaming bulk import of Accounts, Contacts and Leads from CSV / NDJSON
+"""
+import csv
+import io
+import json
+import os
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+
+from .cache import invalidate_model
+from .changes import record_changes
+from .matching import match_keys
+from .models import Account, Campaign, Contact, Lead, User
+from .permissions import IsSuperAdmin
+from .rollups import rows_created
+
+
+class ImportSpec:
+    """Columns accepted for one entity and how its foreign keys are resolved."""
+
+    def __init__(self, model, fields: Tuple[str, ...], relations: Dict[str, Tuple[type, str]]):
+        self.model = model
+        self.fields = fields
+        # column -> (related model, natural key field), e.g. "account" -> (Account, "name")
+        self.relations = relations
+
+
+IMPORT_SPECS = {
+    "accounts": ImportSpec(
+        Account,
+        fields=("name", "region"),
+        relations={"owner": (User, "email")},
+    ),
+    "contacts": ImportSpec(
+        Contact,
+        fields=("first_name", "last_name", "email", "phone", "position"),
+        relations={"account": (Account, "name")},
+    ),
+    "leads": ImportSpec(
+        Lead,
+        fields=("title", "description", "status"),
+        relations={
+            "owner": (User, "email"),
+            "campaign": (Campaign, "name"),
+            "account": (Account, "name"),
+            "contact": (Contact, "email"),
+        },
+    ),
+}
+
+CASE_INSENSITIVE_KEYS = {"email"}
+
+
+def iter_records(stream, file_format: str) -> Iterator[Tuple[int, object]]:
+    """
+    Yield (line number, record) pairs from a text stream without reading it
+    all into memory. NDJSON lines that fail to parse are yielded as the
+    parse error so the importer can reject them with a line number.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif file_format == "ndjson":
+        for line_num, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except ValueError as e:
+                yield line_num, e
+    else:
+        raise ValueError(f"Unsupported import format: {file_format}")
+
+
+def open_text(fileobj) -> io.TextIOBase:
+    """Wrap a binary upload or file in a streaming UTF-8 text reader."""
+    return io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+
+
+class RejectWriter:
+    """Writes rejected rows to a CSV file and keeps the first few in memory."""
+
+    def __init__(self, fileobj=None, sample_size: int = 100):
+        self.writer = csv.writer(fileobj) if fileobj is not None else None
+        if self.writer:
+            self.writer.writerow(["line", "error", "record"])
+        self.sample_size = sample_size
+        self.sample: List[Dict] = []
+        self.count = 0
+
+    def reject(self, line_num: int, error: str, record) -> None:
+        self.count += 1
+        if not isinstance(record, (dict, list, str, int, float, bool, type(None))):
+            record = str(record)
+        if self.writer:
+            self.writer.writerow([line_num, error, json.dumps(record, default=str)])
+        if len(self.sample) < self.sample_size:
+            self.sample.append({"line": line_num, "error": error})
+
+
+class BulkImporter:
+    """
+    Validates records in chunks and writes each valid chunk with a single
+    COPY (PostgreSQL) or bulk_create (other backends). Foreign keys are
+    resolved from in-memory maps loaded once per run, so the cost per row is
+    a dict lookup instead of a query.
+    """
+
+    def __init__(self, entity: str, chunk_size: int = 5000, rejects: Optional[RejectWriter] = None,
+                 using: str = "default"):
+        if entity not in IMPORT_SPECS:
+            raise ValueError(f"Unknown import entity: {entity}")
+        self.spec = IMPORT_SPECS[entity]
+        self.model = self.spec.model
+        self.chunk_size = chunk_size
+        self.rejects = rejects or RejectWriter()
+        self.using = using
+        self.imported = 0
+
+        meta = self.model._meta
+        self.columns = [f for f in meta.concrete_fields if not f.primary_key]
+        self.plain_fields = {name: meta.get_field(name) for name in self.spec.fields}
+        self.fk_fields = {name: meta.get_field(name) for name in self.spec.relations}
+        self.lookups, self.known_ids = self._load_maps()
+
+    def _load_maps(self):
+        lookups, known_ids = {}, {}
+        for column, (related, key) in self.spec.relations.items():
+            mapping, ids = {}, set()
+            rows = related.objects.using(self.using).order_by("pk").values_list("pk", key)
+            for pk, natural in rows.iterator(chunk_size=self.chunk_size):
+                ids.add(pk)
+                if natural:
+                    mapping.setdefault(self._normalize(key, natural), pk)
+            lookups[column] = mapping
+            known_ids[column] = ids
+        return lookups, known_ids
+
+    @staticmethod
+    def _normalize(key: str, value) -> str:
+        value = str(value).strip()
+        return value.lower() if key in CASE_INSENSITIVE_KEYS else value
+
+    def _blank_value(self, field):
+        if field.has_default():
+            return field.get_default()
+        if field.null:
+            return None
+        if field.blank:
+            return ""
+        raise ValidationError("This field is required.")
+
+    def clean(self, record: Dict) -> Dict:
+        """Turn one raw record into model attribute values, or raise ValidationError."""
+        if not isinstance(record, dict):
+            raise ValidationError("Record is not an object.")
+        record = {str(k).strip().lower(): v for k, v in record.items() if k is not None}
+        values = {}
+        errors = {}
+        for name, field in self.plain_fields.items():
+            raw = record.get(name)
+            try:
+                if raw is None or raw == "":
+                    values[field.attname] = self._blank_value(field)
+                else:
+                    values[field.attname] = field.clean(str(raw).strip(), None)
+            except ValidationError as e:
+                errors[name] = e.messages
+        for column, field in self.fk_fields.items():
+            related, key = self.spec.relations[column]
+            raw_id = record.get(field.attname)
+            raw = record.get(column)
+            if raw_id not in (None, ""):
+                try:
+                    pk = int(raw_id)
+                except (TypeError, ValueError):
+                    pk = None
+                if pk not in self.known_ids[column]:
+                    errors[field.attname] = [f"Unknown {column} id {raw_id!r}."]
+                    continue
+            elif raw not in (None, ""):
+                pk = self.lookups[column].get(self._normalize(key, raw))
+                if pk is None:
+                    errors[column] = [f"Unknown {column} {raw!r}."]
+                    continue
+            elif not field.null:
+                errors[column] = ["This field is required."]
+                continue
+            else:
+                pk = None
+            values[field.attname] = pk
+        if errors:
+            raise ValidationError(errors)
+        now = timezone.now()
+        for field in self.columns:
+            if field.attname not in values:
+                auto = getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+                values[field.attname] = now if auto else field.get_default()
+        if self.model is Contact:
+            # COPY skips Contact's own upkeep of the match keys
+            values.update(match_keys(values.get("first_name"), values.get("last_name"),
+                                     values.get("email"), values.get("phone")))
+        return values
+
+    def run(self, records: Iterable[Tuple[int, object]]) -> Dict[str, int]:
+        chunk: List[Tuple[int, Dict, Dict]] = []
+        for line_num, record in records:
+            if isinstance(record, Exception):
+                self.rejects.reject(line_num, f"Invalid JSON: {record}", None)
+                continue
+            try:
+                chunk.append((line_num, record, self.clean(record)))
+            except ValidationError as e:
+                self.rejects.reject(line_num, _format_errors(e), record)
+                continue
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk)
+                chunk = []
+        if chunk:
+            self._flush(chunk)
+        return {"imported": self.imported, "rejected": self.rejects.count}
+
+    def _flush(self, chunk: List[Tuple[int, Dict, Dict]]) -> None:
+        rows = [values for _, _, values in chunk]
+        manager = self.model.objects.using(self.using)
+        try:
+            with transaction.atomic(using=self.using):
+                if connections[self.using].vendor == "postgresql":
+                    pks = self._copy(rows)
+                    # COPY skips RollupQuerySet.bulk_create, which counts rows into their parents
+                    rows_created(self.model, pks, self.using)
+                else:
+                    objs = manager.bulk_create([self.model(**values) for values in rows], batch_size=self.chunk_size)
+                    pks = [obj.pk for obj in objs]
+                record_changes(self.model, pks, "C")
+            self.imported += len(rows)
+        except DatabaseError:
+            # Fall back to one row per savepoint to find the offending rows.
+            for line_num, record, values in chunk:
+                try:
+                    with transaction.atomic(using=self.using):
+                        self.model(**values).save(using=self.using)
+                    self.imported += 1
+                except DatabaseError as e:
+                    self.rejects.reject(line_num, str(e).strip(), record)
+        # bulk_create and COPY send no post_save signals.
+        invalidate_model(self.model)
+
+    def _copy(self, rows: List[Dict]) -> List[int]:
+        return copy_rows(self.model, self.columns, rows, self.using)
+
+
+def reserve_pks(model, count: int, using: str = "default") -> List[int]:
+    """Draw count ids from the table's primary key sequence; PostgreSQL only."""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+            [connection.ops.quote_name(model._meta.db_table), model._meta.pk.column, count],
+        )
+        return [pk for pk, in cursor.fetchall()]
+
+
+def copy_rows(model, columns, rows: Iterable[Dict], using: str = "default") -> List[int]:
+    """
+    Write rows (dicts keyed by attname) with COPY and return their primary
+    keys, in order; PostgreSQL only. COPY cannot return the ids it assigns,
+    so they are drawn from the sequence first and written with the rows:
+    rows other transactions insert meanwhile never get mixed in.
+    """
+    rows = list(rows)
+    pks = reserve_pks(model, len(rows), using)
+    attnames = [f.attname for f in columns]
+    buffer = io.StringIO()
+    for pk, values in zip(pks, rows):
+        buffer.write(",".join([str(pk), *(_copy_value(values[name]) for name in attnames)]))
+        buffer.write("\n")
+    buffer.seek(0)
+    quote = connections[using].ops.quote_name
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        quote(model._meta.db_table), ", ".join(quote(f.column) for f in [model._meta.pk, *columns])
+    )
+    with connections[using].cursor() as cursor:
+        cursor.cursor.copy_expert(sql, buffer)
+    return pks
+
+
+def _copy_value(value) -> str:
+    # Unquoted empty is NULL in COPY csv; anything quoted is a literal value.
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        value = value.isoformat()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _format_errors(error: ValidationError) -> str:
+    if hasattr(error, "error_dict"):
+        return "; ".join(f"{field}: {' '.join(messages)}" for field, messages in error.message_dict.items())
+    return " ".join(error.messages)
+
+
+class ImportMixin:
+    """
+    Adds POST /api/<entity>/import/ (multipart field "file") to a viewset
+    whose basename has an IMPORT_SPECS entry. Rejected rows are written to
+    MEDIA_ROOT/imports/ and the first few are returned in the response.
+    """
+
+    @action(detail=False, methods=["post"], url_path="import", parser_classes=[MultiPartParser],
+            permission_classes=[IsSuperAdmin])
+    def import_records(self, request):
+        upload = request.FILES.get("file")
+        if not upload:
+            return Response({"error": "file is required"}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get("format") or (
+            "ndjson" if upload.name.endswith((".ndjson", ".jsonl")) else "csv"
+        )
+        if file_format not in ("csv", "ndjson"):
+            return Response({"error": "format must be csv or ndjson"}, status=status.HTTP_400_BAD_REQUEST)
+
+        entity = f"{self.basename}s"
+        rejects_dir = os.path.join(settings.MEDIA_ROOT, "imports")
+        os.makedirs(rejects_dir, exist_ok=True)
+        rejects_path = os.path.join(rejects_dir, f"{entity}-{uuid.uuid4().hex}.rejects.csv")
+
+        with open(rejects_path, "w", encoding="utf-8", newline="") as rejects_file:
+            rejects = RejectWriter(rejects_file)
+            importer = BulkImporter(entity, chunk_size=settings.CRM_IMPORT_CHUNK_SIZE, rejects=rejects)
+            result = importer.run(iter_records(open_text(upload.file), file_format))
+        if not rejects.count:
+            os.remove(rejects_path)
+
+        result["errors"] = rejects.sample
+        if rejects.count:
+            result["rejects_file"] = os.path.relpath(rejects_path, settings.MEDIA_ROOT)
+        return Response(result, status=status.HTTP_201_CREATED if result["imported"] else status.HTTP_200_OK)
@@ -0,0 +1,294 @@
+"""
+Facebook insights: incremental ingestion into FacebookInsightDaily and local performance reports
+"""
+import logging
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Count, DecimalField, F, FloatField, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .models import Account, Campaign, Deal, FacebookInsightDaily, Lead
+from .permissions import scope_queryset
+
+logger = logging.getLogger("crm.insights")
+
+# Campaign insight fields stored as metrics; each action type is stored as "action:<type>"
+CAMPAIGN_FIELDS = ("spend", "impressions", "clicks", "reach")
+LEAD_ACTION = "action:lead"
+# Page metrics that are a running total, reported as their latest value rather than summed
+PAGE_GAUGES = ("page_fans",)
+PAGE_SUMS = ("page_engaged_users", "page_post_engagements")
+# Longest date range Graph serves per insights request
+MAX_WINDOW_DAYS = 90
+UNIQUE_FIELDS = ["object_type", "object_id", "metric", "day"]
+
+
+def _number(value) -> Optional[Decimal]:
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def windows(last: Optional[date], today: date, days: Optional[int] = None) -> Iterator[Tuple[date, date]]:
+    """
+    Date ranges (inclusive) to fetch for an object whose newest stored day
+    is last: the last CRM_FACEBOOK_INSIGHTS_REFRESH_DAYS again, as Facebook
+    keeps revising recent days, then everything up to today; objects never
+    fetched go back CRM_FACEBOOK_INSIGHTS_BACKFILL_DAYS. days instead
+    refetches the last `days` days. Ranges are at most MAX_WINDOW_DAYS long.
+    """
+    if days is not None:
+        since = today - timedelta(days=days - 1)
+    elif last is not None:
+        since = last - timedelta(days=settings.CRM_FACEBOOK_INSIGHTS_REFRESH_DAYS - 1)
+    else:
+        since = today - timedelta(days=settings.CRM_FACEBOOK_INSIGHTS_BACKFILL_DAYS - 1)
+    while since <= today:
+        until = min(since + timedelta(days=MAX_WINDOW_DAYS - 1), today)
+        yield since, until
+        since = until + timedelta(days=1)
+
+
+def page_facts(api, account: Account, since: date, until: date) -> List[FacebookInsightDaily]:
+    """Daily page insights of since..until for the page account was synced from."""
+    # Page insights end each day at the end_time of the next one; until is exclusive
+    response = api.get_page_insights(account.facebook_page_id, since.isoformat(),
+                                     (until + timedelta(days=1)).isoformat())
+    now = timezone.now()
+    facts = []
+    for metric in response.get("data", []):
+        for entry in metric.get("values", []):
+            value = _number(entry.get("value"))
+            if value is None or not entry.get("end_time"):
+                continue
+            end = datetime.fromisoformat(entry["end_time"].replace("+0000", "+00:00"))
+            day = (end - timedelta(days=1)).date()
+            if since <= day <= until:
+                facts.append(FacebookInsightDaily(
+                    object_type=FacebookInsightDaily.PAGE, object_id=account.facebook_page_id,
+                    metric=metric["name"], day=day, value=value, account=account, fetched_at=now,
+                ))
+    return facts
+
+
+def campaign_facts(api, campaign: Campaign, since: date, until: date) -> List[FacebookInsightDaily]:
+    """Daily ad insights of since..until for the ad campaign campaign was synced from."""
+    now = timezone.now()
+    facts = []
+    for row in api.get_campaign_insights(campaign.facebook_campaign_id, since.isoformat(), until.isoformat()):
+        day = parse_date(row.get("date_start") or "")
+        if day is None:
+            continue
+        values = {field: row.get(field) for field in CAMPAIGN_FIELDS}
+        for action in row.get("actions") or []:
+            values[f"action:{action.get('action_type')}"] = action.get("value")
+        for metric, raw in values.items():
+            value = _number(raw) if raw is not None else None
+            if value is not None:
+                facts.append(FacebookInsightDaily(
+                    object_type=FacebookInsightDaily.CAMPAIGN, object_id=campaign.facebook_campaign_id,
+                    metric=metric, day=day, value=value, campaign=campaign, fetched_at=now,
+                ))
+    return facts
+
+
+def refresh_insights(api, accounts: Optional[Iterable[Account]] = None,
+                     campaigns: Optional[Iterable[Campaign]] = None, days: Optional[int] = None) -> Dict[str, int]:
+    """
+    Fetch the new date windows of page insights for accounts and ad
+    insights for campaigns (default: every account and campaign synced from
+    Facebook) and upsert them into FacebookInsightDaily. An object Graph
+    refuses (e.g. no access with this token) is logged and skipped.
+    """
+    if accounts is None:
+        accounts = Account.objects.exclude(facebook_page_id=None).exclude(facebook_page_id="")
+    if campaigns is None:
+        campaigns = Campaign.objects.exclude(facebook_campaign_id=None).exclude(facebook_campaign_id="")
+    last_days = {
+        (row["object_type"], row["object_id"]): row["last"]
+        for row in FacebookInsightDaily.objects.order_by().values("object_type", "object_id").annotate(last=Max("day"))
+    }
+    today = timezone.localdate()
+    result = {"objects": 0, "rows": 0, "errors": 0}
+    objects = [(FacebookInsightDaily.PAGE, account, account.facebook_page_id, page_facts) for account in accounts]
+    objects += [(FacebookInsightDaily.CAMPAIGN, campaign, campaign.facebook_campaign_id, campaign_facts)
+                for campaign in campaigns]
+    for object_type, obj, object_id, fetch in objects:
+        try:
+            for since, until in windows(last_days.get((object_type, object_id)), today, days):
+                facts = fetch(api, obj, since, until)
+                FacebookInsightDaily.objects.bulk_create(
+                    facts, batch_size=1000, update_conflicts=True, unique_fields=UNIQUE_FIELDS,
+                    update_fields=["value", "account", "campaign", "fetched_at"],
+                )
+                result["rows"] += len(facts)
+            result["objects"] += 1
+        except Exception:
+            logger.exception("Fetching insights of %s %s failed", object_type, object_id)
+            result["errors"] += 1
+    return result
+
+
+# reports
+
+def _period(params) -> Tuple[Optional[date], Optional[date]]:
+    today = timezone.localdate()
+    try:
+        start = parse_date(params["from"]) if params.get("from") else today - timedelta(days=29)
+        end = parse_date(params["to"]) if params.get("to") else today
+    except ValueError:
+        return None, None
+    return start, end
+
+
+def _bounds(start: date, end: date):
+    start_at = timezone.make_aware(datetime.combine(start, time.min))
+    return start_at, timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+
+
+def _fact(fk: str, metric: str, start: date, end: date, latest: bool = False):
+    """Subquery of metric summed over start..end for each parent row, or its value on the latest day."""
+    rows = FacebookInsightDaily.objects.filter(**{fk: OuterRef("pk")}, metric=metric, day__gte=start, day__lte=end)
+    if latest:
+        rows = rows.order_by("-day").values("value")[:1]
+    else:
+        rows = rows.order_by().values(fk).annotate(total=Sum("value")).values("total")
+    output = DecimalField(max_digits=20, decimal_places=4)
+    return Coalesce(Subquery(rows, output_field=output), Value(Decimal(0)), output_field=output)
+
+
+def _count(model, fk: str, **filters):
+    rows = model.objects.filter(**{fk: OuterRef("pk")}, **filters).order_by().values(fk).annotate(
+        n=Count("pk")).values("n")
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def _won_amount(fk: str, won_from, won_to):
+    rows = (
+        Deal.objects.filter(**{fk: OuterRef("pk")}, stage="WON", stage_changed_at__gte=won_from,
+                            stage_changed_at__lt=won_to)
+        .order_by().values(fk).annotate(total=Sum("amount")).values("total")
+    )
+    output = DecimalField(max_digits=16, decimal_places=2)
+    return Coalesce(Subquery(rows, output_field=output), Value(Decimal(0)), output_field=output)
+
+
+def _ratio(numerator, denominator):
+    return Cast(numerator, FloatField()) / NullIf(Cast(denominator, FloatField()), Value(0.0))
+
+
+def crm_outcomes(fk: str, start: date, end: date) -> Dict:
+    """Annotations counting a parent's leads and deals created in start..end, and deals won in it."""
+    start_at, end_at = _bounds(start, end)
+    created = {"created_at__gte": start_at, "created_at__lt": end_at}
+    return {
+        "leads_created": _count(Lead, fk, **created),
+        "deals_created": _count(Deal, fk, **created),
+        "deals_won": _count(Deal, fk, stage="WON", stage_changed_at__gte=start_at, stage_changed_at__lt=end_at),
+        "won_revenue": _won_amount(fk, start_at, end_at),
+    }
+
+
+def _rows(queryset, fields) -> List[Dict]:
+    rows = []
+    for row in queryset.values(*fields):
+        for name, value in row.items():
+            if isinstance(value, Decimal):
+                row[name] = round(float(value), 2)
+            elif isinstance(value, float):
+                row[name] = round(value, 4)
+        rows.append(row)
+    return rows
+
+
+class InsightsReportView(APIView):
+    """
+    Base for the performance reports: Facebook metrics of ?from=YYYY-MM-DD
+    through ?to=YYYY-MM-DD (default: the last 30 days) from
+    FacebookInsightDaily, next to the CRM leads and deals of the same
+    period, as one SQL query over the parents the user may see. No Graph
+    call is made; manage.py ingest_facebook_insights keeps the facts fresh.
+    """
+    permission_classes = [IsAuthenticated]
+    orderings = ()
+
+    def report(self, start: date, end: date):
+        raise NotImplementedError
+
+    def get(self, request):
+        start, end = _period(request.query_params)
+        if start is None or end is None:
+            return Response({"detail": "from and to must be YYYY-MM-DD dates"}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({"detail": "from must not be after to"}, status=status.HTTP_400_BAD_REQUEST)
+        ordering = request.query_params.get("ordering") or self.orderings[0]
+        if ordering.lstrip("-") not in self.orderings:
+            return Response({"detail": f"ordering must be one of {', '.join(self.orderings)} (- for descending)"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        queryset, fields = self.report(start, end)
+        queryset = scope_queryset(queryset, request.user)
+        expression = F(ordering.lstrip("-"))
+        queryset = queryset.order_by(
+            expression.desc(nulls_last=True) if ordering.startswith("-") else expression.asc(nulls_last=True), "pk"
+        )
+        return Response({"from": start, "to": end, "results": _rows(queryset, fields)})
+
+
+class CampaignPerformanceView(InsightsReportView):
+    """
+    Per Facebook ad campaign: spend, impressions, clicks, reach and lead
+    form submissions, the campaign's CRM leads, deals and won revenue, and
+    cost per lead (spend / CRM leads) and ROI ((won - spend) / spend).
+    ?ordering=spend|leads_created|cost_per_lead|roi|won_revenue, - for descending.
+    """
+    orderings = ("spend", "leads_created", "cost_per_lead", "roi", "won_revenue")
+
+    def report(self, start, end):
+        queryset = (
+            Campaign.objects.exclude(facebook_campaign_id=None).exclude(facebook_campaign_id="")
+            .annotate(
+                **{field: _fact("campaign", field, start, end) for field in CAMPAIGN_FIELDS},
+                facebook_leads=_fact("campaign", LEAD_ACTION, start, end),
+                **crm_outcomes("campaign", start, end),
+            )
+            .annotate(
+                cost_per_lead=_ratio(F("spend"), F("leads_created")),
+                roi=_ratio(F("won_revenue") - F("spend"), F("spend")),
+            )
+        )
+        fields = ("id", "name", "facebook_campaign_id", *CAMPAIGN_FIELDS, "facebook_leads", "leads_created",
+                  "deals_created", "deals_won", "won_revenue", "cost_per_lead", "roi")
+        return queryset, fields
+
+
+class PagePerformanceView(InsightsReportView):
+    """
+    Per Facebook page: latest fan count and engagement totals, and the CRM
+    leads (those from its lead forms counted apart), deals and won revenue
+    of the account it was synced into.
+    ?ordering=leads_created|page_post_engagements|won_revenue, - for descending.
+    """
+    orderings = ("leads_created", "page_post_engagements", "won_revenue")
+
+    def report(self, start, end):
+        start_at, end_at = _bounds(start, end)
+        queryset = Account.objects.exclude(facebook_page_id=None).exclude(facebook_page_id="").annotate(
+            **{metric: _fact("account", metric, start, end, latest=True) for metric in PAGE_GAUGES},
+            **{metric: _fact("account", metric, start, end) for metric in PAGE_SUMS},
+            facebook_leads=_count(Lead, "account", created_at__gte=start_at, created_at__lt=end_at,
+                                  facebook_lead_id__isnull=False),
+            **crm_outcomes("account", start, end),
+        )
+        fields = ("id", "name", "facebook_page_id", *PAGE_GAUGES, *PAGE_SUMS, "facebook_leads", "leads_created",
+                  "deals_created", "deals_won", "won_revenue")
+        return queryset, fields
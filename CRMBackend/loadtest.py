@@ -0,0 +1,287 @@
+"""
+Load tests against a running deployment: many concurrent JWT clients replaying a weighted request mix
+"""
+import asyncio
+import os
+import random
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from django.conf import settings
+from django.db.models import Count
+
+from .models import Account, User
+
+# Roles load-test users are created with unless asked otherwise; superadmins are opt-in
+DEFAULT_ROLES = (User.Role.ADMIN, User.Role.EMPLOYEE)
+
+# Relative weight of each operation in the default mix; writes are about a tenth.
+DEFAULT_MIX = {
+    "dashboard": 10,
+    "leads": 25,
+    "lead-detail": 10,
+    "deals": 10,
+    "accounts": 10,
+    "contacts": 10,
+    "tasks": 10,
+    "changes": 5,
+    "lead-create": 5,
+    "lead-update": 5,
+}
+
+LIST_PATHS = {
+    "dashboard": "/api/dashboard/",
+    "leads": "/api/leads/",
+    "deals": "/api/deals/",
+    "accounts": "/api/accounts/",
+    "contacts": "/api/contacts/",
+    "tasks": "/api/tasks/",
+    "campaigns": "/api/campaigns/",
+    "changes": "/api/changes/",
+}
+OWN_LEAD_OPS = ("lead-detail", "lead-create", "lead-update")
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """'leads=50,dashboard=10' -> weights; unknown operations raise ValueError."""
+    mix = {}
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in LIST_PATHS and name not in OWN_LEAD_OPS:
+            raise ValueError(f"Unknown operation {name!r}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def parse_roles(value: str) -> List[str]:
+    """'admin,employee' -> roles; unknown roles raise ValueError."""
+    roles = [part.strip().upper() for part in value.split(",") if part.strip()]
+    unknown = [role for role in roles if role not in User.Role.values]
+    if unknown or not roles:
+        raise ValueError(f"Unknown roles {', '.join(unknown) or value!r}")
+    return roles
+
+
+def prepare_users(per_role: int, mix: Dict[str, int], roles=DEFAULT_ROLES) -> List[Dict]:
+    """
+    Create (or reactivate) per_role load-test users for each of roles, with
+    a random password made for this run (stored in each user dict). When
+    the mix writes leads, each user gets a home account, and admins have it
+    in allowed_accounts, so every client may read and update the leads it
+    writes. retire_users() locks them again after the run.
+    """
+    accounts = [None]
+    if any(operation in OWN_LEAD_OPS for operation in mix):
+        accounts = list(
+            Account.objects.annotate(n=Count("leads")).order_by("-n").values_list("pk", flat=True)[:per_role * 3]
+        )
+        if not accounts:
+            raise ValueError("No accounts: seed data first (manage.py seed_crm).")
+    password = secrets.token_urlsafe(24)
+    users = []
+    for role in roles:
+        for n in range(per_role):
+            email = f"loadtest-{role.lower()}-{n}@example.com"
+            user = User.objects.filter(email=email).first() or User(
+                email=email, role=role, first_name="Load", last_name=f"{role.title()} {n}"
+            )
+            user.role = role
+            user.is_active = True
+            user.set_password(password)
+            user.save()
+            account = accounts[len(users) % len(accounts)]
+            if role == User.Role.ADMIN and account is not None:
+                user.allowed_accounts.add(account)
+            users.append({"id": user.pk, "email": email, "role": role, "account": account, "password": password})
+    return users
+
+
+def retire_users(users: List[Dict]) -> None:
+    """Deactivate the load-test users and make their passwords unusable."""
+    for user in User.objects.filter(pk__in=[user["id"] for user in users]):
+        user.is_active = False
+        user.set_unusable_password()
+        user.save(update_fields=["is_active", "password"])
+
+
+class Server:
+    """
+    gunicorn serving crm.wsgi on a free local port, started with the
+    environment of this process so it uses the same database (CRM_DB).
+    """
+
+    def __init__(self, workers: int, threads: int, port: Optional[int] = None, startup_timeout: float = 30):
+        self.workers = workers
+        self.threads = threads
+        self.port = port or self._free_port()
+        self.startup_timeout = startup_timeout
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = None
+
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn", "crm.wsgi",
+                "--config", str(settings.BASE_DIR / "crm" / "gunicorn_conf.py"),
+                "--bind", f"127.0.0.1:{self.port}",
+                "--workers", str(self.workers),
+                "--threads", str(self.threads),
+                "--log-level", "warning",
+            ],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "crm.settings")},
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {self.process.returncode}")
+            try:
+                httpx.get(self.url + "/api/auth/login/", timeout=1)
+                return self
+            except httpx.TransportError:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError(f"gunicorn did not answer within {self.startup_timeout:.0f}s")
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class LoadTest:
+    """
+    Logs every user in through /api/auth/login/, then runs `clients`
+    concurrent clients for `duration` seconds (or until `max_requests`),
+    each bound to one user in turn and picking operations from the weighted
+    mix, with an optional think time between requests. Writes create leads
+    owned by the client's user and update or read them back.
+    """
+
+    def __init__(self, base_url: str, users: List[Dict], mix: Dict[str, int], clients: int = 20,
+                 duration: float = 30, max_requests: Optional[int] = None, think_time: float = 0.0,
+                 seed: int = 0, timeout: float = 30):
+        self.base_url = base_url.rstrip("/")
+        self.users = users
+        self.operations, self.weights = zip(*mix.items())
+        self.clients = clients
+        self.duration = duration
+        self.max_requests = max_requests
+        self.think_time = think_time
+        self.random = random.Random(seed)
+        self.timeout = timeout
+        self.samples = {}
+        self.statuses = {}
+        self.sent = 0
+
+    def _record(self, name: str, elapsed: float, status) -> None:
+        self.samples.setdefault(name, []).append((elapsed, status))
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    async def _request(self, http, name, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await http.request(method, path, **kwargs)
+        except httpx.HTTPError as exc:
+            self._record(name, time.perf_counter() - start, type(exc).__name__)
+            return None
+        self._record(name, time.perf_counter() - start, response.status_code)
+        return response
+
+    async def _login(self, http, user) -> Optional[str]:
+        response = await self._request(http, "login", "POST", "/api/auth/login/",
+                                       json={"email": user["email"], "password": user["password"]})
+        if response is None or response.status_code != 200:
+            return None
+        return response.json()["access"]
+
+    async def _client(self, http, user, token, deadline):
+        headers = {"Authorization": f"Bearer {token}"}
+        own_leads = []
+        while time.monotonic() < deadline and (self.max_requests is None or self.sent < self.max_requests):
+            self.sent += 1
+            operation = self.random.choices(self.operations, self.weights)[0]
+            if operation in ("lead-detail", "lead-update") and not own_leads:
+                operation = "lead-create"
+            if operation == "lead-create":
+                response = await self._request(http, operation, "POST", "/api/leads/", headers=headers, json={
+                    "title": f"Load test lead {self.sent}", "owner": user["id"], "account": user["account"],
+                })
+                if response is not None and response.status_code == 201:
+                    own_leads.append(response.json()["id"])
+            elif operation == "lead-update":
+                status = self.random.choice(("CONTACTED", "QUALIFIED", "LOST"))
+                await self._request(http, operation, "PATCH", f"/api/leads/{self.random.choice(own_leads)}/",
+                                    headers=headers, json={"status": status})
+            elif operation == "lead-detail":
+                await self._request(http, operation, "GET", f"/api/leads/{self.random.choice(own_leads)}/",
+                                    headers=headers)
+            else:
+                await self._request(http, operation, "GET", LIST_PATHS[operation], headers=headers)
+            if self.think_time:
+                await asyncio.sleep(self.random.expovariate(1 / self.think_time))
+
+    async def _run(self) -> float:
+        limits = httpx.Limits(max_connections=self.clients, max_keepalive_connections=self.clients)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits) as http:
+            tokens = await asyncio.gather(*(self._login(http, user) for user in self.users))
+            sessions = [(user, token) for user, token in zip(self.users, tokens) if token]
+            if not sessions:
+                raise RuntimeError("No load-test user could log in.")
+            start = time.monotonic()
+            deadline = start + self.duration
+            await asyncio.gather(*(
+                self._client(http, *sessions[n % len(sessions)], deadline) for n in range(self.clients)
+            ))
+            return time.monotonic() - start
+
+    def run(self) -> Dict:
+        elapsed = asyncio.run(self._run())
+        endpoints = {}
+        for name, samples in sorted(self.samples.items()):
+            latencies = sorted(elapsed_s for elapsed_s, _ in samples)
+            errors = sum(1 for _, status in samples if not isinstance(status, int) or status >= 400)
+            endpoints[name] = {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": round(errors / len(samples), 4),
+                # Login happens before the timed window
+                "throughput_rps": round(len(samples) / elapsed, 2) if name != "login" else None,
+                "latency_ms": {
+                    "p50": round(percentile(latencies, 0.50) * 1000, 2),
+                    "p95": round(percentile(latencies, 0.95) * 1000, 2),
+                    "p99": round(percentile(latencies, 0.99) * 1000, 2),
+                    "max": round(latencies[-1] * 1000, 2),
+                },
+            }
+        timed = sum(len(s) for name, s in self.samples.items() if name != "login")
+        return {
+            "clients": self.clients,
+            "users": len(self.users),
+            "seconds": round(elapsed, 2),
+            "requests": timed,
+            "throughput_rps": round(timed / elapsed, 2) if elapsed else 0,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items(), key=str)},
+            "endpoints": endpoints,
+        }
@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from CRMBackend.benchmarks import BenchmarkSuite, compare
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency, query count and allocation peak of every API endpoint, the "
+        "dashboard and the Facebook sync (against replayed Graph fixtures) on the current data, "
+        "and write the results as JSON. Seed data first with seed_crm."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument("--output", help="Write JSON results to this file instead of stdout.")
+        parser.add_argument("--baseline", help="Earlier results to compare against; regressions fail the command.")
+        parser.add_argument("--tolerance", type=float, default=1.25,
+                            help="Allowed latency/allocation ratio against the baseline.")
+        parser.add_argument("--only", action="append",
+                            help="Only benchmarks whose name contains this (repeatable), e.g. lead-list.")
+        parser.add_argument("--with-cache", action="store_true", help="Keep the response cache on.")
+
+    def handle(self, *args, **options):
+        suite = BenchmarkSuite(repeat=options["repeat"], use_cache=options["with_cache"], only=options["only"])
+        results = suite.run()
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                fh.write(output)
+            for name, result in results["results"].items():
+                self.stdout.write(
+                    f"{name}: p50 {result['latency_ms']['p50']} ms, p95 {result['latency_ms']['p95']} ms, "
+                    f"{result['queries']} queries, {result['alloc_peak_kb']} KiB"
+                )
+        else:
+            self.stdout.write(output)
+
+        if options["baseline"]:
+            try:
+                with open(options["baseline"]) as fh:
+                    baseline = json.load(fh)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read baseline {options['baseline']}: {exc}")
+            regressions = compare(baseline, results, options["tolerance"])
+            if regressions:
+                raise CommandError("Regressions against baseline:\n" + "\n".join(regressions))
+            self.stderr.write("No regressions against baseline.")
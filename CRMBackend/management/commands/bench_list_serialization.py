@@ -0,0 +1,96 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from CRMBackend.fast_serializers import compile_row_plan, orjson, render_json
+from CRMBackend.models import Account, Deal, Lead
+from CRMBackend.serializers import DealSerializer, LeadSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare per-row CPU cost of ModelSerializer list output against the "
+        "values_list() fast path for leads and deals. Rows are created inside a "
+        "transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        self.results = {}
+        try:
+            with transaction.atomic():
+                self.seed(options["rows"])
+                for name, model, serializer_class in (
+                    ("leads", Lead, LeadSerializer),
+                    ("deals", Deal, DealSerializer),
+                ):
+                    self.results[name] = self.measure(model, serializer_class, options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+        if options["json"]:
+            self.stdout.write(json.dumps(self.results, indent=2))
+            return
+        self.stdout.write(f"JSON encoder: {'orjson' if orjson else 'json (stdlib)'}")
+        for name, result in self.results.items():
+            self.stdout.write(
+                f"{name}: {result['rows']} rows, serializer {result['serializer_us_per_row']:.2f} us/row, "
+                f"fast path {result['fast_us_per_row']:.2f} us/row ({result['speedup']:.1f}x)"
+            )
+
+    def seed(self, rows):
+        now = timezone.now()
+        account = Account.objects.create(name="Benchmark account", region="BENCH")
+        Lead.objects.bulk_create(
+            [Lead(title=f"Benchmark lead {i}", description="Imported éè", account=account, created_at=now)
+             for i in range(rows)],
+            batch_size=1000,
+        )
+        Deal.objects.bulk_create(
+            [Deal(title=f"Benchmark deal {i}", amount=i * 10 + 0.5, account=account, close_date=now.date(),
+                  created_at=now)
+             for i in range(rows)],
+            batch_size=1000,
+        )
+
+    def measure(self, model, serializer_class, repeat):
+        queryset = model.objects.order_by("-created_at")
+        renderer = JSONRenderer()
+
+        def drf():
+            return renderer.render(serializer_class(list(queryset), many=True).data)
+
+        def fast():
+            plan = compile_row_plan(serializer_class())
+            return render_json(plan.convert(queryset.values_list(*plan.attnames)), renderer, None, {})
+
+        if drf() != fast():
+            raise CommandError(f"Fast path output differs from {serializer_class.__name__} output.")
+        rows = queryset.count()
+        drf_time = min(self.cpu_time(drf) for _ in range(repeat))
+        fast_time = min(self.cpu_time(fast) for _ in range(repeat))
+        return {
+            "rows": rows,
+            "serializer_us_per_row": drf_time / rows * 1e6,
+            "fast_us_per_row": fast_time / rows * 1e6,
+            "speedup": drf_time / fast_time if fast_time else 0,
+        }
+
+    @staticmethod
+    def cpu_time(func):
+        start = time.process_time()
+        func()
+        return time.process_time() - start
@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from CRMBackend.benchmarks import bench_login
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare login throughput and CPU per login: the legacy double-authenticate pipeline, "
+        "LoginView with a session and LoginView in JWT-only mode."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=20, help="Logins per mode.")
+        parser.add_argument("--iterations", type=int, help="PBKDF2 iterations instead of CRM_PASSWORD_ITERATIONS.")
+        parser.add_argument("--json", action="store_true")
+
+    def handle(self, *args, **options):
+        report = bench_login(options["logins"], options["iterations"])
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"PBKDF2 iterations: {report['iterations']}, {report['logins']} logins per mode")
+        legacy_cpu = report["results"]["legacy"]["cpu_ms_per_login"]
+        for mode, result in report["results"].items():
+            self.stdout.write(
+                f"{mode:<10} {result['logins_per_second']:>8} logins/s  {result['cpu_ms_per_login']:>8} ms CPU/login"
+                f"  ({result['cpu_ms_per_login'] / legacy_cpu:.0%} of legacy)  {result['queries_per_login']} queries/login"
+            )
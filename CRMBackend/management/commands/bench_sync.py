@@ -0,0 +1,58 @@
+import json
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from CRMBackend.benchmarks import run_sync
+from CRMBackend.graph_backends import ReplayBackend, generate_fixtures
+from CRMBackend.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Time one full Facebook sync_all offline, replaying Graph fixtures with injected latency, "
+        "page size and rate limiting. With --leads, synthetic fixtures of that size are generated "
+        "first; otherwise FACEBOOK_GRAPH_FIXTURES is replayed. Changes are rolled back unless --keep."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fixtures", default=settings.FACEBOOK_GRAPH_FIXTURES)
+        parser.add_argument("--leads", type=int, help="Generate synthetic fixtures with this many leads.")
+        parser.add_argument("--forms", type=int, default=5)
+        parser.add_argument("--campaigns", type=int, default=50)
+        parser.add_argument("--latency-ms", type=float, default=0, help="Added to every Graph call.")
+        parser.add_argument("--page-size", type=int, default=settings.FACEBOOK_GRAPH_REPLAY_PAGE_SIZE)
+        parser.add_argument("--throttle-rate", type=float, default=0, help="Share of calls rate limited.")
+        parser.add_argument("--retry-backoff", type=float, default=settings.FACEBOOK_GRAPH_RETRY_BACKOFF)
+        parser.add_argument("--user", help="Email of the user the sync runs as; defaults to a superadmin.")
+        parser.add_argument("--keep", action="store_true", help="Commit the synced rows.")
+
+    def handle(self, *args, **options):
+        if options["user"]:
+            user = User.objects.filter(email=options["user"]).first()
+        else:
+            user = User.objects.filter(role=User.Role.SUPERADMIN).first() or User.objects.first()
+        if user is None:
+            raise CommandError("No user to run the sync as.")
+
+        with tempfile.TemporaryDirectory() as directory:
+            if options["leads"] is not None:
+                generate_fixtures(directory, forms=options["forms"], leads=options["leads"],
+                                  campaigns=options["campaigns"])
+                fixtures = directory
+            else:
+                fixtures = options["fixtures"]
+            try:
+                backend = ReplayBackend(
+                    fixtures,
+                    latency=options["latency_ms"] / 1000,
+                    page_size=options["page_size"],
+                    throttle_rate=options["throttle_rate"],
+                )
+            except FileNotFoundError:
+                raise CommandError(f"No fixtures in {fixtures}: record some or run graph_fixtures.")
+            with override_settings(FACEBOOK_GRAPH_RETRY_BACKOFF=options["retry_backoff"]):
+                report = run_sync(backend, user, keep=options["keep"])
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from CRMBackend.changes import compact_change_log
+
+
+class Command(BaseCommand):
+    help = "Remove expired and superseded change feed entries. Run daily from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retention-days", type=int, default=settings.CRM_CHANGELOG_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        result = compact_change_log(options["retention_days"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {result['expired']} expired and {result['superseded']} superseded change log entries."
+        ))
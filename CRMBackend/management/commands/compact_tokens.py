@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from CRMBackend.token_blacklist import compact_token_blacklist
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove expired outstanding and blacklisted refresh tokens. Runs automatically every "
+        "CRM_TOKEN_COMPACTION_SECONDS; use this from cron when that is disabled."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        removed = compact_token_blacklist(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {removed['outstanding']} expired outstanding and {removed['blacklisted']} blacklisted tokens."
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from CRMBackend.dedup import duplicate_groups, merge_groups
+from CRMBackend.matching import KEY_FIELDS
+from CRMBackend.models import Contact
+
+
+class Command(BaseCommand):
+    help = (
+        "Find contacts of the same account that are one person (same normalized email, E.164 phone or "
+        "phonetic name) and merge each group into its oldest contact, repointing leads and deals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", type=int, default=None, help="Only this account's contacts.")
+        parser.add_argument("--threshold", type=float, default=None,
+                            help="Minimum pair score to merge (default CRM_DEDUP_THRESHOLD).")
+        parser.add_argument("--batch-size", type=int, default=500, help="Groups merged per transaction.")
+        parser.add_argument("--dry-run", action="store_true", help="List the groups without merging.")
+        parser.add_argument("--rekey", action="store_true",
+                            help="Recompute the match keys of every contact first, e.g. after changing "
+                                 "CRM_DEFAULT_PHONE_COUNTRY_CODE.")
+
+    def handle(self, *args, **options):
+        contacts = Contact.objects.all()
+        if options["account"] is not None:
+            contacts = contacts.filter(account_id=options["account"])
+        if options["rekey"]:
+            batch = []
+            for contact in contacts.only("first_name", "last_name", "email", "phone").iterator(chunk_size=2000):
+                contact.set_match_keys()
+                batch.append(contact)
+                if len(batch) == 2000:
+                    Contact.objects.bulk_update(batch, KEY_FIELDS)
+                    batch = []
+            Contact.objects.bulk_update(batch, KEY_FIELDS)
+
+        groups = duplicate_groups(contacts, threshold=options["threshold"])
+        duplicates = sum(len(group) - 1 for group in groups)
+        self.stdout.write(f"Found {len(groups)} groups holding {duplicates} duplicate contacts.")
+        if options["dry_run"]:
+            for group in groups:
+                self.stdout.write(f"  keep {group[0]}, merge {', '.join(str(pk) for pk in group[1:])}")
+            return
+        result = merge_groups(groups, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Merged {result['merged']} contacts into {result['groups']}; "
+            f"repointed {result['leads']} leads and {result['deals']} deals."
+        ))
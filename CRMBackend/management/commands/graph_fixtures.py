@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from CRMBackend.graph_backends import generate_fixtures
+
+
+class Command(BaseCommand):
+    help = (
+        "Write synthetic Graph API fixtures (pages, ad accounts, campaigns, lead forms, leads and daily insights) "
+        "for FACEBOOK_GRAPH_BACKEND=replay. Real responses are captured with FACEBOOK_GRAPH_BACKEND=record."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default=settings.FACEBOOK_GRAPH_FIXTURES)
+        parser.add_argument("--pages", type=int, default=1)
+        parser.add_argument("--forms", type=int, default=5, help="Lead forms per page.")
+        parser.add_argument("--leads", type=int, default=1000, help="Leads per page, spread over its forms.")
+        parser.add_argument("--campaigns", type=int, default=50, help="Campaigns per ad account.")
+        parser.add_argument("--ad-accounts", type=int, default=1)
+        parser.add_argument("--days", type=int, default=90, help="Days of page and campaign insights.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        counts = generate_fixtures(
+            options["output"],
+            pages=options["pages"],
+            forms=options["forms"],
+            leads=options["leads"],
+            campaigns=options["campaigns"],
+            ad_accounts=options["ad_accounts"],
+            days=options["days"],
+            seed=options["seed"],
+        )
+        summary = ", ".join(f"{count} {name}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Wrote fixtures for {summary} to {options['output']}"))
@@ -0,0 +1,44 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from CRMBackend.importers import IMPORT_SPECS, BulkImporter, RejectWriter, iter_records, open_text
+
+
+class Command(BaseCommand):
+    help = "Bulk import accounts, contacts or leads from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("entity", choices=sorted(IMPORT_SPECS))
+        parser.add_argument("path", help="File to import, or '-' for stdin.")
+        parser.add_argument("--format", choices=["csv", "ndjson"],
+                            help="Input format (default: guessed from the file extension).")
+        parser.add_argument("--rejects", help="Where to write rejected rows (default: <path>.rejects.csv).")
+        parser.add_argument("--chunk-size", type=int, default=settings.CRM_IMPORT_CHUNK_SIZE)
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or ("ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv")
+        rejects_path = options["rejects"] or ("import.rejects.csv" if path == "-" else f"{path}.rejects.csv")
+
+        try:
+            source = open_text(sys.stdin.buffer) if path == "-" else open(path, encoding="utf-8-sig", newline="")
+        except OSError as e:
+            raise CommandError(str(e))
+
+        with source, open(rejects_path, "w", encoding="utf-8", newline="") as rejects_file:
+            importer = BulkImporter(
+                options["entity"],
+                chunk_size=options["chunk_size"],
+                rejects=RejectWriter(rejects_file),
+                using=options["database"],
+            )
+            result = importer.run(iter_records(source, file_format))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['imported']} {options['entity']}, rejected {result['rejected']}."
+        ))
+        if result["rejected"]:
+            self.stdout.write(f"Rejected rows written to {rejects_path}")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from CRMBackend.facebook_service import FacebookGraphAPI
+from CRMBackend.insights import refresh_insights
+from CRMBackend.models import FacebookIntegration
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch the new days of Facebook page and ad campaign insights for every account and campaign synced "
+        "from Facebook into the daily metrics table behind /api/analytics/campaigns/ and /api/analytics/pages/."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--integration", type=int, default=None,
+                            help="Integration whose token to use (default: the most recently synced one).")
+        parser.add_argument("--days", type=int, default=None,
+                            help="Refetch the last N days instead of only the new ones.")
+
+    def handle(self, *args, **options):
+        integrations = FacebookIntegration.objects.filter(is_active=True)
+        if options["integration"] is not None:
+            integration = integrations.filter(pk=options["integration"]).first()
+        else:
+            integration = integrations.order_by(F("last_synced_at").desc(nulls_last=True), "-pk").first()
+        if integration is None:
+            raise CommandError("No active Facebook integration.")
+        result = refresh_insights(FacebookGraphAPI(integration.access_token), days=options["days"])
+        message = f"Stored {result['rows']} metric days for {result['objects']} pages and campaigns."
+        if result["errors"]:
+            message += f" {result['errors']} failed, see the log."
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,91 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from CRMBackend.loadtest import (
+    DEFAULT_MIX,
+    DEFAULT_ROLES,
+    LoadTest,
+    Server,
+    parse_mix,
+    parse_roles,
+    prepare_users,
+    retire_users,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Start crm.wsgi under gunicorn (or use --url), log in load-test users of the chosen roles and replay "
+        "a weighted request mix with many concurrent clients; reports throughput, p50/p95/p99 latency "
+        "and error rate per endpoint. Run with CRM_DB=sqlite or CRM_DB=postgres against seeded data, "
+        "e.g. CRM_DB=sqlite python manage.py loadtest --clients 50 --duration 60. The users get a random "
+        "password for the run and are deactivated afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", help="Test a server that is already running instead of starting gunicorn; "
+                                          "needs --create-users, as the users are created in its database.")
+        parser.add_argument("--create-users", action="store_true",
+                            help="Confirm creating load-test users in the database of the server at --url.")
+        parser.add_argument("--roles", default=",".join(DEFAULT_ROLES).lower(),
+                            help="Roles of the load-test users, e.g. admin,employee,superadmin.")
+        parser.add_argument("--workers", type=int, default=4, help="gunicorn worker processes.")
+        parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker.")
+        parser.add_argument("--clients", type=int, default=20, help="Concurrent clients.")
+        parser.add_argument("--users-per-role", type=int, default=3)
+        parser.add_argument("--duration", type=float, default=30, help="Seconds of load after login.")
+        parser.add_argument("--requests", type=int, help="Stop after this many requests.")
+        parser.add_argument("--think-ms", type=float, default=0, help="Mean pause between a client's requests.")
+        parser.add_argument("--mix", help="Weights, e.g. leads=50,dashboard=10,lead-create=5.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        if options["url"] and not options["create_users"]:
+            raise CommandError(
+                "--url runs against an existing deployment: pass --create-users to create load-test users there."
+            )
+        try:
+            mix = parse_mix(options["mix"]) if options["mix"] else DEFAULT_MIX
+            roles = parse_roles(options["roles"])
+            users = prepare_users(options["users_per_role"], mix, roles)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        def run(url):
+            return LoadTest(
+                url, users, mix,
+                clients=options["clients"],
+                duration=options["duration"],
+                max_requests=options["requests"],
+                think_time=options["think_ms"] / 1000,
+                seed=options["seed"],
+            ).run()
+
+        try:
+            if options["url"]:
+                report = run(options["url"])
+            else:
+                with Server(options["workers"], options["threads"]) as server:
+                    self.stderr.write(f"gunicorn on {server.url} ({options['workers']} workers)")
+                    report = run(server.url)
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+        finally:
+            retire_users(users)
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2)
+        self.stdout.write(
+            f"{report['requests']} requests in {report['seconds']}s from {report['clients']} clients: "
+            f"{report['throughput_rps']} req/s, statuses {report['statuses']}"
+        )
+        self.stdout.write(f"{'endpoint':<14}{'requests':>9}{'req/s':>9}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+        for name, result in report["endpoints"].items():
+            latency = result["latency_ms"]
+            self.stdout.write(
+                f"{name:<14}{result['requests']:>9}{result['throughput_rps'] or '-':>9}"
+                f"{result['error_rate']:>8.1%}{latency['p50']:>9}{latency['p95']:>9}{latency['p99']:>9}{latency['max']:>9}"
+            )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from CRMBackend.rollups import check_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the campaign and account rollup columns (lead_count, won_amount, open_deal_amount, ...) "
+        "with their child rows and recount the parents that drifted, e.g. after raw SQL writes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true",
+                            help="Only report mismatches, and exit non-zero when there are any.")
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        mismatches = check_rollups(repair=not options["check"], using=options["database"])
+        for column, pks in mismatches.items():
+            sample = ", ".join(str(pk) for pk in pks[:10]) + (" ..." if len(pks) > 10 else "")
+            self.stdout.write(f"{column}: {len(pks)} rows differ ({sample})")
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("All rollup columns match their child rows."))
+        elif options["check"]:
+            raise CommandError(f"{sum(len(pks) for pks in mismatches.values())} rollup values are out of date.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {sum(len(pks) for pks in mismatches.values())} rollup values."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from CRMBackend.pipeline import refresh_pipeline_rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh the daily deal stage rollups behind /api/analytics/pipeline/. Recent days are recomputed "
+        "automatically every CRM_PIPELINE_ROLLUP_SECONDS; use --rebuild after seeding or backfilling history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Recompute every day of the stage history.")
+        parser.add_argument("--days", type=int, default=None, help="Recompute the last N days.")
+
+    def handle(self, *args, **options):
+        result = refresh_pipeline_rollup(rebuild=options["rebuild"], days=options["days"])
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {result['days']} days into {result['rows']} rows."))
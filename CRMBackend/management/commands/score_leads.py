@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from CRMBackend.models import Lead
+from CRMBackend.scoring import score_leads
+
+
+class Command(BaseCommand):
+    help = (
+        "Score leads for ?ordering=-score. New and changed leads are scored in the background every "
+        "CRM_LEAD_SCORE_SECONDS; use --all (e.g. nightly) as ages and conversion rates drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Rescore every lead, not only stale ones.")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Leads per batch (default CRM_LEAD_SCORE_BATCH_SIZE).")
+
+    def handle(self, *args, **options):
+        result = score_leads(Lead.objects.all() if options["all"] else None, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {result['scored']} leads ({result['changed']} changed) in {result['seconds']}s."
+        ))
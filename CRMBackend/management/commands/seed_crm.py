@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from CRMBackend.pipeline import refresh_pipeline_rollup
+from CRMBackend.seeding import DEFAULT_COUNTS, Seeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, accounts, contacts, campaigns, leads, deals and tasks "
+        "with skewed owners and regions, using COPY (PostgreSQL) or bulk_create. "
+        "Defaults produce 1M leads, 200k contacts and 50k deals."
+    )
+
+    def add_arguments(self, parser):
+        for entity, count in DEFAULT_COUNTS.items():
+            parser.add_argument(f"--{entity}", type=int, default=count)
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--seed", type=int, default=0, help="Random seed, for reproducible data.")
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--json", action="store_true", help="Print the timing report as JSON.")
+
+    def handle(self, *args, **options):
+        counts = {entity: options[entity] for entity in DEFAULT_COUNTS}
+        if counts["users"] < 1 or counts["accounts"] < 1:
+            raise CommandError("At least one user and one account are needed to own the other rows.")
+        seeder = Seeder(
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            using=options["database"],
+            progress=None if options["json"] else self.stdout.write,
+        )
+        report = seeder.run(counts)
+        if counts["deals"] and options["database"] == "default":
+            # Seeded deals entered their stages in the past, before the incremental refresh window
+            refresh_pipeline_rollup(rebuild=True)
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Seeded {sum(counts.values())} rows (tag {seeder.tag})."))
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from CRMBackend.outbox import prune_outbox, send_pending
+
+# Sent messages are pruned at most this often in --loop mode
+PRUNE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver queued emails (password resets, notifications) in batches over one connection of "
+        "EMAIL_BACKEND, retrying failures with backoff. Runs once by default; --loop keeps polling."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Messages per batch (default CRM_OUTBOX_BATCH_SIZE).")
+        parser.add_argument("--max-attempts", type=int, default=None,
+                            help="Attempts before a message is marked FAILED (default CRM_OUTBOX_MAX_ATTEMPTS).")
+        parser.add_argument("--loop", action="store_true", help="Keep running, polling for new messages.")
+        parser.add_argument("--interval", type=float, default=2.0,
+                            help="Seconds to wait when the outbox is empty in --loop mode.")
+
+    def send_due(self, options):
+        totals = {"sent": 0, "retrying": 0, "failed": 0}
+        while True:
+            result = send_pending(options["batch_size"], options["max_attempts"])
+            for key, value in result.items():
+                totals[key] += value
+            if not any(result.values()):
+                return totals
+
+    def report(self, totals):
+        if any(totals.values()):
+            self.stdout.write(self.style.SUCCESS(
+                f"Sent {totals['sent']} emails, {totals['retrying']} to retry, {totals['failed']} failed."
+            ))
+
+    def handle(self, *args, **options):
+        pruned_at = time.monotonic()
+        pruned = prune_outbox()
+        if not options["loop"]:
+            totals = self.send_due(options)
+            self.report(totals)
+            if not any(totals.values()):
+                self.stdout.write("Outbox is empty.")
+            if pruned:
+                self.stdout.write(f"Pruned {pruned} sent emails.")
+            return
+        try:
+            while True:
+                close_old_connections()
+                self.report(self.send_due(options))
+                if time.monotonic() - pruned_at >= PRUNE_INTERVAL:
+                    pruned_at = time.monotonic()
+                    prune_outbox()
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
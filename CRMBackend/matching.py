@@ -0,0 +1,83 @@
+"""
+Normalized match keys for contacts: lowercased email, E.164 phone and a phonetic name key
+"""
+import re
+import unicodedata
+from typing import Dict, Optional
+
+from django.conf import settings
+
+# Contact fields the keys are derived from, and the key columns
+SOURCE_FIELDS = ("first_name", "last_name", "email", "phone")
+KEY_FIELDS = ("email_key", "phone_key", "name_key")
+
+_SOUNDEX = {letter: digit for digit, letters in (
+    ("1", "BFPV"), ("2", "CGJKQSXZ"), ("3", "DT"), ("4", "L"), ("5", "MN"), ("6", "R"),
+) for letter in letters}
+_EXTENSION = re.compile(r"\s*(?:ext\.?|x|#)\s*\d+\s*$", re.IGNORECASE)
+
+
+def fold(value: Optional[str]) -> str:
+    """Accents stripped and case folded: 'Müller' -> 'muller'."""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().strip()
+
+
+def normalize_email(value: Optional[str]) -> str:
+    return (value or "").strip().lower()
+
+
+def normalize_phone(value: Optional[str], country_code: Optional[str] = None) -> str:
+    """
+    '+49 (0)30 1234-567', '0049 30 1234567' and, with country code 49,
+    '030 1234567' -> '+49301234567'. Extensions are dropped. Without a
+    country code a national number keeps its digits, minus the trunk 0 and
+    without '+'; anything outside 7..15 digits gives ''.
+    """
+    value = _EXTENSION.sub("", (value or "").strip())
+    digits = re.sub(r"\D", "", value)
+    country_code = settings.CRM_DEFAULT_PHONE_COUNTRY_CODE if country_code is None else country_code
+    if value.startswith("+"):
+        # '+44 (0)20 ...': the trunk 0 in parentheses is not dialled internationally
+        digits = re.sub(r"\D", "", re.sub(r"\(0\)", "", value))
+        international = True
+    elif digits.startswith("00"):
+        digits, international = digits[2:], True
+    else:
+        digits, international = digits.lstrip("0"), False
+        if country_code:
+            digits, international = country_code + digits, True
+    if not 7 <= len(digits) <= 15:
+        return ""
+    return f"+{digits}" if international else digits
+
+
+def soundex(word: Optional[str]) -> str:
+    """American Soundex of word: 'Robert' and 'Rupert' -> 'R163'; '' without letters."""
+    letters = [c for c in fold(word).upper() if "A" <= c <= "Z"]
+    if not letters:
+        return ""
+    code, last = letters[0], _SOUNDEX.get(letters[0], "")
+    for letter in letters[1:]:
+        digit = _SOUNDEX.get(letter, "")
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if letter not in "HW":
+            last = digit
+    return code.ljust(4, "0")
+
+
+def name_key(first_name: Optional[str], last_name: Optional[str]) -> str:
+    """Soundex of the first and last name: 'Jon Smyth' and 'John Smith' -> 'J500S530'."""
+    first, last = soundex(first_name), soundex(last_name)
+    return f"{first or '0000'}{last or '0000'}" if first or last else ""
+
+
+def match_keys(first_name=None, last_name=None, email=None, phone=None) -> Dict[str, str]:
+    return {
+        "email_key": normalize_email(email),
+        "phone_key": normalize_phone(phone),
+        "name_key": name_key(first_name, last_name),
+    }
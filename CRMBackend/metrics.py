@@ -0,0 +1,133 @@
+"""
+Prometheus metrics for the API, caches and the Facebook sync, served at /metrics
+"""
+import ipaddress
+import os
+import re
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# With several gunicorn workers set PROMETHEUS_MULTIPROC_DIR (and use
+# crm/gunicorn_conf.py): every worker then writes its samples to mmap files
+# there and /metrics adds them up, whichever worker answers the scrape.
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+REQUEST_LATENCY = Histogram(
+    "crm_http_request_duration_seconds",
+    "Request latency by view",
+    ["method", "view", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Histogram(
+    "crm_db_queries_per_request",
+    "Queries run by sampled requests",
+    ["view"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250),
+)
+DB_TIME = Histogram(
+    "crm_db_time_per_request_seconds",
+    "Time spent in the database by sampled requests",
+    ["view"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_REPLICA_LAG = Gauge(
+    "crm_db_replica_lag_seconds",
+    "Last measured replication lag per replica alias, -1 when unreachable",
+    ["alias"],
+    multiprocess_mode="max",
+)
+CACHE_LOOKUPS = Counter(
+    "crm_cache_lookups_total",
+    "Response cache and ETag memo lookups",
+    ["cache", "result"],
+)
+GRAPH_CALLS = Counter(
+    "crm_facebook_graph_calls_total",
+    "Graph API calls by edge and outcome",
+    ["edge", "outcome"],
+)
+GRAPH_LATENCY = Histogram(
+    "crm_facebook_graph_call_duration_seconds",
+    "Graph API call latency",
+    ["edge"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+GRAPH_THROTTLED = Counter(
+    "crm_facebook_graph_throttled_total",
+    "Graph API calls refused by rate limiting",
+    ["edge"],
+)
+SYNC_ROWS = Counter(
+    "crm_facebook_sync_rows_total",
+    "Rows written by the Facebook sync",
+    ["entity", "op"],
+)
+
+# Graph error codes for app, user, page and ad account rate limits
+THROTTLE_CODES = {4, 17, 32, 613} | set(range(80000, 80015))
+_ID_SEGMENT = re.compile(r"^(act_)?\d+$")
+
+
+def view_label(request) -> str:
+    """URL name of the resolved view; bounded, unlike the path."""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match._func_path
+
+
+def graph_edge(endpoint: str) -> str:
+    """Graph endpoint with object ids replaced, e.g. 123/leadgen_forms -> {id}/leadgen_forms."""
+    return "/".join("{id}" if _ID_SEGMENT.match(part) else part for part in endpoint.split("/"))
+
+
+def observe_graph_call(endpoint: str, duration: float, status_code, error_code=None) -> None:
+    edge = graph_edge(endpoint)
+    GRAPH_LATENCY.labels(edge).observe(duration)
+    if status_code == 429 or error_code in THROTTLE_CODES:
+        GRAPH_THROTTLED.labels(edge).inc()
+        outcome = "throttled"
+    elif status_code is None:
+        outcome = "network_error"
+    elif status_code >= 400:
+        outcome = "error"
+    else:
+        outcome = "ok"
+    GRAPH_CALLS.labels(edge, outcome).inc()
+
+
+def _internal(request) -> bool:
+    """Sent straight from a loopback or private address, not relayed by a proxy."""
+    if "HTTP_X_FORWARDED_FOR" in request.META:
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_private
+
+
+def metrics_allowed(request) -> bool:
+    token = settings.CRM_METRICS_TOKEN
+    if token:
+        return request.headers.get("Authorization") == f"Bearer {token}"
+    return settings.CRM_METRICS_PUBLIC or _internal(request)
+
+
+def metrics_view(request):
+    """
+    Prometheus text format. When CRM_METRICS_TOKEN is set the scraper has to
+    send it as a bearer token; without one only scrapes from internal
+    addresses are answered, unless CRM_METRICS_PUBLIC opens the endpoint.
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
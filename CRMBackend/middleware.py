@@ -0,0 +1,258 @@
+"""
+Per-request instrumentation: latency metrics, SQL query count, DB time, repeated statements
+and the on-demand profiler; read replica routing
+"""
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from . import db_router
+from .metrics import DB_QUERIES, DB_TIME, REQUEST_LATENCY, view_label
+from .profiling import RequestProfile, profile_requested, profiling_allowed
+
+logger = logging.getLogger("crm.sql")
+
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+_IN_LIST = re.compile(r"IN \((?:%s, )*%s\)")
+
+
+def fingerprint(sql: str) -> str:
+    """SQL shape: parameters are already placeholders, only IN lists vary in length."""
+    return _IN_LIST.sub("IN (...)", sql)
+
+
+class QueryRecorder:
+    """execute_wrapper that times every statement and counts identical ones."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            # Keyed on the raw string: a dict lookup per query, fingerprinting happens once at the end
+            self.statements[sql] = self.statements.get(sql, 0) + 1
+
+    def repeated(self, threshold: int) -> list:
+        """(count, fingerprint) of statement shapes run more than threshold times, most frequent first."""
+        shapes = {}
+        for sql, count in self.statements.items():
+            shape = fingerprint(sql)
+            shapes[shape] = shapes.get(shape, 0) + count
+        return sorted(((count, shape) for shape, count in shapes.items() if count > threshold), reverse=True)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Wraps a sample of requests (CRM_SQL_SAMPLE_RATE) with execute_wrapper on
+    every database connection. Sampled responses get a Server-Timing header
+    (db and app durations, query count) under DEBUG or for staff users, as
+    it tells how the server spends its time; requests slower than
+    CRM_SQL_SLOW_REQUEST_MS and statements repeated more than
+    CRM_SQL_N_PLUS_ONE_THRESHOLD times, the usual N+1 shape, are logged to
+    the "crm.sql" logger. Unsampled requests only pay for one random().
+    Works for sync and async views; queries made while a streaming response
+    is iterated are not counted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _sampled(self) -> bool:
+        rate = settings.CRM_SQL_SAMPLE_RATE
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    @staticmethod
+    def _show_timing(request) -> bool:
+        if not settings.CRM_SQL_SERVER_TIMING:
+            return False
+        if settings.DEBUG:
+            return True
+        user = getattr(request, "user", None)
+        return bool(user and user.is_authenticated and (user.is_staff or user.is_superuser))
+
+    def _wrap(self, stack, recorder):
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            self._wrap(stack, recorder)
+            response = self.get_response(request)
+        return self._report(request, response, recorder, time.perf_counter() - start, self._show_timing(request))
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        # Connections belong to the thread that runs the request's sync code
+        # (the async ORM included), so wrap and unwrap them from that thread.
+        stack = ExitStack()
+        await sync_to_async(self._wrap)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        elapsed = time.perf_counter() - start
+        # request.user may still have to be loaded from the session
+        show_timing = await sync_to_async(self._show_timing)(request)
+        return self._report(request, response, recorder, elapsed, show_timing)
+
+    def _report(self, request, response, recorder, elapsed, show_timing):
+        db_ms = recorder.duration * 1000
+        total_ms = elapsed * 1000
+        view = view_label(request)
+        DB_QUERIES.labels(view).observe(recorder.count)
+        DB_TIME.labels(view).observe(recorder.duration)
+        if show_timing:
+            timing = f'db;dur={db_ms:.1f};desc="{recorder.count} queries", app;dur={total_ms - db_ms:.1f}'
+            existing = response.get("Server-Timing")
+            response["Server-Timing"] = f"{existing}, {timing}" if existing else timing
+
+        repeated = recorder.repeated(settings.CRM_SQL_N_PLUS_ONE_THRESHOLD)
+        for count, shape in repeated:
+            logger.warning("Possible N+1 on %s %s: %d x %s", request.method, request.path, count, shape[:500])
+        if total_ms >= settings.CRM_SQL_SLOW_REQUEST_MS:
+            logger.warning(
+                "Slow request %s %s: %.0f ms, %d queries, %.0f ms in db",
+                request.method, request.path, total_ms, recorder.count, db_ms,
+            )
+        return response
+
+
+class RequestMetricsMiddleware:
+    """Observes every request in the crm_http_request_duration_seconds histogram, labelled by view name."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, time.perf_counter() - start)
+        return response
+
+    def _observe(self, request, response, elapsed):
+        method = request.method if request.method in HTTP_METHODS else "OTHER"
+        REQUEST_LATENCY.labels(method, view_label(request), response.status_code).observe(elapsed)
+
+
+class ProfilerMiddleware:
+    """
+    Profiles a request when a superuser adds ?__profile=1 (or the
+    X-CRM-Profile: 1 header): stack samples, every SQL statement and the
+    tracemalloc peak, stored under CRM_PROFILE_DIR; ?__profile=inline
+    returns the profile instead of the response. Other requests only pay
+    for the query string check.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mode = profile_requested(request)
+        if mode is None or not profiling_allowed(request):
+            return self.get_response(request)
+        profile = RequestProfile(request, thread_ids={threading.get_ident()})
+        profile.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.stop()
+        return profile.finish(response, mode)
+
+    async def __acall__(self, request):
+        mode = profile_requested(request)
+        if mode is None or not await sync_to_async(profiling_allowed)(request):
+            return await self.get_response(request)
+        # The request's code runs on the event loop and in sync_to_async
+        # threads, so every thread is sampled.
+        profile = RequestProfile(request)
+        await sync_to_async(profile.start)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(profile.stop)()
+        return await sync_to_async(profile.finish)(response, mode)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets ReplicaRouter send the reads of safe requests to a replica and,
+    after a successful write, pins the user to the primary for
+    CRM_DB_STICKY_SECONDS so they read their own writes.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = db_router.start_request(request)
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            db_router.end_request(request, response, token)
+        return response
+
+    async def __acall__(self, request):
+        token = db_router.start_request(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            db_router.end_request(request, response, token)
+        return response
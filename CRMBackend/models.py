@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import (
     AbstractBaseUser,
     PermissionsMixin,
@@ -6,6 +6,25 @@ from django.contrib.auth.models import (
 )
 from django.utils import timezone
 
+from .matching import KEY_FIELDS, SOURCE_FIELDS, match_keys
+from .rollups import RollupMixin, RollupParentMixin, RollupQuerySet
+
+
+def SET_NULL_AND_TOUCH(collector, field, sub_objs, using):
+    """
+    on_delete=SET_NULL that also refreshes updated_at on the affected rows,
+    so their row version changes along with the foreign key. Like SET_NULL,
+    sub_objs stays an unevaluated queryset and each update is one UPDATE
+    rather than a load of every child row. The touch is queued first: the
+    updates run in order, and once the key is cleared the queryset matches
+    nothing.
+    """
+    collector.add_field_update(field.model._meta.get_field("updated_at"), timezone.now(), sub_objs)
+    collector.add_field_update(field, None, sub_objs)
+
+
+SET_NULL_AND_TOUCH.lazy_sub_objs = True
+
 
 # =========================
 # Custom User
@@ -44,6 +63,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = UserManager()
 
@@ -110,24 +130,58 @@ class FacebookIntegration(models.Model):
 # =========================
 # Account & Contact
 # =========================
-class Account(models.Model):
+class Account(RollupParentMixin, models.Model):
     """A company or organization you do business with."""
 
     name = models.CharField(max_length=255)
     region = models.CharField(max_length=64, blank=True, null=True)
     owner = models.ForeignKey(
-        User, null=True, blank=True, on_delete=models.SET_NULL, related_name="accounts"
+        User, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="accounts"
     )
     # Facebook integration fields
     facebook_page_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
     facebook_synced_at = models.DateTimeField(null=True, blank=True)
+    # Rollups of the children, maintained by rollups.py
+    contact_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    open_deal_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False, db_index=True)
+    open_task_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
 
-class Contact(models.Model):
+class ContactQuerySet(RollupQuerySet):
+    """
+    Keeps the match keys right for bulk writes: bulk_create derives them
+    from the new rows, update() (and so bulk_update()) rederives them for
+    the rows whose name, email or phone it sets.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.set_match_keys()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def update(self, **kwargs):
+        if not set(SOURCE_FIELDS).intersection(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            pks = list(self.select_for_update(of=("self",)).order_by().values_list("pk", flat=True))
+            rows = super().update(**kwargs)
+            for start in range(0, len(pks), 1000):
+                contacts = list(self.model._base_manager.using(self.db).filter(pk__in=pks[start:start + 1000]).only(
+                    *SOURCE_FIELDS
+                ))
+                for contact in contacts:
+                    contact.set_match_keys()
+                self.model._base_manager.using(self.db).bulk_update(contacts, KEY_FIELDS)
+        return rows
+
+
+class Contact(RollupMixin, models.Model):
     """A person who works at an account (customer contact)."""
 
     account = models.ForeignKey(
@@ -141,22 +195,49 @@ class Contact(models.Model):
     # Facebook integration fields
     facebook_user_id = models.CharField(max_length=100, blank=True, null=True)
     facebook_synced_at = models.DateTimeField(null=True, blank=True)
+    # Normalized match keys for deduplication, derived from the fields above (see matching.py)
+    email_key = models.CharField(max_length=254, blank=True, default="", editable=False)
+    phone_key = models.CharField(max_length=16, blank=True, default="", editable=False)
+    name_key = models.CharField(max_length=8, blank=True, default="", editable=False)
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ContactQuerySet.as_manager()
+
+    class Meta:
+        # Duplicates are looked for within an account, one key at a time
+        indexes = [
+            models.Index(fields=["account", "email_key"]),
+            models.Index(fields=["account", "phone_key"]),
+            models.Index(fields=["account", "name_key"]),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    def set_match_keys(self):
+        for field, value in match_keys(self.first_name, self.last_name, self.email, self.phone).items():
+            setattr(self, field, value)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or set(SOURCE_FIELDS).intersection(update_fields):
+            self.set_match_keys()
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, *KEY_FIELDS}
+        super().save(*args, **kwargs)
+
 
 # =========================
 # Campaigns
 # =========================
-class Campaign(models.Model):
+class Campaign(RollupParentMixin, models.Model):
     """Marketing campaign that generates leads."""
 
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     owner = models.ForeignKey(
-        User, on_delete=models.SET_NULL, null=True, related_name="campaigns"
+        User, on_delete=SET_NULL_AND_TOUCH, null=True, related_name="campaigns"
     )
     accounts = models.ManyToManyField(Account, blank=True, related_name="campaigns")
     start_date = models.DateField(null=True, blank=True)
@@ -166,7 +247,12 @@ class Campaign(models.Model):
     facebook_campaign_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
     facebook_ad_set_id = models.CharField(max_length=100, blank=True, null=True)
     facebook_synced_at = models.DateTimeField(null=True, blank=True)
+    # Rollups of the children, maintained by rollups.py
+    lead_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    deal_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    won_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False, db_index=True)
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -175,7 +261,7 @@ class Campaign(models.Model):
 # =========================
 # Leads
 # =========================
-class Lead(models.Model):
+class Lead(RollupMixin, models.Model):
     """Potential sales opportunity from a campaign or contact."""
 
     STATUS = (
@@ -189,22 +275,32 @@ class Lead(models.Model):
     description = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS, default="NEW")
     owner = models.ForeignKey(
-        User, null=True, blank=True, on_delete=models.SET_NULL, related_name="leads"
+        User, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="leads"
     )
     campaign = models.ForeignKey(
-        Campaign, null=True, blank=True, on_delete=models.SET_NULL, related_name="leads"
+        Campaign, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="leads"
     )
     account = models.ForeignKey(
-        Account, null=True, blank=True, on_delete=models.SET_NULL, related_name="leads"
+        Account, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="leads"
     )
     contact = models.ForeignKey(
-        Contact, null=True, blank=True, on_delete=models.SET_NULL, related_name="leads"
+        Contact, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="leads"
     )
     # Facebook integration fields
     facebook_lead_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
     facebook_lead_form_id = models.CharField(max_length=100, blank=True, null=True)
     facebook_synced_at = models.DateTimeField(null=True, blank=True)
+    # Likelihood to convert, 0..100, written in batches by scoring.py
+    score = models.PositiveSmallIntegerField(default=0, editable=False)
+    scored_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = RollupQuerySet.as_manager()
+
+    class Meta:
+        # ?ordering=-score reads the best leads straight off this index
+        indexes = [models.Index(fields=["-score", "-created_at"])]
 
     def __str__(self):
         return self.title
@@ -213,7 +309,73 @@ class Lead(models.Model):
 # =========================
 # Deals
 # =========================
-class Deal(models.Model):
+class DealQuerySet(RollupQuerySet):
+    """
+    Keeps the stage history for bulk writes, which skip Deal.save():
+    bulk_create logs the stage each deal starts in, update() (and so
+    bulk_update()) logs the rows whose stage it changes. Writers that skip
+    bulk_create too (COPY) call log_created() themselves.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.stage_changed_at = obj.created_at
+        objs = super().bulk_create(objs, *args, **kwargs)
+        self.log_created([obj for obj in objs if obj.pk is not None])
+        return objs
+
+    def log_created(self, objs=None):
+        """Log the stage each of objs (default: the deals in this queryset) was created in."""
+        if objs is None:
+            objs = self.order_by().only(
+                "stage", "owner", "campaign", "account", "amount", "created_at"
+            ).iterator(chunk_size=1000)
+        DealStageChange.objects.using(self.db).bulk_create(
+            [DealStageChange.entered(obj, "", None, obj.created_at) for obj in objs],
+            batch_size=1000,
+        )
+
+    def update(self, **kwargs):
+        if "stage" not in kwargs:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            before = {
+                pk: (stage, since)
+                for pk, stage, since in self.select_for_update(of=("self",)).order_by()
+                .values_list("pk", "stage", "stage_changed_at")
+            }
+            rows = super().update(**kwargs)
+            now = timezone.now()
+            changes = []
+            pks = list(before)
+            for start in range(0, len(pks), 1000):
+                for deal in self.model._base_manager.using(self.db).filter(pk__in=pks[start:start + 1000]).only(
+                    "stage", "owner", "campaign", "account", "amount"
+                ):
+                    from_stage, since = before[deal.pk]
+                    if deal.stage != from_stage:
+                        changes.append(DealStageChange.entered(deal, from_stage, since, now))
+            if changes:
+                from .changes import record_changes
+
+                changed = [change.deal_id for change in changes]
+                self.model._base_manager.using(self.db).filter(pk__in=changed).update(stage_changed_at=now)
+                DealStageChange.objects.using(self.db).bulk_create(changes, batch_size=1000)
+                # Queryset updates send no post_save; super().update() has invalidated the cache
+                record_changes(self.model, changed, "U")
+        return rows
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        # Stage changes are logged by update(), which bulk_update() runs for each batch
+        objs = list(objs)
+        rows = super().bulk_update(objs, fields, batch_size)
+        for obj in objs:
+            obj._loaded_stage = obj.stage
+        return rows
+
+
+class Deal(RollupMixin, models.Model):
     """Sales opportunity typically converted from a qualified lead."""
 
     STAGE = (
@@ -229,53 +391,262 @@ class Deal(models.Model):
     stage = models.CharField(max_length=20, choices=STAGE, default="PROSPECT")
     account = models.ForeignKey(Account, related_name="deals", on_delete=models.CASCADE)
     lead = models.ForeignKey(
-        Lead, null=True, blank=True, on_delete=models.SET_NULL, related_name="deals"
+        Lead, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="deals"
     )
     contact = models.ForeignKey(
-        Contact, null=True, blank=True, on_delete=models.SET_NULL, related_name="deals"
+        Contact, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="deals"
     )
     owner = models.ForeignKey(
-        User, null=True, blank=True, on_delete=models.SET_NULL, related_name="deals"
+        User, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="deals"
     )
     campaign = models.ForeignKey(
-        Campaign, null=True, blank=True, on_delete=models.SET_NULL, related_name="deals"
+        Campaign, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="deals"
     )
     close_date = models.DateField(null=True, blank=True)
     # Facebook integration fields
     facebook_event_id = models.CharField(max_length=100, blank=True, null=True)
     facebook_synced_at = models.DateTimeField(null=True, blank=True)
+    # When the deal entered its current stage
+    stage_changed_at = models.DateTimeField(default=timezone.now, editable=False)
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = DealQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.title} ({self.stage})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        deal = super().from_db(db, field_names, values)
+        # The stage as loaded, so save() can tell whether it changed
+        deal._loaded_stage = deal.__dict__.get("stage")
+        return deal
+
+    def save(self, *args, **kwargs):
+        """Save, logging a DealStageChange when the deal is created or its stage changes."""
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "stage" not in update_fields:
+            return super().save(*args, **kwargs)
+        using = kwargs.get("using") or self._state.db or "default"
+        with transaction.atomic(using=using):
+            if self._state.adding:
+                self.stage_changed_at = self.created_at
+                change = ("", None, self.created_at)
+            else:
+                from_stage = getattr(self, "_loaded_stage", None)
+                since = self.stage_changed_at
+                if from_stage is None:
+                    from_stage, since = Deal._base_manager.using(using).filter(pk=self.pk).values_list(
+                        "stage", "stage_changed_at"
+                    ).first() or (self.stage, since)
+                change = None
+                if from_stage != self.stage:
+                    change = (from_stage, since, timezone.now())
+                    self.stage_changed_at = change[2]
+                    if update_fields is not None:
+                        kwargs["update_fields"] = {*update_fields, "stage_changed_at"}
+            super().save(*args, **kwargs)
+            if change is not None:
+                DealStageChange.entered(self, *change).save(using=using)
+        self._loaded_stage = self.stage
+
 
 # =========================
 # Tasks / Activities
 # =========================
-class Task(models.Model):
+class Task(RollupMixin, models.Model):
     """Action items linked to any entity (Lead, Deal, Campaign, Account)."""
 
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     assigned_to = models.ForeignKey(
-        User, null=True, blank=True, on_delete=models.SET_NULL, related_name="tasks"
+        User, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="tasks"
     )
     due_date = models.DateField(null=True, blank=True)
     completed = models.BooleanField(default=False)
     related_lead = models.ForeignKey(
-        Lead, null=True, blank=True, on_delete=models.SET_NULL, related_name="tasks"
+        Lead, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="tasks"
     )
     related_deal = models.ForeignKey(
-        Deal, null=True, blank=True, on_delete=models.SET_NULL, related_name="tasks"
+        Deal, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="tasks"
     )
     related_campaign = models.ForeignKey(
-        Campaign, null=True, blank=True, on_delete=models.SET_NULL, related_name="tasks"
+        Campaign, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="tasks"
     )
     related_account = models.ForeignKey(
-        Account, null=True, blank=True, on_delete=models.SET_NULL, related_name="tasks"
+        Account, null=True, blank=True, on_delete=SET_NULL_AND_TOUCH, related_name="tasks"
     )
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = RollupQuerySet.as_manager()
 
     def __str__(self):
         return self.title
+
+
+# =========================
+# Pipeline analytics
+# =========================
+class DealStageChange(models.Model):
+    """
+    Append-only log of the stages deals enter. from_stage is "" for the
+    stage a deal was created in; owner, campaign, account and amount are
+    the deal's at the time of the change.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    # History outlives the deal
+    deal = models.ForeignKey(
+        Deal, on_delete=models.DO_NOTHING, db_constraint=False, related_name="stage_changes"
+    )
+    from_stage = models.CharField(max_length=20, blank=True)
+    to_stage = models.CharField(max_length=20, choices=Deal.STAGE)
+    owner = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    campaign = models.ForeignKey(Campaign, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    account = models.ForeignKey(Account, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Time spent in from_stage
+    dwell_seconds = models.FloatField(null=True, blank=True)
+    changed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @classmethod
+    def entered(cls, deal, from_stage, since, changed_at):
+        """The change of deal from from_stage (entered at since) to its current stage at changed_at."""
+        return cls(
+            deal_id=deal.pk,
+            from_stage=from_stage,
+            to_stage=deal.stage,
+            owner_id=deal.owner_id,
+            campaign_id=deal.campaign_id,
+            account_id=deal.account_id,
+            amount=deal.amount,
+            dwell_seconds=(changed_at - since).total_seconds() if from_stage and since else None,
+            changed_at=changed_at,
+        )
+
+    def __str__(self):
+        return f"Deal {self.deal_id}: {self.from_stage or '-'} -> {self.to_stage}"
+
+
+class DealStageDaily(models.Model):
+    """
+    Daily rollup of DealStageChange per stage, owner, campaign and account:
+    deals that entered the stage (created: as new deals) and that left it,
+    where they went, and the total time they had spent in it.
+    """
+
+    day = models.DateField()
+    stage = models.CharField(max_length=20, choices=Deal.STAGE)
+    owner = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    campaign = models.ForeignKey(Campaign, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    account = models.ForeignKey(Account, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    entered = models.PositiveIntegerField(default=0)
+    entered_amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    created = models.PositiveIntegerField(default=0)
+    exited = models.PositiveIntegerField(default=0)
+    # Exits to a later stage (including WON) and to LOST
+    advanced = models.PositiveIntegerField(default=0)
+    lost = models.PositiveIntegerField(default=0)
+    dwell_seconds = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=["day", "stage"])]
+
+    def __str__(self):
+        return f"{self.day} {self.stage}"
+
+
+# =========================
+# Facebook insights
+# =========================
+class FacebookInsightDaily(models.Model):
+    """
+    One day of one Facebook metric (page insights, or ad insights such as
+    spend and clicks) for a page or ad campaign, keyed by the Facebook id.
+    account / campaign point at the CRM row the object was synced into,
+    for joins with leads and deals.
+    """
+
+    PAGE = "page"
+    CAMPAIGN = "campaign"
+    OBJECT_TYPES = ((PAGE, "Page"), (CAMPAIGN, "Ad campaign"))
+
+    object_type = models.CharField(max_length=8, choices=OBJECT_TYPES)
+    object_id = models.CharField(max_length=100)
+    metric = models.CharField(max_length=100)
+    day = models.DateField()
+    value = models.DecimalField(max_digits=20, decimal_places=4)
+    account = models.ForeignKey(Account, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    campaign = models.ForeignKey(Campaign, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    fetched_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["object_type", "object_id", "metric", "day"], name="facebook_insight_key"),
+        ]
+        indexes = [
+            models.Index(fields=["campaign", "metric", "day"]),
+            models.Index(fields=["account", "metric", "day"]),
+        ]
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_id} {self.metric} {self.day}"
+
+
+# =========================
+# Change log (delta sync)
+# =========================
+class ChangeLogEntry(models.Model):
+    """One create/update/delete of a synced CRM row; the id is the sync position."""
+
+    OP = (
+        ("C", "Created"),
+        ("U", "Updated"),
+        ("D", "Deleted"),
+    )
+    id = models.BigAutoField(primary_key=True)
+    entity = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    op = models.CharField(max_length=1, choices=OP)
+    changed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["entity", "object_id"])]
+
+    def __str__(self):
+        return f"{self.entity}:{self.object_id} {self.op}"
+
+
+# =========================
+# Email outbox
+# =========================
+class OutboxEmail(models.Model):
+    """An email queued by a request and delivered by manage.py send_outbox."""
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        SENDING = "SENDING", "Sending"
+        SENT = "SENT", "Sent"
+        FAILED = "FAILED", "Failed"
+
+    id = models.BigAutoField(primary_key=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # When the message may next be picked up; for SENDING rows, when the claim expires
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
@@ -0,0 +1,136 @@
+"""
+Email outbox: requests queue messages in the database and manage.py send_outbox delivers them in batches
+"""
+import logging
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger("crm.mail")
+
+# Longest wait between two attempts at one message
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+
+def queue_mail(subject: str, message: str, recipient_list: List[str], from_email: Optional[str] = None,
+               html_message: Optional[str] = None) -> OutboxEmail:
+    """
+    send_mail() without the SMTP round trip: the message is stored with the
+    caller's transaction and sent by the outbox worker.
+    """
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=message,
+        html_body=html_message or "",
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(recipient_list),
+    )
+
+
+def claim_batch(batch_size: int) -> List[OutboxEmail]:
+    """
+    Mark up to batch_size due messages as SENDING and return them. Rows
+    locked by another worker are skipped where the database supports it;
+    a claim expires after CRM_OUTBOX_CLAIM_SECONDS, so messages of a worker
+    that died mid-batch are picked up again.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutboxEmail.objects.filter(
+            status__in=(OutboxEmail.Status.PENDING, OutboxEmail.Status.SENDING), next_attempt_at__lte=now,
+        ).order_by("next_attempt_at", "id")
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        batch = list(due[:batch_size])
+        if batch:
+            OutboxEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+                status=OutboxEmail.Status.SENDING,
+                attempts=F("attempts") + 1,
+                next_attempt_at=now + timedelta(seconds=settings.CRM_OUTBOX_CLAIM_SECONDS),
+            )
+    for email in batch:
+        email.attempts += 1
+    return batch
+
+
+def _message(email: OutboxEmail, mail_connection) -> EmailMultiAlternatives:
+    message = EmailMultiAlternatives(
+        email.subject, email.body, email.from_email, email.to, connection=mail_connection
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, "text/html")
+    return message
+
+
+def _failed(email: OutboxEmail, error: str, max_attempts: int) -> None:
+    """Schedule the next attempt with exponential backoff, or give up after max_attempts."""
+    email.last_error = error[:2000]
+    if email.attempts >= max_attempts:
+        email.status = OutboxEmail.Status.FAILED
+        logger.error("Giving up on outbox email %s after %s attempts: %s", email.pk, email.attempts, error)
+        return
+    delay = timedelta(seconds=settings.CRM_OUTBOX_RETRY_BACKOFF * 2 ** (email.attempts - 1))
+    email.status = OutboxEmail.Status.PENDING
+    email.next_attempt_at = timezone.now() + min(delay, MAX_RETRY_DELAY)
+
+
+def send_pending(batch_size: Optional[int] = None, max_attempts: Optional[int] = None) -> Dict[str, int]:
+    """
+    Send one batch of due messages over a single connection of
+    EMAIL_BACKEND. Each message succeeds or fails on its own; failures are
+    retried with backoff up to max_attempts.
+    """
+    batch_size = batch_size or settings.CRM_OUTBOX_BATCH_SIZE
+    max_attempts = max_attempts or settings.CRM_OUTBOX_MAX_ATTEMPTS
+    batch = claim_batch(batch_size)
+    result = {"sent": 0, "retrying": 0, "failed": 0}
+    if not batch:
+        return result
+
+    sent, failed = [], []
+    mail_connection = get_connection(fail_silently=False)
+    try:
+        mail_connection.open()
+    except Exception as exc:
+        logger.warning("Email backend unavailable, %s outbox emails rescheduled: %s", len(batch), exc)
+        failed = batch
+        for email in batch:
+            _failed(email, f"{type(exc).__name__}: {exc}", max_attempts)
+    else:
+        try:
+            for email in batch:
+                try:
+                    if not mail_connection.send_messages([_message(email, mail_connection)]):
+                        raise ValueError("The email backend did not send the message")
+                except Exception as exc:
+                    _failed(email, f"{type(exc).__name__}: {exc}", max_attempts)
+                    failed.append(email)
+                else:
+                    sent.append(email.pk)
+        finally:
+            mail_connection.close()
+
+    if sent:
+        OutboxEmail.objects.filter(pk__in=sent).update(
+            status=OutboxEmail.Status.SENT, sent_at=timezone.now(), last_error=""
+        )
+    if failed:
+        OutboxEmail.objects.bulk_update(failed, ["status", "next_attempt_at", "last_error"])
+    result["sent"] = len(sent)
+    result["failed"] = sum(1 for email in failed if email.status == OutboxEmail.Status.FAILED)
+    result["retrying"] = len(failed) - result["failed"]
+    return result
+
+
+def prune_outbox(days: Optional[int] = None) -> int:
+    """Delete messages sent more than days (CRM_OUTBOX_RETENTION_DAYS) ago."""
+    days = settings.CRM_OUTBOX_RETENTION_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    return OutboxEmail.objects.filter(status=OutboxEmail.Status.SENT, sent_at__lt=cutoff).delete()[0]
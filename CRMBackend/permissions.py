@@ -1,3 +1,4 @@
+from django.db.models import Q
 from rest_framework import permissions
 
 class IsSuperAdmin(permissions.BasePermission):
@@ -36,3 +37,37 @@ class IsAdminOrOwner(permissions.BasePermission):
             if getattr(obj, 'owner', None) == user or getattr(obj, 'assigned_to', None) == user:
                 return True
         return False
+
+
+def scope_queryset(queryset, user):
+    """
+    Queryset counterpart of IsAdminOrOwner.has_object_permission, for
+    endpoints that read many rows at once and cannot check them one by one.
+    """
+    if not user.is_authenticated:
+        return queryset.none()
+    if user.role == user.Role.SUPERADMIN:
+        return queryset
+
+    model = queryset.model
+    field_names = {f.name for f in model._meta.get_fields()}
+    own = Q(pk__in=[])
+    if user.role == user.Role.EMPLOYEE:
+        if 'owner' in field_names:
+            own |= Q(owner=user)
+        if 'assigned_to' in field_names:
+            own |= Q(assigned_to=user)
+
+    if 'account' in field_names:
+        if user.role == user.Role.ADMIN:
+            visible = Q(account__in=user.allowed_accounts.all())
+            if user.region:
+                visible |= Q(account__region=user.region)
+            return queryset.filter(visible)
+        return queryset.filter(own)
+    if 'accounts' in field_names:
+        visible = Q(accounts__in=user.allowed_accounts.all())
+        if user.region:
+            visible |= Q(accounts__region=user.region)
+        return queryset.filter(pk__in=model.objects.filter(visible).values('pk'))
+    return queryset.filter(own)
@@ -0,0 +1,210 @@
+"""
+Pipeline analytics: daily rollups of the deal stage history and /api/analytics/pipeline/
+"""
+import logging
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .models import Deal, DealStageChange, DealStageDaily
+from .permissions import scope_queryset
+
+logger = logging.getLogger("crm.pipeline")
+
+ROLLUP_LOCK_KEY = "crm:pipeline-rollup"
+
+STAGES = [stage for stage, _ in Deal.STAGE]
+OPEN_STAGES = ["PROSPECT", "QUALIFICATION", "PROPOSAL", "NEGOTIATION"]
+_ORDER = {stage: n for n, stage in enumerate(STAGES)}
+
+
+def _day_bounds(day: date):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def rollup_day(day: date) -> int:
+    """Replace the DealStageDaily rows of day with fresh aggregates of its stage changes; returns the row count."""
+    start, end = _day_bounds(day)
+    changes = DealStageChange.objects.filter(changed_at__gte=start, changed_at__lt=end).order_by()
+    rows = {}
+
+    def row(stage, owner, campaign, account):
+        key = (stage, owner, campaign, account)
+        if key not in rows:
+            rows[key] = DealStageDaily(day=day, stage=stage, owner_id=owner, campaign_id=campaign, account_id=account)
+        return rows[key]
+
+    for entry in changes.values("to_stage", "owner", "campaign", "account").annotate(
+        n=Count("id"), amount=Sum("amount"), created=Count("id", filter=Q(from_stage=""))
+    ):
+        daily = row(entry["to_stage"], entry["owner"], entry["campaign"], entry["account"])
+        daily.entered += entry["n"]
+        daily.entered_amount += entry["amount"] or 0
+        daily.created += entry["created"]
+    exits = changes.exclude(from_stage="").values("from_stage", "to_stage", "owner", "campaign", "account")
+    for exit_ in exits.annotate(n=Count("id"), dwell=Sum("dwell_seconds")):
+        daily = row(exit_["from_stage"], exit_["owner"], exit_["campaign"], exit_["account"])
+        daily.exited += exit_["n"]
+        daily.dwell_seconds += exit_["dwell"] or 0
+        if exit_["to_stage"] == "LOST":
+            daily.lost += exit_["n"]
+        elif _ORDER.get(exit_["to_stage"], -1) > _ORDER.get(exit_["from_stage"], -1):
+            daily.advanced += exit_["n"]
+
+    with transaction.atomic():
+        DealStageDaily.objects.filter(day=day).delete()
+        DealStageDaily.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
+
+
+def refresh_pipeline_rollup(rebuild: bool = False, days: Optional[int] = None) -> Dict[str, int]:
+    """
+    Bring DealStageDaily up to date. Stage changes are logged as they
+    happen, so only the days from the last rolled-up day minus
+    CRM_PIPELINE_ROLLUP_REFRESH_DAYS (or the last `days` days) through today
+    are recomputed; that also covers changes committed after the previous
+    run. rebuild recomputes every day of the history, e.g. after seeding
+    or backfilling changes with past timestamps.
+    """
+    today = timezone.localdate()
+    history = DealStageChange.objects.aggregate(first=Min("changed_at"))["first"]
+    if history is None:
+        return {"days": 0, "rows": 0}
+    first = timezone.localdate(history)
+    if days is not None:
+        first = max(first, today - timedelta(days=days - 1))
+    elif not rebuild:
+        last = DealStageDaily.objects.aggregate(last=Max("day"))["last"]
+        if last is not None:
+            first = max(first, last - timedelta(days=settings.CRM_PIPELINE_ROLLUP_REFRESH_DAYS))
+    rows = 0
+    day = first
+    while day <= today:
+        rows += rollup_day(day)
+        day += timedelta(days=1)
+    if rebuild:
+        DealStageDaily.objects.filter(day__lt=timezone.localdate(history)).delete()
+    return {"days": (today - first).days + 1, "rows": rows}
+
+
+def maybe_refresh() -> Optional[threading.Thread]:
+    """
+    Refresh the rollup in a background thread, at most once per
+    CRM_PIPELINE_ROLLUP_SECONDS across the processes sharing the cache.
+    """
+    if not settings.CRM_PIPELINE_ROLLUP_SECONDS or not cache.add(
+        ROLLUP_LOCK_KEY, 1, settings.CRM_PIPELINE_ROLLUP_SECONDS
+    ):
+        return None
+
+    def run():
+        try:
+            refresh_pipeline_rollup()
+        except Exception:
+            logger.exception("Pipeline rollup failed")
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=run, name="crm-pipeline-rollup", daemon=True)
+    thread.start()
+    return thread
+
+
+def _ratio(numerator, denominator, digits=4):
+    return round(numerator / denominator, digits) if denominator else None
+
+
+def pipeline_summary(rollups) -> Dict:
+    """Per-stage flow, win rate, cycle length and velocity from a queryset of DealStageDaily rows."""
+    totals = {
+        row["stage"]: row
+        for row in rollups.order_by().values("stage").annotate(
+            entered=Sum("entered"), entered_amount=Sum("entered_amount"), created=Sum("created"),
+            exited=Sum("exited"), advanced=Sum("advanced"), lost=Sum("lost"), dwell_seconds=Sum("dwell_seconds"),
+        )
+    }
+    stages: List[Dict] = []
+    for stage in STAGES:
+        row = totals.get(stage, {})
+        exited = row.get("exited") or 0
+        stages.append({
+            "stage": stage,
+            "entered": row.get("entered") or 0,
+            "created": row.get("created") or 0,
+            "exited": exited,
+            "advanced": row.get("advanced") or 0,
+            "lost": row.get("lost") or 0,
+            "conversion_rate": _ratio(row.get("advanced") or 0, exited),
+            "avg_days_in_stage": _ratio((row.get("dwell_seconds") or 0) / 86400, exited, 2),
+        })
+    won = totals.get("WON", {})
+    won_count, won_amount = won.get("entered") or 0, won.get("entered_amount") or 0
+    lost_count = totals.get("LOST", {}).get("entered") or 0
+    created = sum(stage["created"] for stage in stages)
+    win_rate = _ratio(won_count, won_count + lost_count)
+    # Expected time from the first stage to a decision: the mean stay in every open stage
+    stays = [stage["avg_days_in_stage"] for stage in stages if stage["stage"] in OPEN_STAGES]
+    cycle_days = round(sum(s for s in stays if s is not None), 2) if any(s is not None for s in stays) else None
+    avg_won_amount = _ratio(float(won_amount), won_count, 2)
+    velocity = None
+    if win_rate is not None and avg_won_amount is not None and cycle_days:
+        # Pipeline velocity: value the new deals of the period are expected to close per day
+        velocity = round(created * avg_won_amount * win_rate / cycle_days, 2)
+    return {
+        "stages": stages,
+        "created": created,
+        "won": won_count,
+        "won_amount": round(float(won_amount), 2),
+        "lost": lost_count,
+        "win_rate": win_rate,
+        "avg_won_amount": avg_won_amount,
+        "avg_cycle_days": cycle_days,
+        "velocity_per_day": velocity,
+    }
+
+
+class PipelineAnalyticsView(APIView):
+    """
+    Stage conversion, time in stage, win rate and pipeline velocity for
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD (default: the last 90 days), optionally
+    narrowed by ?owner=, ?campaign= and ?account=. Reads only the daily
+    rollups, scoped like the deals themselves; the rollup is refreshed in
+    the background at most every CRM_PIPELINE_ROLLUP_SECONDS, so the
+    current day may lag by that much.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        today = timezone.localdate()
+        params = request.query_params
+        try:
+            start = parse_date(params["from"]) if params.get("from") else today - timedelta(days=89)
+            end = parse_date(params["to"]) if params.get("to") else today
+        except ValueError:
+            start = end = None
+        if start is None or end is None:
+            return Response({"detail": "from and to must be YYYY-MM-DD dates"}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({"detail": "from must not be after to"}, status=status.HTTP_400_BAD_REQUEST)
+        maybe_refresh()
+
+        rollups = scope_queryset(DealStageDaily.objects.filter(day__gte=start, day__lte=end), request.user)
+        for field in ("owner", "campaign", "account"):
+            value = params.get(field)
+            if value:
+                if not value.isdigit():
+                    return Response({"detail": f"{field} must be an id"}, status=status.HTTP_400_BAD_REQUEST)
+                rollups = rollups.filter(**{f"{field}_id": int(value)})
+        return Response({"from": start, "to": end, **pipeline_summary(rollups)})
@@ -0,0 +1,177 @@
+"""
+On-demand request profiling for superusers: sampled stacks, SQL log, allocation peak
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+PROFILE_PARAM = "__profile"
+PROFILE_HEADER = "HTTP_X_CRM_PROFILE"
+
+
+def profile_requested(request):
+    """
+    Profile mode asked for by the request ("1" or "inline"), or None. Only
+    looks at the raw query string and headers so ordinary requests pay for
+    two lookups.
+    """
+    if PROFILE_PARAM in request.META.get("QUERY_STRING", ""):
+        mode = request.GET.get(PROFILE_PARAM)
+    else:
+        mode = request.META.get(PROFILE_HEADER)
+    return None if mode in (None, "", "0", "false") else mode
+
+
+def profiling_allowed(request) -> bool:
+    """Superusers only; API requests carry a JWT, pages a session."""
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        try:
+            result = JWTAuthentication().authenticate(request)
+        except exceptions.APIException:
+            return False
+        user = result[0] if result else None
+    return bool(user and (user.is_superuser or getattr(user, "role", None) == "SUPERADMIN"))
+
+
+class StackSampler:
+    """
+    Samples the stacks of the profiled threads from a background thread
+    every interval and counts them in collapsed ("folded") form, one line
+    per distinct stack, which flamegraph.pl, speedscope and inferno read.
+    With thread_ids=None every other thread is sampled; under ASGI that
+    includes concurrent requests.
+    """
+
+    def __init__(self, interval: float, thread_ids=None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="crm-profiler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names[thread_id] = next(
+                        (t.name for t in threading.enumerate() if t.ident == thread_id), str(thread_id)
+                    )
+                self.stacks[";".join([names[thread_id], *reversed(frames)])] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class SQLLog:
+    """execute_wrapper keeping every statement with its duration."""
+
+    def __init__(self):
+        self.entries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.entries.append({
+                "sql": sql,
+                "params": None if many else [repr(p)[:200] for p in (params or ())],
+                "many": many,
+                "ms": round((time.perf_counter() - start) * 1000, 3),
+            })
+
+
+class RequestProfile:
+    """Profiles one request: start() before the view runs, stop() after it, then finish() with its response."""
+
+    def __init__(self, request, thread_ids=None):
+        self.request = request
+        self.sampler = StackSampler(settings.CRM_PROFILE_INTERVAL_MS / 1000, thread_ids)
+        self.sql = SQLLog()
+        self._stack = ExitStack()
+        self._started_tracemalloc = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self.sql))
+        self._stack.enter_context(self.sampler)
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self._start
+        self._stack.close()
+        self.peak = tracemalloc.get_traced_memory()[1]
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    def report(self, response) -> dict:
+        return {
+            "method": self.request.method,
+            "path": self.request.get_full_path(),
+            "status": response.status_code,
+            "recorded_at": timezone.now().isoformat(),
+            "duration_ms": round(self.duration * 1000, 3),
+            "tracemalloc_peak_bytes": self.peak,
+            "sql_count": len(self.sql.entries),
+            "sql_ms": round(sum(entry["ms"] for entry in self.sql.entries), 3),
+            "sql": self.sql.entries,
+            "sample_interval_ms": settings.CRM_PROFILE_INTERVAL_MS,
+            "samples": self.sampler.samples,
+            "collapsed_stacks": self.sampler.collapsed(),
+        }
+
+    def finish(self, response, mode):
+        """
+        Store the profile under CRM_PROFILE_DIR (<name>.json plus
+        <name>.folded for flame graph tools) and point to it with the
+        X-CRM-Profile header; mode "inline" returns the profile instead
+        of the response.
+        """
+        report = self.report(response)
+        name = f"{timezone.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(settings.CRM_PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(settings.CRM_PROFILE_DIR, name + ".json"), "w") as fh:
+            json.dump(report, fh)
+        with open(os.path.join(settings.CRM_PROFILE_DIR, name + ".folded"), "w") as fh:
+            fh.write(report["collapsed_stacks"])
+        if mode == "inline":
+            response = HttpResponse(json.dumps(report), content_type="application/json")
+        response["X-CRM-Profile"] = name
+        return response
@@ -0,0 +1,342 @@
+"""
+Rollup columns on campaigns and accounts, kept in step with their child rows by F() updates
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cached_property
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+# Batch size for queries over many child rows
+CHUNK = 1000
+
+
+class Rollup:
+    """
+    parent.column = the number of child rows pointing at the parent through
+    fk (or the sum of their `value` column) whose `field` is one of `values`
+    (or, with exclude, none of them); every row counts without a field.
+    """
+
+    def __init__(self, child: str, fk: str, column: str, value: Optional[str] = None,
+                 field: Optional[str] = None, values: Tuple = (), exclude: bool = False):
+        self.child_label = child
+        self.fk = fk
+        self.column = column
+        self.value = value
+        self.field = field
+        self.values = values
+        self.exclude = exclude
+
+    @cached_property
+    def child(self):
+        return apps.get_model(self.child_label)
+
+    @cached_property
+    def parent(self):
+        return self.child._meta.get_field(self.fk).related_model
+
+    @cached_property
+    def attname(self) -> str:
+        return self.child._meta.get_field(self.fk).attname
+
+    @cached_property
+    def reads(self) -> set:
+        """Child field names and attnames whose change can move this rollup."""
+        names = {self.fk, self.attname, self.value, self.field}
+        names.discard(None)
+        return names
+
+    def condition(self) -> Q:
+        if self.field is None:
+            return Q()
+        condition = Q(**{f"{self.field}__in": self.values})
+        return ~condition if self.exclude else condition
+
+    def amount(self, row):
+        """What row adds to its parent's column."""
+        if self.field is not None and (getattr(row, self.field) in self.values) == self.exclude:
+            return 0
+        if self.value is None:
+            return 1
+        # Unsaved instances may still hold the value as assigned, e.g. a string
+        return self.child._meta.get_field(self.value).to_python(getattr(row, self.value)) or 0
+
+    def aggregate(self):
+        condition = self.condition()
+        if self.value is None:
+            return Count("pk", filter=condition or None)
+        return Sum(self.value, filter=condition or None)
+
+    def expected(self):
+        """Subquery of the column's correct value for each parent row."""
+        rows = (
+            self.child._base_manager.filter(self.condition(), **{self.fk: OuterRef("pk")})
+            .order_by().values(self.fk).annotate(total=self.aggregate()).values("total")
+        )
+        output = self.parent._meta.get_field(self.column)
+        return Coalesce(Subquery(rows, output_field=output), Value(0, output_field=output))
+
+
+ROLLUPS = (
+    Rollup("CRMBackend.Lead", "campaign", "lead_count"),
+    Rollup("CRMBackend.Deal", "campaign", "deal_count"),
+    Rollup("CRMBackend.Deal", "campaign", "won_amount", value="amount", field="stage", values=("WON",)),
+    Rollup("CRMBackend.Contact", "account", "contact_count"),
+    Rollup("CRMBackend.Deal", "account", "open_deal_amount", value="amount", field="stage",
+           values=("WON", "LOST"), exclude=True),
+    Rollup("CRMBackend.Task", "related_account", "open_task_count", field="completed", values=(False,)),
+)
+
+
+def rollups_for(model) -> List[Rollup]:
+    return [rollup for rollup in ROLLUPS if rollup.child_label == model._meta.label]
+
+
+def read_fields(model) -> set:
+    return set().union(*(rollup.reads for rollup in rollups_for(model)))
+
+
+Deltas = Dict[Tuple[type, int], Dict[str, object]]
+
+
+def contributions(model, rows: Iterable, sign: int = 1, deltas: Optional[Deltas] = None) -> Deltas:
+    """What rows (instances) add to their parents' columns, times sign, accumulated into deltas."""
+    deltas = defaultdict(lambda: defaultdict(int)) if deltas is None else deltas
+    rollups = rollups_for(model)
+    for row in rows:
+        for rollup in rollups:
+            parent_id = getattr(row, rollup.attname)
+            if parent_id is not None:
+                amount = rollup.amount(row)
+                if amount:
+                    deltas[(rollup.parent, parent_id)][rollup.column] += sign * amount
+    return deltas
+
+
+def grouped_contributions(queryset, sign: int = 1, deltas: Optional[Deltas] = None) -> Deltas:
+    """contributions() of every row of queryset, computed with one grouped query per rollup."""
+    deltas = defaultdict(lambda: defaultdict(int)) if deltas is None else deltas
+    for rollup in rollups_for(queryset.model):
+        rows = queryset.order_by().exclude(**{rollup.attname: None}).values(rollup.attname).annotate(
+            total=rollup.aggregate()
+        )
+        for row in rows:
+            if row["total"]:
+                deltas[(rollup.parent, row[rollup.attname])][rollup.column] += sign * row["total"]
+    return deltas
+
+
+def apply_deltas(deltas: Deltas, using: str = "default") -> None:
+    """
+    Add the deltas to the parent rows with F() expressions, in a fixed order
+    so concurrent writers lock parents alike. Touched parents get a new
+    updated_at and change log entry like any other update.
+    """
+    from .cache import invalidate_model
+    from .changes import record_changes
+
+    now = timezone.now()
+    touched = defaultdict(list)
+    for (parent, pk), columns in sorted(deltas.items(), key=lambda item: (item[0][0]._meta.label, item[0][1])):
+        changes = {column: F(column) + delta for column, delta in columns.items() if delta}
+        if changes:
+            parent._base_manager.using(using).filter(pk=pk).update(updated_at=now, **changes)
+            touched[parent].append(pk)
+    for parent, pks in touched.items():
+        invalidate_model(parent)
+        record_changes(parent, pks, "U")
+
+
+def rows_created(model, pks: List[int], using: str = "default") -> None:
+    """Count the rows of pks, freshly inserted past bulk_create (COPY), into their parents."""
+    deltas = defaultdict(lambda: defaultdict(int))
+    for start in range(0, len(pks), CHUNK):
+        grouped_contributions(model._base_manager.using(using).filter(pk__in=pks[start:start + CHUNK]),
+                              deltas=deltas)
+    apply_deltas(deltas, using)
+
+
+# (deltas, deleted rows) of the delete in progress, see deleting()
+_deleting: ContextVar = ContextVar("rollup_deletes", default=None)
+
+
+@contextmanager
+def deleting(using: str = "default"):
+    """
+    Collect what the rows deleted inside the block (cascades included) take
+    out of their parents and apply it once at the end, leaving out parents
+    deleted as well, rather than one parent update per deleted row.
+    """
+    if _deleting.get() is not None:
+        yield
+        return
+    deltas, deleted = defaultdict(lambda: defaultdict(int)), set()
+    token = _deleting.set((deltas, deleted))
+    try:
+        with transaction.atomic(using=using):
+            yield
+            apply_deltas({key: columns for key, columns in deltas.items() if key not in deleted}, using)
+    finally:
+        _deleting.reset(token)
+
+
+def child_deleted(instance, using: str = "default") -> None:
+    batch = _deleting.get()
+    if batch is None:
+        apply_deltas(contributions(type(instance), [instance], sign=-1), using)
+        return
+    deltas, deleted = batch
+    contributions(type(instance), [instance], sign=-1, deltas=deltas)
+    deleted.add((type(instance), instance.pk))
+
+
+class RollupQuerySet(models.QuerySet):
+    """
+    Keeps parent rollups right for bulk writes, which skip save() and send
+    no signals: bulk_create adds the new rows, update() (and so
+    bulk_update()) moves the rows it changes between parents and values
+    and invalidates the model's cached responses.
+    Deletes go through the post_delete signal, batched by delete().
+    """
+
+    def delete(self):
+        with deleting(self.db):
+            return super().delete()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            if kwargs.get("ignore_conflicts") or kwargs.get("update_conflicts"):
+                # Which rows were written is unknown: recount the parents involved
+                parents = defaultdict(set)
+                for (parent, pk) in contributions(self.model, objs):
+                    parents[parent].add(pk)
+                for parent, pks in parents.items():
+                    recount(parent, pks, using=self.db)
+            else:
+                apply_deltas(contributions(self.model, objs), self.db)
+        return objs
+
+    def update(self, **kwargs):
+        from .cache import invalidate_model
+
+        fields = read_fields(self.model)
+        if not fields.intersection(kwargs):
+            rows = super().update(**kwargs)
+            # No post_save either: cached responses of the model would outlive the update
+            if rows:
+                invalidate_model(self.model)
+            return rows
+        with transaction.atomic(using=self.db):
+            pks = list(self.select_for_update(of=("self",)).order_by().values_list("pk", flat=True))
+            deltas = defaultdict(lambda: defaultdict(int))
+            for start in range(0, len(pks), CHUNK):
+                grouped_contributions(self.model._base_manager.using(self.db).filter(pk__in=pks[start:start + CHUNK]),
+                                      sign=-1, deltas=deltas)
+            rows = super().update(**kwargs)
+            for start in range(0, len(pks), CHUNK):
+                grouped_contributions(self.model._base_manager.using(self.db).filter(pk__in=pks[start:start + CHUNK]),
+                                      deltas=deltas)
+            apply_deltas(deltas, self.db)
+            if rows:
+                invalidate_model(self.model)
+        return rows
+
+
+class RollupMixin(models.Model):
+    """Moves the model's contribution to parent rollups along with each save()."""
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        fields = read_fields(type(self))
+        update_fields = kwargs.get("update_fields")
+        if not fields or (update_fields is not None and not fields.intersection(update_fields)):
+            return super().save(*args, **kwargs)
+        using = kwargs.get("using") or self._state.db or "default"
+        with transaction.atomic(using=using):
+            deltas = defaultdict(lambda: defaultdict(int))
+            if not self._state.adding:
+                attnames = {type(self)._meta.get_field(name).attname for name in fields}
+                before = (
+                    type(self)._base_manager.using(using).select_for_update(of=("self",))
+                    .filter(pk=self.pk).only(*attnames).first()
+                )
+                if before is not None:
+                    contributions(type(self), [before], sign=-1, deltas=deltas)
+            super().save(*args, **kwargs)
+            contributions(type(self), [self], deltas=deltas)
+            apply_deltas(deltas, using)
+
+    def delete(self, using=None, keep_parents=False):
+        with deleting(using or self._state.db or "default"):
+            return super().delete(using, keep_parents)
+
+
+class RollupParentMixin(models.Model):
+    """
+    Leaves the rollup columns out of save() on existing rows: the copy in
+    memory may be stale, and writing it back would undo concurrent deltas.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get("force_insert"):
+            columns = {rollup.column for rollup in ROLLUPS if rollup.parent is type(self)}
+            update_fields = kwargs.get("update_fields")
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in deferred
+                ]
+            kwargs["update_fields"] = [name for name in update_fields if name not in columns]
+        return super().save(*args, **kwargs)
+
+    def delete(self, using=None, keep_parents=False):
+        # Cascades to children: take them out of the other parents in one go
+        with deleting(using or self._state.db or "default"):
+            return super().delete(using, keep_parents)
+
+
+def recount(parent, pks: Optional[Iterable[int]] = None, using: str = "default") -> int:
+    """Set parent's rollup columns from the child rows (of pks, or all parents); returns rows updated."""
+    columns = {rollup.column: rollup.expected() for rollup in ROLLUPS if rollup.parent is parent}
+    queryset = parent._base_manager.using(using)
+    if pks is not None:
+        queryset = queryset.filter(pk__in=list(pks))
+    return queryset.update(**columns)
+
+
+def check_rollups(repair: bool = False, using: str = "default") -> Dict[str, List[int]]:
+    """
+    Parent rows whose rollup columns disagree with their children, per
+    'Model.column'; with repair, those rows are recounted.
+    """
+    mismatches = {}
+    for rollup in ROLLUPS:
+        rows = (
+            rollup.parent._base_manager.using(using).annotate(expected_value=rollup.expected())
+            .exclude(**{rollup.column: F("expected_value")}).values_list("pk", flat=True)
+        )
+        pks = sorted(rows)
+        if pks:
+            mismatches[f"{rollup.parent.__name__}.{rollup.column}"] = pks
+            if repair:
+                with transaction.atomic(using=using):
+                    for start in range(0, len(pks), CHUNK):
+                        rollup.parent._base_manager.using(using).filter(pk__in=pks[start:start + CHUNK]).update(
+                            **{rollup.column: rollup.expected()}
+                        )
+    return mismatches
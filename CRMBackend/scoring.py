@@ -0,0 +1,188 @@
+"""
+Lead scoring: feature columns pulled for many leads at once and scored in NumPy batches
+"""
+import json
+import logging
+import math
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .cache import invalidate_model
+from .changes import record_changes
+from .models import Lead
+
+logger = logging.getLogger("crm.scoring")
+
+SCORE_LOCK_KEY = "crm:lead-scoring"
+
+STATUS_WEIGHTS = {"NEW": 0.0, "CONTACTED": 0.5, "QUALIFIED": 1.5, "CONVERTED": 3.0, "LOST": -3.0}
+# Weight of each feature in the log-odds of a lead converting
+WEIGHTS = {"status": 1.0, "campaign": 1.0, "region": 0.5, "contact": 1.0, "answers": 0.8, "recency": 1.0}
+BIAS = -1.5
+# Conversion rates are shrunk towards the overall rate as if every group had this many more leads
+PRIOR_LEADS = 20
+RECENCY_HALF_LIFE_DAYS = 30
+# Form answers beyond this many add nothing
+MAX_ANSWERS = 5
+
+COLUMNS = ("pk", "status", "campaign_id", "account__region", "contact_id", "contact__email", "contact__phone",
+           "contact__position", "description", "created_at", "score")
+
+
+def _logit(p):
+    return np.log(p / (1 - p))
+
+
+def conversion_rates(column: str) -> Tuple[Dict, float]:
+    """({value of column: smoothed share of its leads converted}, overall share) in one grouped query."""
+    rows = list(
+        Lead.objects.order_by().values(column).annotate(total=Count("pk"), converted=Count("pk", filter=Q(status="CONVERTED")))
+    )
+    total = sum(row["total"] for row in rows)
+    converted = sum(row["converted"] for row in rows)
+    # Keep the overall rate off 0 and 1, where its log-odds are infinite
+    overall = (converted + 1) / (total + 2)
+    rates = {
+        row[column]: (row["converted"] + PRIOR_LEADS * overall) / (row["total"] + PRIOR_LEADS)
+        for row in rows if row[column] is not None
+    }
+    return rates, overall
+
+
+def answer_count(description: Optional[str]) -> int:
+    """Non-empty answers of a lead form (stored by the Facebook sync as a JSON object); free text counts once."""
+    if description and description[0] == "{":
+        try:
+            answers = json.loads(description)
+        except ValueError:
+            return 1
+        if isinstance(answers, dict):
+            return sum(1 for value in answers.values() if value not in (None, ""))
+    return 1 if description else 0
+
+
+class Scorer:
+    """Scores 0..100 for batches of lead rows (tuples of COLUMNS), with group conversion rates read once."""
+
+    def __init__(self):
+        self.campaign_rates, overall = conversion_rates("campaign_id")
+        self.region_rates, _ = conversion_rates("account__region")
+        self.overall_logit = math.log(overall / (1 - overall))
+        self.now = time.time()
+
+    def _relative_logit(self, keys: np.ndarray, rates: Dict) -> np.ndarray:
+        """Log-odds of each key's rate over the overall rate; 0 for keys without leads."""
+        unique, inverse = np.unique(keys, return_inverse=True)
+        table = np.array([rates.get(key) or 0.0 for key in unique.tolist()])
+        known = table > 0
+        table[known] = _logit(table[known]) - self.overall_logit
+        return table[inverse]
+
+    def features(self, rows) -> Dict[str, np.ndarray]:
+        (_, status, campaign, region, contact, email, phone, position, description, created, _) = zip(*rows)
+        n = len(rows)
+        statuses = np.array(status)
+        status_weight = np.zeros(n)
+        for value, weight in STATUS_WEIGHTS.items():
+            status_weight[statuses == value] = weight
+        filled = (np.array([bool(v) for v in email], dtype=float) + np.array([bool(v) for v in phone], dtype=float)
+                  + np.array([bool(v) for v in position], dtype=float))
+        age_days = (self.now - np.fromiter((value.timestamp() for value in created), float, n)) / 86400
+        return {
+            "status": status_weight,
+            "campaign": self._relative_logit(np.array([-1 if v is None else v for v in campaign]), self.campaign_rates),
+            "region": self._relative_logit(np.array(["" if v is None else v for v in region]), self.region_rates),
+            "contact": np.where(np.array([v is not None for v in contact]), (1 + filled) / 4, 0.0),
+            "answers": np.minimum(np.fromiter(map(answer_count, description), float, n), MAX_ANSWERS) / MAX_ANSWERS,
+            "recency": 0.5 ** (np.maximum(age_days, 0) / RECENCY_HALF_LIFE_DAYS),
+        }
+
+    def score(self, rows) -> np.ndarray:
+        features = self.features(rows)
+        log_odds = BIAS + sum(WEIGHTS[name] * values for name, values in features.items())
+        return np.rint(100 / (1 + np.exp(-log_odds))).astype(np.int16)
+
+
+def stale_leads():
+    """Leads never scored, or changed (with their contact or account) since they were."""
+    return Lead.objects.filter(
+        Q(scored_at=None)
+        | Q(updated_at__gt=F("scored_at"))
+        | Q(contact__updated_at__gt=F("scored_at"))
+        | Q(account__updated_at__gt=F("scored_at"))
+    )
+
+
+def score_leads(leads=None, batch_size: Optional[int] = None) -> Dict[str, float]:
+    """
+    Score leads (default: stale_leads()) in batches of batch_size (default
+    CRM_LEAD_SCORE_BATCH_SIZE): one query reads a batch's features, NumPy
+    scores it, and the new scores go back with one UPDATE per distinct score
+    and chunk of ids. Rows whose score moved get a new updated_at and change
+    log entry like any edit; rows edited while their batch was being
+    scored are left stale for the next run.
+    """
+    leads = stale_leads() if leads is None else leads
+    batch_size = batch_size or settings.CRM_LEAD_SCORE_BATCH_SIZE
+    start = time.perf_counter()
+    scorer = Scorer()
+    manager = Lead._base_manager
+    scored = changed = 0
+    last_pk = 0
+    while True:
+        read_at = timezone.now()
+        rows = list(leads.filter(pk__gt=last_pk).order_by("pk").values_list(*COLUMNS)[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        pks = np.fromiter((row[0] for row in rows), np.int64, len(rows))
+        old = np.fromiter((row[-1] for row in rows), np.int16, len(rows))
+        new = scorer.score(rows)
+        moved = new != old
+        now = timezone.now()
+        current = {"updated_at__lte": read_at}
+        changed_pks = []
+        for value in np.unique(new[moved]).tolist():
+            ids = pks[moved & (new == value)].tolist()
+            for i in range(0, len(ids), 1000):
+                manager.filter(pk__in=ids[i:i + 1000], **current).update(score=value, scored_at=now, updated_at=now)
+            changed_pks.extend(ids)
+        ids = pks[~moved].tolist()
+        for i in range(0, len(ids), 1000):
+            manager.filter(pk__in=ids[i:i + 1000], **current).update(scored_at=now)
+        if changed_pks:
+            record_changes(Lead, changed_pks, "U")
+        scored += len(rows)
+        changed += len(changed_pks)
+    if changed:
+        invalidate_model(Lead)
+    return {"scored": scored, "changed": changed, "seconds": round(time.perf_counter() - start, 2)}
+
+
+def maybe_rescore() -> Optional[threading.Thread]:
+    """
+    Score stale leads in a background thread, at most once per
+    CRM_LEAD_SCORE_SECONDS across the processes sharing the cache.
+    """
+    if not settings.CRM_LEAD_SCORE_SECONDS or not cache.add(SCORE_LOCK_KEY, 1, settings.CRM_LEAD_SCORE_SECONDS):
+        return None
+
+    def run():
+        try:
+            score_leads()
+        except Exception:
+            logger.exception("Lead scoring failed")
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=run, name="crm-lead-scoring", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,251 @@
+"""
+Synthetic CRM data at benchmark volumes, written with COPY or bulk_create
+"""
+import itertools
+import random
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .cache import invalidate_model
+from .importers import copy_rows
+from .matching import match_keys
+from .models import Account, Campaign, Contact, Deal, Lead, Task, User
+from .rollups import recount
+
+REGIONS = ("EU", "US", "APAC", "LATAM", "MEA")
+# A couple of regions hold most of the business, like in production.
+REGION_WEIGHTS = (45, 30, 15, 7, 3)
+LEAD_STATUS_WEIGHTS = {"NEW": 40, "CONTACTED": 25, "QUALIFIED": 15, "CONVERTED": 8, "LOST": 12}
+DEAL_STAGE_WEIGHTS = {"PROSPECT": 30, "QUALIFICATION": 20, "PROPOSAL": 15, "NEGOTIATION": 10, "WON": 15, "LOST": 10}
+FIRST_NAMES = ("Anna", "Ben", "Carla", "David", "Elif", "Farid", "Grace", "Hugo", "Ines", "Jon", "Kemal", "Lena")
+LAST_NAMES = ("Smith", "Khan", "Garcia", "Müller", "Rossi", "Nowak", "Silva", "Yilmaz", "Dubois", "Sato")
+
+DEFAULT_COUNTS = {
+    "users": 200,
+    "accounts": 20000,
+    "contacts": 200000,
+    "campaigns": 500,
+    "leads": 1000000,
+    "deals": 50000,
+    "tasks": 100000,
+}
+
+
+def zipf_cum_weights(n: int, exponent: float = 1.1) -> List[float]:
+    """Cumulative Zipf weights: the first few items get most of the picks."""
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+
+
+class Seeder:
+    """
+    Inserts synthetic users, accounts, contacts, campaigns, leads, deals and
+    tasks with skewed owners (Zipf over users) and regions. Rows go in
+    batches through COPY on PostgreSQL and bulk_create elsewhere; like other
+    bulk paths no signals fire, so caches are invalidated at the end and the
+    change log is left alone (clients do a full reload after seeding).
+    """
+
+    def __init__(self, seed: int = 0, batch_size: int = 10000, using: str = "default",
+                 progress: Optional[Callable[[str], None]] = None):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.using = using
+        self.progress = progress or (lambda message: None)
+        self.use_copy = connections[using].vendor == "postgresql"
+        self.tag = uuid.UUID(int=self.random.getrandbits(128)).hex[:8]
+        self.now = timezone.now()
+
+    def run(self, counts: Dict[str, int]) -> Dict[str, Dict[str, float]]:
+        counts = {**DEFAULT_COUNTS, **counts}
+        report = {}
+        for entity in ("users", "accounts", "contacts", "campaigns", "leads", "deals", "tasks"):
+            start = time.perf_counter()
+            getattr(self, f"seed_{entity}")(counts[entity])
+            elapsed = time.perf_counter() - start
+            report[entity] = {"rows": counts[entity], "seconds": round(elapsed, 2),
+                              "rows_per_second": round(counts[entity] / elapsed) if elapsed else 0}
+            self.progress(f"{entity}: {counts[entity]} rows in {elapsed:.1f}s")
+        # COPY bypasses the rollup upkeep of bulk_create; recount the parents once
+        for parent in (Account, Campaign):
+            recount(parent, using=self.using)
+        for model in (User, Account, Contact, Campaign, Lead, Deal, Task):
+            invalidate_model(model)
+        return report
+
+    # helpers
+
+    def _created_at(self):
+        # Two years of history, denser towards today.
+        days = int(730 * self.random.random() ** 2)
+        return self.now - timedelta(days=days, seconds=self.random.randrange(86400))
+
+    def _pick(self, population, cum_weights, k):
+        return self.random.choices(population, cum_weights=cum_weights, k=k)
+
+    def _insert(self, model, rows) -> List[int]:
+        """Insert row dicts in batches and return the new primary keys."""
+        columns = [f for f in model._meta.concrete_fields if not f.primary_key]
+        pks = []
+        for batch in iter(lambda: list(itertools.islice(rows, self.batch_size)), []):
+            with transaction.atomic(using=self.using):
+                if self.use_copy:
+                    pks.extend(copy_rows(model, columns, batch, self.using))
+                else:
+                    objs = model.objects.using(self.using).bulk_create([model(**values) for values in batch])
+                    pks.extend(obj.pk for obj in objs)
+        return pks
+
+    def _defaults(self, model) -> Dict:
+        """Every concrete column at its default, so COPY gets a value for each."""
+        values = {}
+        for field in model._meta.concrete_fields:
+            if field.primary_key:
+                continue
+            if field.has_default():
+                values[field.attname] = field.get_default()
+            else:
+                # Blank text columns are NOT NULL without a default; the ORM would write ""
+                values[field.attname] = "" if field.empty_strings_allowed and not field.null else None
+        return values
+
+    # entities
+
+    def seed_users(self, count):
+        password = make_password(None)  # unusable: seeded users cannot log in
+        base = self._defaults(User)
+        roles = self._pick((User.Role.ADMIN, User.Role.EMPLOYEE), (2, 100), count)
+
+        def rows():
+            for n, role in enumerate(roles):
+                created = self._created_at()
+                yield {**base, "email": f"seed-{self.tag}-{n}@example.com", "password": password,
+                       "first_name": self.random.choice(FIRST_NAMES), "last_name": self.random.choice(LAST_NAMES),
+                       "role": role, "region": self._pick(REGIONS, list(itertools.accumulate(REGION_WEIGHTS)), 1)[0],
+                       "created_at": created, "updated_at": created}
+
+        self.users = self._insert(User, rows())
+        self.owner_weights = zipf_cum_weights(len(self.users))
+
+    def seed_accounts(self, count):
+        base = self._defaults(Account)
+        region_weights = list(itertools.accumulate(REGION_WEIGHTS))
+
+        def rows():
+            for n in range(count):
+                created = self._created_at()
+                yield {**base, "name": f"Account {self.tag}-{n}",
+                       "region": self._pick(REGIONS, region_weights, 1)[0],
+                       "owner_id": self._pick(self.users, self.owner_weights, 1)[0],
+                       "created_at": created, "updated_at": created}
+
+        self.accounts = self._insert(Account, rows())
+        self.account_weights = zipf_cum_weights(len(self.accounts), exponent=0.8)
+        # Admins get a handful of accounts each, as through rows.
+        admins = User.objects.using(self.using).filter(pk__in=self.users, role=User.Role.ADMIN).values_list("pk", flat=True)
+        through = User.allowed_accounts.through
+        through.objects.using(self.using).bulk_create(
+            [through(user_id=admin, account_id=account)
+             for admin in admins for account in set(self.random.sample(self.accounts, min(20, len(self.accounts))))],
+            batch_size=self.batch_size,
+        )
+
+    def seed_contacts(self, count):
+        base = self._defaults(Contact)
+
+        def rows():
+            for n in range(count):
+                created = self._created_at()
+                first, last = self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES)
+                email, phone = f"{first}.{last}.{self.tag}{n}@example.com".lower(), f"+1555{n:07d}"
+                yield {**base, "account_id": self._pick(self.accounts, self.account_weights, 1)[0],
+                       "first_name": first, "last_name": last, "email": email, "phone": phone,
+                       **match_keys(first, last, email, phone), "created_at": created, "updated_at": created}
+
+        self.contacts = self._insert(Contact, rows())
+
+    def seed_campaigns(self, count):
+        base = self._defaults(Campaign)
+
+        def rows():
+            for n in range(count):
+                created = self._created_at()
+                yield {**base, "name": f"Campaign {self.tag}-{n}",
+                       "owner_id": self._pick(self.users, self.owner_weights, 1)[0],
+                       "budget": Decimal(self.random.randrange(100, 500000)) / 100,
+                       "start_date": created.date(), "end_date": (created + timedelta(days=90)).date(),
+                       "created_at": created, "updated_at": created}
+
+        self.campaigns = self._insert(Campaign, rows())
+        through = Campaign.accounts.through
+        through.objects.using(self.using).bulk_create(
+            [through(campaign_id=campaign, account_id=account)
+             for campaign in self.campaigns
+             for account in set(self._pick(self.accounts, self.account_weights, 3))],
+            batch_size=self.batch_size,
+        )
+
+    def seed_leads(self, count):
+        base = self._defaults(Lead)
+        statuses, status_weights = zip(*LEAD_STATUS_WEIGHTS.items())
+        status_weights = list(itertools.accumulate(status_weights))
+
+        def rows():
+            for n in range(count):
+                created = self._created_at()
+                has_contact = self.random.random() < 0.6
+                yield {**base, "title": f"Lead {self.tag}-{n}", "description": "Synthetic lead",
+                       "status": self._pick(statuses, status_weights, 1)[0],
+                       "owner_id": self._pick(self.users, self.owner_weights, 1)[0],
+                       "campaign_id": self.random.choice(self.campaigns) if self.random.random() < 0.7 else None,
+                       "account_id": self._pick(self.accounts, self.account_weights, 1)[0],
+                       "contact_id": self.random.choice(self.contacts) if has_contact and self.contacts else None,
+                       "created_at": created, "updated_at": created}
+
+        self.leads = self._insert(Lead, rows())
+
+    def seed_deals(self, count):
+        base = self._defaults(Deal)
+        stages, stage_weights = zip(*DEAL_STAGE_WEIGHTS.items())
+        stage_weights = list(itertools.accumulate(stage_weights))
+
+        def rows():
+            for n in range(count):
+                created = self._created_at()
+                yield {**base, "title": f"Deal {self.tag}-{n}",
+                       "amount": Decimal(int(self.random.lognormvariate(9, 1.2) * 100)) / 100,
+                       "stage": self._pick(stages, stage_weights, 1)[0],
+                       "account_id": self._pick(self.accounts, self.account_weights, 1)[0],
+                       "lead_id": self.random.choice(self.leads) if self.leads else None,
+                       "owner_id": self._pick(self.users, self.owner_weights, 1)[0],
+                       "campaign_id": self.random.choice(self.campaigns) if self.random.random() < 0.5 else None,
+                       "close_date": (created + timedelta(days=self.random.randrange(7, 120))).date(),
+                       "stage_changed_at": created, "created_at": created, "updated_at": created}
+
+        self.deals = self._insert(Deal, rows())
+        if self.use_copy:
+            # COPY skips DealQuerySet.bulk_create, which logs the initial stages
+            for start in range(0, len(self.deals), self.batch_size):
+                Deal.objects.using(self.using).filter(pk__in=self.deals[start:start + self.batch_size]).log_created()
+
+    def seed_tasks(self, count):
+        base = self._defaults(Task)
+
+        def rows():
+            for n in range(count):
+                created = self._created_at()
+                yield {**base, "title": f"Task {self.tag}-{n}",
+                       "assigned_to_id": self._pick(self.users, self.owner_weights, 1)[0],
+                       "due_date": (created + timedelta(days=self.random.randrange(1, 30))).date(),
+                       "completed": self.random.random() < 0.6,
+                       "related_lead_id": self.random.choice(self.leads) if self.leads else None,
+                       "related_deal_id": self.random.choice(self.deals) if self.deals and self.random.random() < 0.3 else None,
+                       "created_at": created, "updated_at": created}
+
+        self._insert(Task, rows())
@@ -0,0 +1,67 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.utils import timezone
+
+from .cache import invalidate_model
+from .changes import record_change, record_changes
+from .models import SET_NULL_AND_TOUCH, Account, Campaign, Contact, Deal, Lead, Task, User
+from .rollups import child_deleted
+
+CRM_MODELS = (User, Account, Contact, Lead, Deal, Campaign, Task)
+
+
+def on_save(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login, which no CRM response includes.
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    invalidate_model(sender)
+    record_change(sender, instance.pk, "C" if created else "U")
+
+
+def on_pre_delete(sender, instance, **kwargs):
+    # Children whose foreign key SET_NULL_AND_TOUCH is about to clear are
+    # updated with a queryset update, which sends no post_save.
+    for relation in sender._meta.related_objects:
+        if relation.one_to_many and relation.on_delete is SET_NULL_AND_TOUCH:
+            children = relation.related_model.objects.filter(**{relation.field.name: instance})
+            record_changes(relation.related_model, list(children.values_list("pk", flat=True)), "U")
+
+
+def on_delete(sender, instance, using="default", **kwargs):
+    invalidate_model(sender)
+    record_change(sender, instance.pk, "D")
+    # Deletes, cascades included, take the row out of its parents' rollups
+    child_deleted(instance, using)
+
+
+def _linked_pks(through, instance, model):
+    source = next(f for f in through._meta.concrete_fields if f.is_relation and f.related_model is type(instance))
+    target = next(f for f in through._meta.concrete_fields
+                  if f.is_relation and f.related_model is model and f is not source)
+    return set(through.objects.filter(**{source.attname: instance.pk}).values_list(target.attname, flat=True))
+
+
+def on_m2m_change(sender, instance, action, model, pk_set, **kwargs):
+    """Many-to-many changes do not save either side; bump both row versions."""
+    if action == "pre_clear":
+        instance._crm_cleared_pks = _linked_pks(sender, instance, model)
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if action == "post_clear":
+        pk_set = instance.__dict__.pop("_crm_cleared_pks", set())
+    now = timezone.now()
+    type(instance).objects.filter(pk=instance.pk).update(updated_at=now)
+    record_change(type(instance), instance.pk, "U")
+    if pk_set:
+        model.objects.filter(pk__in=pk_set).update(updated_at=now)
+        record_changes(model, pk_set, "U")
+    for changed in (type(instance), model):
+        invalidate_model(changed)
+
+
+for crm_model in CRM_MODELS:
+    post_save.connect(on_save, sender=crm_model)
+    pre_delete.connect(on_pre_delete, sender=crm_model)
+    post_delete.connect(on_delete, sender=crm_model)
+    for m2m_field in crm_model._meta.local_many_to_many:
+        m2m_changed.connect(on_m2m_change, sender=m2m_field.remote_field.through)
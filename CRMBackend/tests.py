@@ -1,3 +1,464 @@
-from django.test import TestCase
+import tempfile
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import token_blacklist
+from .dedup import duplicate_groups, merge_groups
+from .facebook_service import AsyncFacebookGraphAPI, FacebookGraphAPI
+from .graph_backends import ReplayBackend, generate_fixtures
+from .matching import name_key, normalize_phone, soundex
+from .models import (
+    Account, Campaign, ChangeLogEntry, Contact, Deal, DealStageChange, Lead, OutboxEmail, Task, User,
+)
+from .outbox import claim_batch, prune_outbox, queue_mail, send_pending
+from .rollups import check_rollups
+from .token_blacklist import BlacklistFilter, FilteredRefreshToken, compact_token_blacklist
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.account = Account.objects.create(name="Acme", region="EU")
+        self.other_account = Account.objects.create(name="Globex", region="US")
+        self.campaign = Campaign.objects.create(name="Spring", budget=10)
+        self.other_campaign = Campaign.objects.create(name="Autumn", budget=10)
+
+    def deal(self, **kwargs):
+        kwargs = {"title": "Deal", "account": self.account, "campaign": self.campaign, "amount": 100, **kwargs}
+        return Deal.objects.create(**kwargs)
+
+    def assertConsistent(self):
+        self.assertEqual(check_rollups(), {})
+
+    def test_save_counts_and_moves_rows(self):
+        deal = self.deal(amount=Decimal("250.50"))
+        Lead.objects.create(title="Lead", campaign=self.campaign)
+        Contact.objects.create(account=self.account, first_name="Ann")
+        Task.objects.create(title="Call", related_account=self.account)
+        self.account.refresh_from_db()
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.account.open_deal_amount, Decimal("250.50"))
+        self.assertEqual((self.account.contact_count, self.account.open_task_count), (1, 1))
+        self.assertEqual((self.campaign.deal_count, self.campaign.lead_count), (1, 1))
+
+        deal.stage = "WON"
+        deal.save()
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.won_amount, Decimal("250.50"))
+
+        deal.account = self.other_account
+        deal.campaign = self.other_campaign
+        deal.save()
+        self.assertConsistent()
+
+    def test_update_and_bulk_update(self):
+        deals = [self.deal() for _ in range(3)]
+        Deal.objects.filter(pk__in=[deal.pk for deal in deals[:2]]).update(stage="WON")
+        self.assertConsistent()
+        for deal in deals:
+            deal.account = self.other_account
+            deal.amount = 40
+        Deal.objects.bulk_update(deals, ["account", "amount"])
+        self.assertConsistent()
+        Task.objects.bulk_create([Task(title="Call", related_account=self.account) for _ in range(2)])
+        Task.objects.filter(related_account=self.account).update(completed=True)
+        self.assertConsistent()
+
+    def test_delete(self):
+        deals = [self.deal(account=account) for account in (self.account, self.other_account)]
+        deals[0].delete()
+        self.assertConsistent()
+        Contact.objects.create(account=self.other_account, first_name="Bob")
+        # Cascades to the account's deals and contacts
+        self.other_account.delete()
+        self.assertConsistent()
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.deal_count, 0)
+
+    def test_bulk_delete_updates_each_parent_once(self):
+        Deal.objects.bulk_create([
+            Deal(title=f"Deal {n}", account=self.account, campaign=self.campaign, amount=10) for n in range(5)
+        ])
+        with CaptureQueriesContext(connection) as queries:
+            Deal.objects.filter(account=self.account).delete()
+        updates = [query["sql"] for query in queries.captured_queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(sum(Campaign._meta.db_table in sql for sql in updates), 1)
+        self.assertEqual(sum(Account._meta.db_table in sql for sql in updates), 1)
+        self.assertConsistent()
+
+
+class MatchingTests(TestCase):
+    def test_normalize_phone(self):
+        self.assertEqual(normalize_phone("+49 (0)30 1234-567"), "+49301234567")
+        self.assertEqual(normalize_phone("0049 30 1234567"), "+49301234567")
+        self.assertEqual(normalize_phone("030 1234567", "49"), "+49301234567")
+        self.assertEqual(normalize_phone("030 1234567", ""), "301234567")
+        self.assertEqual(normalize_phone("+1 415 555 0100 ext. 12"), "+14155550100")
+        self.assertEqual(normalize_phone("12345"), "")
+        self.assertEqual(normalize_phone(None), "")
+
+    @override_settings(CRM_DEFAULT_PHONE_COUNTRY_CODE="44")
+    def test_normalize_phone_default_country(self):
+        self.assertEqual(normalize_phone("020 7946 0018"), "+442079460018")
+
+    def test_soundex(self):
+        self.assertEqual(soundex("Robert"), "R163")
+        self.assertEqual(soundex("Rupert"), "R163")
+        self.assertEqual(soundex("Ashcraft"), "A261")
+        self.assertEqual(soundex("Tymczak"), "T522")
+        self.assertEqual(soundex("Pfister"), "P236")
+        self.assertEqual(soundex("Lee"), "L000")
+        self.assertEqual(soundex("Müller"), soundex("Muller"))
+        self.assertEqual(soundex("42"), "")
+
+    def test_name_key(self):
+        self.assertEqual(name_key("Jon", "Smyth"), name_key("John", "Smith"))
+        self.assertEqual(name_key("", "Smith"), "0000S530")
+        self.assertEqual(name_key("", ""), "")
+
+
+class MergeTests(TestCase):
+    def test_merge_repoints_leads_and_deals(self):
+        account = Account.objects.create(name="Acme", region="EU")
+        keep = Contact.objects.create(account=account, first_name="Ann", last_name="Lee", email="ann@acme.com")
+        duplicate = Contact.objects.create(account=account, first_name="Ann", last_name="Lee",
+                                           email="ANN@acme.com ", phone="+1 415 555 0100")
+        lead = Lead.objects.create(title="Lead", account=account, contact=duplicate)
+        deal = Deal.objects.create(title="Deal", account=account, contact=duplicate, amount=5)
+
+        groups = duplicate_groups()
+        self.assertEqual(groups, [[keep.pk, duplicate.pk]])
+        result = merge_groups(groups)
+
+        self.assertEqual(result, {"groups": 1, "merged": 1, "leads": 1, "deals": 1})
+        self.assertFalse(Contact.objects.filter(pk=duplicate.pk).exists())
+        lead.refresh_from_db()
+        deal.refresh_from_db()
+        self.assertEqual((lead.contact_id, deal.contact_id), (keep.pk, keep.pk))
+        keep.refresh_from_db()
+        self.assertEqual(keep.phone, "+1 415 555 0100")
+        self.assertEqual(check_rollups(), {})
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin@example.com", "secret")
+        self.client = APIClient()
+        Lead.objects.create(title="Lead, quoted", owner=self.user)
+
+    def test_csv_and_ndjson(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get("/api/leads/export/?format=csv")
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertIn("title", lines[0].split(","))
+        self.assertIn('"Lead, quoted"', lines[1])
+        response = self.client.get("/api/leads/export/?format=ndjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('"title":"Lead, quoted"', b"".join(response.streaming_content).decode())
+
+    def test_anonymous_gets_401(self):
+        response = self.client.get("/api/leads/export/?format=csv")
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response.content.startswith(b"detail\r\n"))
+        response = self.client.get("/api/leads/export/?format=ndjson")
+        self.assertEqual(response.status_code, 401)
+        self.assertIn(b'"detail"', response.content)
+
+    def test_unknown_format_gets_404(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get("/api/leads/export/?format=xml").status_code, 404)
+
+
+class ChangesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin@example.com", "secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, **params):
+        return self.client.get("/api/changes/", params)
+
+    def test_limit_must_be_positive(self):
+        token = self.get().data["token"]
+        Lead.objects.create(title="Lead")
+        for limit in ("0", "-5", "x"):
+            self.assertEqual(self.get(since=token, limit=limit).status_code, 400)
+        self.assertEqual(self.get(since=token, limit=1).status_code, 200)
+
+    def test_token_stays_before_recent_entries(self):
+        token = self.get().data["token"]
+        old = Lead.objects.create(title="Old")
+        ChangeLogEntry.objects.update(changed_at=timezone.now() - timedelta(hours=1))
+        recent = Lead.objects.create(title="Recent")
+
+        response = self.get(since=token)
+        self.assertEqual([row["id"] for row in response.data["changes"]["leads"]["created"]], [old.pk, recent.pk])
+        self.assertFalse(response.data["more"])
+        # Only the settled entry is moved past; the recent one comes again
+        response = self.get(since=response.data["token"])
+        self.assertEqual([row["id"] for row in response.data["changes"]["leads"]["created"]], [recent.pk])
+
+        with override_settings(CRM_CHANGELOG_SETTLE_SECONDS=0):
+            token = self.get(since=response.data["token"]).data["token"]
+            self.assertEqual(self.get(since=token).data["changes"], {})
+
+
+class DealStageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser("admin@example.com", "secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.deal = Deal.objects.create(title="Deal", account=Account.objects.create(name="Acme"), amount=0)
+
+    def test_queryset_update_logs_stage_and_refreshes_cache(self):
+        url = f"/api/deals/{self.deal.pk}/"
+        self.assertEqual(self.client.get(url).data["stage"], "PROSPECT")
+        ChangeLogEntry.objects.all().delete()
+
+        Deal.objects.filter(pk=self.deal.pk).update(stage="WON")
+
+        self.assertEqual(self.client.get(url).json()["stage"], "WON")
+        self.assertEqual(
+            list(DealStageChange.objects.filter(deal=self.deal).values_list("from_stage", "to_stage")),
+            [("", "PROSPECT"), ("PROSPECT", "WON")],
+        )
+        self.assertTrue(ChangeLogEntry.objects.filter(entity="deals", object_id=self.deal.pk, op="U").exists())
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser("admin@example.com", "secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_queryset_update_invalidates(self):
+        lead = Lead.objects.create(title="Before")
+        url = f"/api/leads/{lead.pk}/"
+        self.assertEqual(self.client.get(url).data["title"], "Before")
+        self.assertEqual(self.client.get("/api/leads/").json()["results"][0]["title"], "Before")
+
+        Lead.objects.filter(pk=lead.pk).update(title="After")
+
+        self.assertEqual(self.client.get(url).json()["title"], "After")
+        self.assertEqual(self.client.get("/api/leads/").json()["results"][0]["title"], "After")
+
+    def test_bulk_update_invalidates(self):
+        lead = Lead.objects.create(title="Before")
+        self.assertEqual(self.client.get(f"/api/leads/{lead.pk}/").data["title"], "Before")
+        lead.title = "After"
+        Lead.objects.bulk_update([lead], ["title"])
+        self.assertEqual(self.client.get(f"/api/leads/{lead.pk}/").json()["title"], "After")
+
+
+@override_settings(CRM_RESPONSE_CACHE=False)
+class FastListTests(TestCase):
+    URLS = ("/api/accounts/", "/api/contacts/", "/api/leads/", "/api/deals/", "/api/campaigns/", "/api/tasks/",
+            "/api/users/")
+
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin@example.com", "secret", first_name="Zoë")
+        employee = User.objects.create_user("employee@example.com", "secret", role=User.Role.EMPLOYEE, region="EU")
+        account = Account.objects.create(name="Åcme \u2028 GmbH", region="EU", owner=employee)
+        Account.objects.create(name="Globex")
+        contact = Contact.objects.create(account=account, first_name="Ann", email="ann@acme.com", phone="+1 415")
+        campaign = Campaign.objects.create(name="Spring", budget=Decimal("1234.50"), start_date=date(2024, 3, 1))
+        campaign.accounts.add(account)
+        lead = Lead.objects.create(title="Lead", owner=employee, account=account, contact=contact, campaign=campaign)
+        Lead.objects.create(title="Bare lead")
+        deal = Deal.objects.create(title="Deal", account=account, lead=lead, amount=Decimal("99.99"),
+                                   close_date=date(2024, 6, 30), stage="WON")
+        Task.objects.create(title="Call", assigned_to=employee, related_deal=deal, due_date=date(2024, 4, 1))
+        Task.objects.create(title="Loose end", completed=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_fast_list_matches_serializers(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                with override_settings(CRM_FAST_LIST_SERIALIZATION=True):
+                    fast = self.client.get(url)
+                with override_settings(CRM_FAST_LIST_SERIALIZATION=False):
+                    regular = self.client.get(url)
+                self.assertEqual(fast.status_code, 200)
+                self.assertTrue(regular.json()["results"])
+                self.assertEqual(fast.json(), regular.json())
+                self.assertEqual(fast.content, regular.content)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser("admin@example.com", "secret")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        self.lead = Lead.objects.create(title="Lead")
+
+    def assertRevalidates(self, url):
+        """Return the ETag of url after checking that sending it back gets 304."""
+        etag = self.client.get(url)["ETag"]
+        self.assertTrue(etag)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        return etag
+
+    def test_detail_changes_after_save(self):
+        url = f"/api/leads/{self.lead.pk}/"
+        etag = self.assertRevalidates(url)
+        self.lead.title = "Renamed"
+        self.lead.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_list_changes_after_delete(self):
+        other = Lead.objects.create(title="Other")
+        etag = self.assertRevalidates("/api/leads/")
+        other.delete()
+        response = self.client.get("/api/leads/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_dashboard(self):
+        # The dashboard ETag includes the current minute; keep it fixed
+        now = datetime(2024, 5, 1, 12, 0, 30, tzinfo=dt_timezone.utc)
+        with mock.patch("CRMBackend.conditional.timezone", mock.Mock(now=lambda: now)):
+            etag = self.assertRevalidates("/api/dashboard/")
+            Lead.objects.create(title="New")
+            response = self.client.get("/api/dashboard/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+@override_settings(CRM_TOKEN_FILTER_SYNC_SECONDS=3600, CRM_TOKEN_COMPACTION_SECONDS=0)
+class TokenBlacklistTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin@example.com", "secret")
+        patcher = mock.patch.object(token_blacklist, "_filter", BlacklistFilter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def refresh(self, token):
+        return APIClient().post("/api/auth/login/refresh/", {"refresh": str(token)}, format="json")
+
+    def test_token_blacklisted_in_this_process_is_rejected(self):
+        token = FilteredRefreshToken.for_user(self.user)
+        other = FilteredRefreshToken.for_user(self.user)
+        FilteredRefreshToken(str(other))  # builds the filter before the blacklisting
+        token.blacklist()
+        with self.assertRaises(TokenError):
+            FilteredRefreshToken(str(token))
+        self.assertEqual(self.refresh(token).status_code, 401)
+        self.assertEqual(self.refresh(other).status_code, 200)
+
+    def test_rebuild_after_compaction_keeps_unexpired_tokens(self):
+        revoked = FilteredRefreshToken.for_user(self.user)
+        revoked.blacklist()
+        expired = OutstandingToken.objects.create(
+            user=self.user, jti="expired", token="expired", expires_at=timezone.now() - timedelta(days=1)
+        )
+        BlacklistedToken.objects.create(token=expired)
+
+        self.assertEqual(compact_token_blacklist(), {"outstanding": 1, "blacklisted": 1})
+        with override_settings(CRM_TOKEN_FILTER_REBUILD_SECONDS=0):
+            with self.assertRaises(TokenError):
+                FilteredRefreshToken(str(revoked))
+        self.assertEqual(self.refresh(revoked).status_code, 401)
+        self.assertTrue(BlacklistedToken.objects.filter(token__jti=revoked["jti"]).exists())
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError("SMTP server down")
+
+
+@override_settings(CRM_OUTBOX_RETRY_BACKOFF=30, CRM_OUTBOX_CLAIM_SECONDS=900)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.email = queue_mail("Hello", "Body", ["ann@example.com"])
+
+    def make_due(self):
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+
+    def test_send(self):
+        self.assertEqual(send_pending(), {"sent": 1, "retrying": 0, "failed": 0})
+        self.assertEqual([message.to for message in mail.outbox], [["ann@example.com"]])
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), (OutboxEmail.Status.SENT, 1))
+        self.assertEqual(send_pending(), {"sent": 0, "retrying": 0, "failed": 0})
+
+    def test_claim_expires(self):
+        self.assertEqual(claim_batch(10), [self.email])
+        self.assertEqual(claim_batch(10), [])
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, OutboxEmail.Status.SENDING)
+        # A worker that died mid-batch: the claim runs out and the message is taken again
+        self.make_due()
+        self.assertEqual([email.attempts for email in claim_batch(10)], [2])
+
+    @override_settings(EMAIL_BACKEND="CRMBackend.tests.FailingEmailBackend")
+    def test_failures_back_off_then_give_up(self):
+        for attempt, delay in ((1, 30), (2, 60)):
+            before = timezone.now()
+            self.assertEqual(send_pending(max_attempts=3), {"sent": 0, "retrying": 1, "failed": 0})
+            self.email.refresh_from_db()
+            self.assertEqual((self.email.status, self.email.attempts), (OutboxEmail.Status.PENDING, attempt))
+            self.assertIn("SMTP server down", self.email.last_error)
+            self.assertGreaterEqual(self.email.next_attempt_at, before + timedelta(seconds=delay))
+            self.assertLess(self.email.next_attempt_at, timezone.now() + timedelta(seconds=delay + 5))
+            # Not due until the backoff has passed
+            self.assertEqual(send_pending(max_attempts=3)["retrying"], 0)
+            self.make_due()
+
+        with self.assertLogs("crm.mail", "ERROR"):
+            self.assertEqual(send_pending(max_attempts=3), {"sent": 0, "retrying": 0, "failed": 1})
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), (OutboxEmail.Status.FAILED, 3))
+        self.make_due()
+        self.assertEqual(claim_batch(10), [])
+
+    def test_prune_sent(self):
+        now = timezone.now()
+        old = queue_mail("Old", "Body", ["ann@example.com"])
+        recent = queue_mail("Recent", "Body", ["ann@example.com"])
+        OutboxEmail.objects.filter(pk=old.pk).update(status=OutboxEmail.Status.SENT, sent_at=now - timedelta(days=8))
+        OutboxEmail.objects.filter(pk=recent.pk).update(status=OutboxEmail.Status.SENT, sent_at=now - timedelta(days=1))
+
+        self.assertEqual(prune_outbox(days=7), 1)
+        self.assertEqual(set(OutboxEmail.objects.values_list("pk", flat=True)), {self.email.pk, recent.pk})
+
+
+class GraphPagingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        generate_fixtures(directory.name, forms=2, leads=500, campaigns=1, days=1)
+        self.backend = ReplayBackend(directory.name, page_size=100)
+
+    async def test_async_client_follows_cursors(self):
+        api = AsyncFacebookGraphAPI("replay", backend=self.backend)
+        pages = await api.get_pages()
+        forms = await api.get_lead_forms(pages[0]["id"])
+        leads = await api.get_page_leads(pages[0]["id"])
+        self.assertEqual(len(forms), 2)
+        self.assertEqual(len(leads), 500)
+        self.assertEqual(len({lead["id"] for lead in leads}), 500)
+        self.assertEqual(leads, [
+            lead for form in forms for lead in FacebookGraphAPI("replay", backend=self.backend).get_leads(form["id"])
+        ])
@@ -0,0 +1,167 @@
+"""
+Refresh token blacklist upkeep: compaction of expired rows and a per-process Bloom filter in front of lookups
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger("crm.auth")
+
+COMPACTION_LOCK_KEY = "crm:token-compaction"
+
+
+def compact_token_blacklist(batch_size: int = 10000) -> dict:
+    """
+    Delete outstanding tokens past their expiry and their blacklist rows,
+    in batches so no statement holds locks on the whole table. An expired
+    token fails signature validation before the blacklist is consulted, so
+    its rows are dead weight.
+    """
+    now = timezone.now()
+    removed = {"outstanding": 0, "blacklisted": 0}
+    while True:
+        ids = list(OutstandingToken.objects.filter(expires_at__lt=now).order_by().values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return removed
+        removed["blacklisted"] += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+        removed["outstanding"] += OutstandingToken.objects.filter(pk__in=ids).delete()[0]
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, sized for capacity items at error_rate false positives."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1000)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class BlacklistFilter:
+    """
+    Bloom filter of the jtis of blacklisted, unexpired refresh tokens. A
+    miss means the token is certainly not blacklisted and the table lookup
+    is skipped; a hit goes to the table. Rows blacklisted since the last
+    build (by any process) are added from a primary-key range query, which
+    reads the hot end of the index, every CRM_TOKEN_FILTER_SYNC_SECONDS: a
+    token revoked through another process is honoured here that much later
+    (0 syncs before every check and saves no query). The filter is
+    rebuilt from scratch every CRM_TOKEN_FILTER_REBUILD_SECONDS, dropping
+    expired tokens.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._built_at = 0.0
+        self._synced_at = 0.0
+        self._last_id = 0
+
+    def _rebuild(self) -> None:
+        # Everything after last_id is picked up by _sync
+        last_id = BlacklistedToken.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        jtis = list(
+            BlacklistedToken.objects.filter(id__lte=last_id, token__expires_at__gt=timezone.now())
+            .values_list("token__jti", flat=True)
+        )
+        # Room to grow until the next rebuild
+        bloom = BloomFilter(2 * len(jtis), settings.CRM_TOKEN_FILTER_ERROR_RATE)
+        for jti in jtis:
+            bloom.add(jti)
+        self._bloom, self._last_id = bloom, last_id
+        self._built_at = self._synced_at = time.monotonic()
+        maybe_compact()
+
+    def _sync(self) -> None:
+        rows = BlacklistedToken.objects.filter(id__gt=self._last_id).order_by("id").values_list("id", "token__jti")
+        for row_id, jti in rows:
+            self._bloom.add(jti)
+            self._last_id = row_id
+        self._synced_at = time.monotonic()
+
+    def add(self, jtis: Iterable[str]) -> None:
+        if self._bloom is not None:
+            for jti in jtis:
+                self._bloom.add(jti)
+
+    def might_contain(self, jti: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._bloom is None or now - self._built_at >= settings.CRM_TOKEN_FILTER_REBUILD_SECONDS:
+                self._rebuild()
+            elif now - self._synced_at >= settings.CRM_TOKEN_FILTER_SYNC_SECONDS:
+                self._sync()
+            hit = jti in self._bloom
+        CACHE_LOOKUPS.labels("token_blacklist", "maybe" if hit else "absent").inc()
+        return hit
+
+
+_filter = BlacklistFilter()
+
+
+def maybe_compact() -> Optional[threading.Thread]:
+    """
+    Compact the blacklist in a background thread, at most once per
+    CRM_TOKEN_COMPACTION_SECONDS across the processes sharing the cache.
+    """
+    if not settings.CRM_TOKEN_COMPACTION_SECONDS or not cache.add(
+        COMPACTION_LOCK_KEY, 1, settings.CRM_TOKEN_COMPACTION_SECONDS
+    ):
+        return None
+
+    def run():
+        try:
+            removed = compact_token_blacklist()
+            logger.info("Token blacklist compacted: %s", removed)
+        except Exception:
+            logger.exception("Token blacklist compaction failed")
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=run, name="crm-token-compaction", daemon=True)
+    thread.start()
+    return thread
+
+
+class FilteredRefreshToken(RefreshToken):
+    """RefreshToken whose blacklist check consults the per-process filter first."""
+
+    def check_blacklist(self) -> None:
+        if _filter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        _filter.add([self.payload[api_settings.JTI_CLAIM]])
+        return result
+
+
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = FilteredRefreshToken
@@ -11,8 +11,14 @@ from .serializers import (
     TaskSerializer,
 )
 from .permissions import IsAdminOrOwner
+from .exports import ExportMixin
+from .importers import ImportMixin
+from .fast_serializers import FastListMixin
+from .cache import CachedResponseMixin
+from .conditional import ConditionalGetMixin
+from .scoring import maybe_rescore
 
-class AccountViewSet(viewsets.ModelViewSet):
+class AccountViewSet(ImportMixin, ExportMixin, ConditionalGetMixin, CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrOwner]
@@ -24,9 +30,13 @@ class AccountViewSet(viewsets.ModelViewSet):
         owner = self.request.query_params.get('owner')
         if owner:
             qs = qs.filter(owner_id=owner)
+        # Largest first by a maintained rollup column, e.g. ?ordering=-open_deal_amount
+        ordering = self.request.query_params.get('ordering')
+        if ordering in ('-contact_count', '-open_deal_amount', '-open_task_count'):
+            return qs.order_by(ordering, '-created_at')
         return qs.order_by('-created_at')
 
-class ContactViewSet(viewsets.ModelViewSet):
+class ContactViewSet(ImportMixin, ExportMixin, ConditionalGetMixin, CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Contact.objects.all()
     serializer_class = ContactSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrOwner]
@@ -45,7 +55,7 @@ class ContactViewSet(viewsets.ModelViewSet):
             qs = qs.filter(account_id=account)
         return qs.order_by('-created_at')
 
-class LeadViewSet(viewsets.ModelViewSet):
+class LeadViewSet(ImportMixin, ExportMixin, ConditionalGetMixin, CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Lead.objects.all()
     serializer_class = LeadSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrOwner]
@@ -63,9 +73,13 @@ class LeadViewSet(viewsets.ModelViewSet):
         campaign = self.request.query_params.get('campaign')
         if campaign:
             qs = qs.filter(campaign_id=campaign)
+        # Best leads first; scores of new and edited leads are brought up to date in the background
+        if self.request.query_params.get('ordering') == '-score':
+            maybe_rescore()
+            return qs.order_by('-score', '-created_at')
         return qs.order_by('-created_at')
 
-class DealViewSet(viewsets.ModelViewSet):
+class DealViewSet(ExportMixin, ConditionalGetMixin, CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Deal.objects.all()
     serializer_class = DealSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrOwner]
@@ -85,7 +99,7 @@ class DealViewSet(viewsets.ModelViewSet):
             qs = qs.filter(owner_id=owner)
         return qs.order_by('-created_at')
 
-class CampaignViewSet(viewsets.ModelViewSet):
+class CampaignViewSet(ExportMixin, ConditionalGetMixin, CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Campaign.objects.all()
     serializer_class = CampaignSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrOwner]
@@ -94,9 +108,13 @@ class CampaignViewSet(viewsets.ModelViewSet):
         q = self.request.query_params.get('q')
         if q:
             qs = qs.filter(Q(name__icontains=q) | Q(description__icontains=q))
+        # Largest first by a maintained rollup column, e.g. ?ordering=-lead_count
+        ordering = self.request.query_params.get('ordering')
+        if ordering in ('-lead_count', '-deal_count', '-won_amount'):
+            return qs.order_by(ordering, '-created_at')
         return qs.order_by('-created_at')
 
-class TaskViewSet(viewsets.ModelViewSet):
+class TaskViewSet(ExportMixin, ConditionalGetMixin, CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrOwner]
@@ -114,7 +132,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         return qs.order_by('-created_at')
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ExportMixin, ConditionalGetMixin, CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     """Expose users via API at /api/users/"""
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -1,18 +1,23 @@
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from asgiref.sync import sync_to_async
 from django.db.models import Count, Sum
+from django.utils.cache import get_conditional_response
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from .serializers import RegisterSerializer, CRMSettingsSerializer
+from .async_views import AsyncAPIView, json_response
+from .conditional import dashboard_etag
 from .models import Account, Contact, Lead, Deal, Campaign, Task
 from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework import generics, status, permissions
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.contrib.auth import authenticate, login
+from .token_blacklist import FilteredRefreshToken
+from django.contrib.auth import login, logout
 from django.contrib.auth import get_user_model
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.core.mail import send_mail
+from .outbox import queue_mail
 from .models import User, CRMSettings
 from django.conf import settings
 from django.urls import reverse
@@ -36,14 +41,25 @@ class RegisterView(generics.CreateAPIView):
 
 
 class LoginView(TokenObtainPairView):
+    """
+    Issues the JWT pair for the user the serializer authenticated, so the
+    password is hashed once per login. A Django session (needed by the
+    @login_required pages) is also created unless the client sends
+    "session": false, or CRM_LOGIN_SESSION is off and it does not ask
+    for one.
+    """
     permission_classes = [permissions.AllowAny]
 
     def post(self, request, *args, **kwargs):
-        response = super().post(request, *args, **kwargs)
-        user = authenticate(email=request.data.get("email"), password=request.data.get("password"))
-        if user:
-            login(request, user)
-        return response
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+        session = request.data.get("session", settings.CRM_LOGIN_SESSION)
+        if session not in (False, "false", "0", 0):
+            login(request, serializer.user)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
 
 class LogoutView(generics.GenericAPIView):
@@ -52,8 +68,10 @@ class LogoutView(generics.GenericAPIView):
     def post(self, request):
         try:
             refresh_token = request.data["refresh"]
-            token = RefreshToken(refresh_token)
+            token = FilteredRefreshToken(refresh_token)
             token.blacklist()
+            # End the session LoginView started, so page shells stop embedding this user's data
+            logout(request._request)
             return Response(status=status.HTTP_205_RESET_CONTENT)
         except Exception:
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -78,11 +96,12 @@ class PasswordResetRequestView(generics.GenericAPIView):
         uid = user.pk
         reset_path = reverse("password-reset-confirm")
         reset_url = f"{request.scheme}://{request.get_host()}{reset_path}?uid={uid}&token={token}"
-        send_mail(
+        # Delivered by manage.py send_outbox; the response does not wait for SMTP
+        queue_mail(
             "Password reset",
             f"Use this link to reset your password: {reset_url}",
-            settings.DEFAULT_FROM_EMAIL,
             [user.email],
+            settings.DEFAULT_FROM_EMAIL,
         )
         return Response(
             {
@@ -111,10 +130,23 @@ class PasswordResetConfirmView(generics.GenericAPIView):
         return Response({"detail": "Password reset successful."})
 
 
-class DashboardView(APIView):
-    permission_classes = [IsAuthenticated]
+class DashboardView(AsyncAPIView):
+    """
+    Dashboard aggregates, on the async ORM. The ~25 count/aggregate queries
+    are awaited one after another, so under ASGI the worker serves other
+    requests while they run.
+    """
+
+    async def get(self, request):
+        etag = await sync_to_async(dashboard_etag)(request, (Account, Contact, Lead, Deal, Campaign, Task))
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = json_response(await self.dashboard(request))
+        response["ETag"] = etag
+        return response
 
-    def get(self, request):
+    async def dashboard(self, request):
         user = request.user
         # Normalize role to values expected by frontend (superuser/admin/employee)
         role_raw = getattr(user, "role", "EMPLOYEE")
@@ -129,37 +161,37 @@ class DashboardView(APIView):
         last_7_days = now - timedelta(days=7)
         last_30_days = now - timedelta(days=30)
 
-        total_leads = Lead.objects.count()
-        total_deals = Deal.objects.count()
+        total_leads = await Lead.objects.acount()
+        total_deals = await Deal.objects.acount()
 
         # Core totals
         data = {
             "role": role,
-            "total_accounts": Account.objects.count(),
-            "total_contacts": Contact.objects.count(),
+            "total_accounts": await Account.objects.acount(),
+            "total_contacts": await Contact.objects.acount(),
             "total_leads": total_leads,
             "total_deals": total_deals,
-            "total_campaigns": Campaign.objects.count(),
-            "total_tasks": Task.objects.count(),
+            "total_campaigns": await Campaign.objects.acount(),
+            "total_tasks": await Task.objects.acount(),
         }
 
         # Totals and recent KPIs
         data["total_deal_value"] = (
-            Deal.objects.aggregate(v=Sum("amount"))[("v")] or 0
+            (await Deal.objects.aaggregate(v=Sum("amount")))["v"] or 0
         )
-        data["recent_deals_7d"] = Deal.objects.filter(created_at__gte=last_7_days).count()
+        data["recent_deals_7d"] = await Deal.objects.filter(created_at__gte=last_7_days).acount()
 
         # Deal stages distribution
         stage_counts_qs = (
             Deal.objects.values("stage").order_by("stage").annotate(count=Count("id"))
         )
-        data["deal_stages"] = {row["stage"]: row["count"] for row in stage_counts_qs}
+        data["deal_stages"] = {row["stage"]: row["count"] async for row in stage_counts_qs}
 
         # Lead statuses distribution
         lead_status_qs = (
             Lead.objects.values("status").order_by("status").annotate(count=Count("id"))
         )
-        data["lead_statuses"] = {row["status"]: row["count"] for row in lead_status_qs}
+        data["lead_statuses"] = {row["status"]: row["count"] async for row in lead_status_qs}
 
         # Conversion rate: percentage of leads that are CONVERTED
         converted_leads = data["lead_statuses"].get("CONVERTED", 0)
@@ -169,7 +201,9 @@ class DashboardView(APIView):
         stage_value_qs = (
             Deal.objects.values("stage").order_by("stage").annotate(total=Sum("amount"))
         )
-        data["deal_value_by_stage"] = {row["stage"]: float(row["total"]) if row["total"] else 0 for row in stage_value_qs}
+        data["deal_value_by_stage"] = {
+            row["stage"]: float(row["total"]) if row["total"] else 0 async for row in stage_value_qs
+        }
 
         # Trends over last 30 days: weekly buckets (4 weeks)
         # Build 4 weekly ranges ending today: [W-3, W-2, W-1, W]
@@ -179,62 +213,62 @@ class DashboardView(APIView):
             period_end = now - timedelta(days=(i - 1) * 7)
             trends.append({
                 "week": f"Week {5 - i}",
-                "accounts": Account.objects.filter(created_at__gte=period_start, created_at__lt=period_end).count(),
-                "leads": Lead.objects.filter(created_at__gte=period_start, created_at__lt=period_end).count(),
-                "deals": Deal.objects.filter(created_at__gte=period_start, created_at__lt=period_end).count(),
+                "accounts": await Account.objects.filter(created_at__gte=period_start, created_at__lt=period_end).acount(),
+                "leads": await Lead.objects.filter(created_at__gte=period_start, created_at__lt=period_end).acount(),
+                "deals": await Deal.objects.filter(created_at__gte=period_start, created_at__lt=period_end).acount(),
             })
         data["trends"] = trends
 
-        # Campaign performance: leads per campaign + budget (top 5 by leads)
+        # Campaign performance: leads per campaign + budget (top 5 by leads),
+        # read from the maintained Campaign.lead_count index
         campaign_lead_counts = (
             Campaign.objects
-            .annotate(lead_count=Count("leads"))
             .order_by("-lead_count", "-budget")
             .values("id", "name", "budget", "lead_count")[:5]
         )
-        data["campaign_performance"] = list(campaign_lead_counts)
+        data["campaign_performance"] = [row async for row in campaign_lead_counts]
 
         # Include previews by role
         if role == "superuser":
-            data["recent_campaigns"] = list(
-                Campaign.objects.order_by("-created_at")[:5].values(
+            data["recent_campaigns"] = [
+                row async for row in Campaign.objects.order_by("-created_at")[:5].values(
                     "id", "name", "budget", "created_at"
                 )
-            )
-            data["recent_leads"] = list(
-                Lead.objects.order_by("-created_at")[:5].values(
+            ]
+            data["recent_leads"] = [
+                row async for row in Lead.objects.order_by("-created_at")[:5].values(
                     "id", "title", "status", "created_at"
                 )
-            )
-            data["recent_deals"] = list(
-                Deal.objects.order_by("-created_at")[:5].values(
+            ]
+            data["recent_deals"] = [
+                row async for row in Deal.objects.order_by("-created_at")[:5].values(
                     "id", "title", "amount", "stage", "created_at"
                 )
-            )
+            ]
         elif role == "admin":
-            data["recent_accounts"] = list(
-                Account.objects.order_by("-created_at")[:5].values(
+            data["recent_accounts"] = [
+                row async for row in Account.objects.order_by("-created_at")[:5].values(
                     "id", "name", "region", "created_at"
                 )
-            )
-            data["recent_leads"] = list(
-                Lead.objects.order_by("-created_at")[:5].values(
+            ]
+            data["recent_leads"] = [
+                row async for row in Lead.objects.order_by("-created_at")[:5].values(
                     "id", "title", "status", "created_at"
                 )
-            )
+            ]
         elif role == "employee":
-            data["assigned_leads"] = list(
-                Lead.objects.filter(owner=user).values(
+            data["assigned_leads"] = [
+                row async for row in Lead.objects.filter(owner=user).values(
                     "id", "title", "status", "created_at"
                 )
-            )
-            data["assigned_tasks"] = list(
-                Task.objects.filter(assigned_to=user).values(
+            ]
+            data["assigned_tasks"] = [
+                row async for row in Task.objects.filter(assigned_to=user).values(
                     "id", "title", "due_date", "completed", "created_at"
                 )
-            )
+            ]
 
-        return Response(data)
+        return data
 
 
 class SettingsView(APIView):
@@ -86,7 +86,7 @@ async function logoutUser() {
     try {
         await fetch("/api/auth/logout/", {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
+            headers: { "Content-Type": "application/json", ...authHeaders() },
             body: JSON.stringify({ refresh }),
         });
     } catch (err) {
@@ -11,7 +11,7 @@ async function loadDashboardData() {
         return;
     }
 
-    const res = await fetch("/api/dashboard/", {
+    const res = await preloadedFetch("/api/dashboard/", {
         headers: { "Authorization": "Bearer " + token }
     });
 
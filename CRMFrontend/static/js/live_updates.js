@@ -0,0 +1,85 @@
+// ===============================
+// Live list updates (/api/events/)
+// ===============================
+
+// Keeps a list table in sync with the server's change stream.
+//   entities:   entity names to listen for, e.g. "leads"
+//   base:       API endpoint of the entity, e.g. "/api/leads/"
+//   tbody:      table body whose rows carry data-id
+//   rowHtml:    item -> "<tr data-id=...>...</tr>"
+//   bindRow:    tr -> attaches the row's button handlers
+//   canPrepend: () -> true when new rows belong on the current page
+// The stream needs the ASGI server; under WSGI it answers 501 and the page
+// simply keeps working without live updates.
+function subscribeLiveUpdates(entities, { base, tbody, rowHtml, bindRow, canPrepend }) {
+    if (!window.EventSource) return null;
+
+    let source;
+    let lastEventId = "";
+    let failures = 0;
+
+    async function fetchRow(id) {
+        const res = await fetch(base + id + "/", { headers: authHeaders() });
+        if (!res.ok) return null;
+        const template = document.createElement("template");
+        template.innerHTML = rowHtml(await res.json()).trim();
+        const tr = template.content.firstElementChild;
+        bindRow(tr);
+        return tr;
+    }
+
+    async function onChange(event) {
+        lastEventId = event.lastEventId || lastEventId;
+        const { id, op } = JSON.parse(event.data);
+        const existing = tbody.querySelector(`tr[data-id="${id}"]`);
+        if (op === "D") {
+            if (existing) existing.remove();
+            return;
+        }
+        if (op === "U" && existing) {
+            const tr = await fetchRow(id);
+            if (tr) existing.replaceWith(tr);
+            else existing.remove();
+            return;
+        }
+        if (op === "C" && !existing && canPrepend()) {
+            const tr = await fetchRow(id);
+            if (tr && !tbody.querySelector(`tr[data-id="${id}"]`)) tbody.prepend(tr);
+        }
+    }
+
+    // EventSource cannot send the Authorization header, so each connection
+    // is opened with a single-use ticket rather than the token in the URL.
+    async function fetchTicket() {
+        let res = await fetch("/api/events/ticket/", { method: "POST", headers: authHeaders() });
+        if (res.status === 401) {
+            await refreshAccessToken();
+            res = await fetch("/api/events/ticket/", { method: "POST", headers: authHeaders() });
+        }
+        return res.ok ? (await res.json()).ticket : null;
+    }
+
+    async function connect() {
+        if (!getAccessToken()) return;
+        const ticket = await fetchTicket();
+        if (!ticket) return;
+        const params = new URLSearchParams({ entities, ticket });
+        // Browsers resend Last-Event-ID themselves only on automatic retries.
+        if (lastEventId) params.set("last_event_id", lastEventId);
+        source = new EventSource("/api/events/?" + params.toString());
+        source.addEventListener("change", onChange);
+        // Missed more than the server replays: the table is stale, load it afresh.
+        source.addEventListener("reset", () => window.location.reload());
+        source.onopen = () => { failures = 0; };
+        source.onerror = () => {
+            // Tickets are single-use, so the browser's own retry is refused; reopen
+            // with a new one, but give up if the server keeps refusing (e.g. 501 under WSGI).
+            source.close();
+            if (++failures <= 3) setTimeout(connect, 5000);
+        };
+    }
+
+    connect();
+    window.addEventListener("beforeunload", () => source && source.close());
+    return { close: () => source && source.close() };
+}
@@ -4,6 +4,13 @@ from django.views.decorators.cache import never_cache
 from django.shortcuts import render, redirect
 from django.contrib import messages
 
+from .preload import api_responses
+
+
+def render_page(request, template, preload=()):
+    """Render a page shell, embedding the API responses in preload when CRM_EMBED_INITIAL_DATA is on."""
+    return render(request, template, {"initial_data": api_responses(request, preload)})
+
 # -----------------------------
 # Auth / Entry Views
 # -----------------------------
@@ -45,10 +52,11 @@ def logout_page(request):
 def settings_page(request):
     return render(request, "settings.html")
 
+@never_cache
 @login_required
 @user_passes_test(lambda u: u.is_superuser)
 def user_management_page(request):
-    return render(request, "users.html")
+    return render_page(request, "users.html", ["/api/users/?page=1"])
 
 # -----------------------------
 # Dashboard View
@@ -59,7 +67,7 @@ def dashboard_page(request):
     """
     Displays dashboard. JS will fetch user data via /api/dashboard/ using JWT.
     """
-    return render(request, "dashboard.html")
+    return render_page(request, "dashboard.html", ["/api/dashboard/"])
 
 
 # -----------------------------
@@ -71,7 +79,7 @@ def accounts_page(request):
     """
     Displays Accounts list page (data fetched via /api/accounts/).
     """
-    return render(request, "accounts.html")
+    return render_page(request, "accounts.html", ["/api/users/", "/api/accounts/?page=1"])
 
 
 @never_cache
@@ -79,7 +87,7 @@ def contacts_page(request):
     """
     Displays Contacts list page (data fetched via /api/contacts/).
     """
-    return render(request, "contacts.html")
+    return render_page(request, "contacts.html", ["/api/contacts/?page=1", "/api/accounts/"])
 
 
 @never_cache
@@ -87,7 +95,13 @@ def leads_page(request):
     """
     Displays Leads list page (data fetched via /api/leads/).
     """
-    return render(request, "leads.html")
+    return render_page(request, "leads.html", [
+        "/api/leads/?page=1",
+        "/api/users/",
+        "/api/campaigns/",
+        "/api/accounts/",
+        "/api/contacts/",
+    ])
 
 
 @never_cache
@@ -95,7 +109,14 @@ def deals_page(request):
     """
     Displays Deals list page (data fetched via /api/deals/).
     """
-    return render(request, "deals.html")
+    return render_page(request, "deals.html", [
+        "/api/deals/?page=1",
+        "/api/users/",
+        "/api/accounts/",
+        "/api/leads/",
+        "/api/contacts/",
+        "/api/campaigns/",
+    ])
 
 
 @never_cache
@@ -103,7 +124,11 @@ def campaigns_page(request):
     """
     Displays Campaigns list page (data fetched via /api/campaigns/).
     """
-    return render(request, "campaigns.html")
+    return render_page(request, "campaigns.html", [
+        "/api/campaigns/?page=1",
+        "/api/users/",
+        "/api/accounts/",
+    ])
 
 
 @never_cache
@@ -111,7 +136,14 @@ def tasks_page(request):
     """
     Displays Tasks list page (data fetched via /api/tasks/).
     """
-    return render(request, "tasks.html")
+    return render_page(request, "tasks.html", [
+        "/api/tasks/?page=1",
+        "/api/users/",
+        "/api/leads/",
+        "/api/deals/",
+        "/api/campaigns/",
+        "/api/accounts/",
+    ])
 
 @never_cache
 @login_required
@@ -3,6 +3,9 @@ ASGI config for crm project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The live update stream (/api/events/) only works under ASGI, e.g.:
+    gunicorn crm.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -0,0 +1,21 @@
+"""
+gunicorn settings for running with Prometheus multiprocess metrics:
+
+    PROMETHEUS_MULTIPROC_DIR=/var/tmp/crm-metrics gunicorn -c crm/gunicorn_conf.py crm.wsgi
+"""
+import os
+import shutil
+
+
+def on_starting(server):
+    # Samples left by a previous run would be added to the new ones.
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -68,16 +68,21 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_REFRESH_SERIALIZER': 'CRMBackend.token_blacklist.FilteredTokenRefreshSerializer',
 }
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'CRMBackend.middleware.RequestMetricsMiddleware',
+    'CRMBackend.middleware.QueryInstrumentationMiddleware',
+    'CRMBackend.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'CRMFrontend.middleware.JWTAuthenticationMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'CRMBackend.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -128,6 +133,36 @@ DATABASES = {
     }
 }
 
+# Local database for development and load tests (manage.py loadtest):
+# CRM_DB=sqlite uses db.sqlite3, CRM_DB=postgres a local server without SSL.
+if os.getenv("CRM_DB") == "sqlite":
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('CRM_DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+    }
+elif os.getenv("CRM_DB") == "postgres":
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'HOST': os.getenv('CRM_DB_HOST', 'localhost'),
+        'PORT': os.getenv('CRM_DB_PORT', '5432'),
+        'NAME': os.getenv('CRM_DB_NAME', 'crm'),
+        'USER': os.getenv('CRM_DB_USER', 'postgres'),
+        'PASSWORD': os.getenv('CRM_DB_PASSWORD', ''),
+    }
+
+# Read replicas of default: comma-separated hosts (host or host:port) for PostgreSQL, database
+# files for SQLite (the same file as default works as a lag-free replica for local testing).
+# They become the aliases replica1, replica2, ... used by CRMBackend.db_router.ReplicaRouter.
+for _n, _replica in enumerate(filter(None, os.getenv('CRM_DB_REPLICAS', '').split(',')), start=1):
+    _replica = _replica.strip()
+    if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        _location = {'NAME': _replica}
+    else:
+        _host, _, _port = _replica.partition(':')
+        _location = {'HOST': _host, 'PORT': _port or DATABASES['default'].get('PORT', '')}
+    DATABASES[f'replica{_n}'] = {**DATABASES['default'], **_location, 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['CRMBackend.db_router.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -171,10 +206,167 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Email settings (for password reset) — replace with your SMTP / Supabase SMTP settings
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# (EMAIL_BACKEND=django.core.mail.backends.filebased.EmailBackend writes messages to EMAIL_FILE_PATH instead)
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', str(BASE_DIR / 'sent_emails'))
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', 10))
 EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.example.com')
 EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
 EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
-DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'no-reply@example.com')
\ No newline at end of file
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'no-reply@example.com')
+# Streaming exports (/api/<entity>/export/): rows fetched per server-side cursor round trip
+CRM_EXPORT_CHUNK_SIZE = int(os.getenv('CRM_EXPORT_CHUNK_SIZE', 2000))
+
+# Bulk imports (manage.py import_crm and /api/<entity>/import/): rows validated and written per chunk
+CRM_IMPORT_CHUNK_SIZE = int(os.getenv('CRM_IMPORT_CHUNK_SIZE', 5000))
+
+# Serve list actions from values_list() rows instead of per-row ModelSerializer instances
+CRM_FAST_LIST_SERIALIZATION = os.getenv('CRM_FAST_LIST_SERIALIZATION', 'True') == 'True'
+
+# Cache
+# Local memory is per process: with several gunicorn workers on one host use the
+# file backend (CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache,
+# CACHE_LOCATION=/var/tmp/crm-cache) so invalidations reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'crm-default'),
+    }
+}
+
+# Cache rendered list/detail responses of the CRM viewsets until a related model changes
+CRM_RESPONSE_CACHE = os.getenv('CRM_RESPONSE_CACHE', 'True') == 'True'
+CRM_RESPONSE_CACHE_TIMEOUT = int(os.getenv('CRM_RESPONSE_CACHE_TIMEOUT', 300))
+
+# Change feed (/api/changes/): tokens and log entries older than this are dropped by compact_changelog
+CRM_CHANGELOG_RETENTION_DAYS = int(os.getenv('CRM_CHANGELOG_RETENTION_DAYS', 30))
+# Entries younger than this are sent again on the next poll, in case an entry with a lower id was still
+# uncommitted; keep it above the longest transaction that writes change log entries (an import chunk)
+CRM_CHANGELOG_SETTLE_SECONDS = float(os.getenv('CRM_CHANGELOG_SETTLE_SECONDS', 30))
+
+# Live update stream (/api/events/, served by crm.asgi)
+CRM_EVENTS_POLL_SECONDS = float(os.getenv('CRM_EVENTS_POLL_SECONDS', 2))
+CRM_EVENTS_HEARTBEAT_SECONDS = float(os.getenv('CRM_EVENTS_HEARTBEAT_SECONDS', 15))
+CRM_EVENTS_MAX_SECONDS = float(os.getenv('CRM_EVENTS_MAX_SECONDS', 300))
+# Lifetime of the single-use tickets a browser opens the stream with (POST /api/events/ticket/)
+CRM_EVENTS_TICKET_SECONDS = int(os.getenv('CRM_EVENTS_TICKET_SECONDS', 30))
+
+# SQL instrumentation (CRMBackend.middleware): share of requests measured, Server-Timing header
+# (sent under DEBUG or to staff users only), slow request log threshold and how often one statement
+# may repeat before it is logged as N+1
+CRM_SQL_SAMPLE_RATE = float(os.getenv('CRM_SQL_SAMPLE_RATE', 0.01))
+CRM_SQL_SERVER_TIMING = os.getenv('CRM_SQL_SERVER_TIMING', 'True') == 'True'
+CRM_SQL_SLOW_REQUEST_MS = int(os.getenv('CRM_SQL_SLOW_REQUEST_MS', 1000))
+CRM_SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv('CRM_SQL_N_PLUS_ONE_THRESHOLD', 10))
+
+# Prometheus scrape endpoint (/metrics): bearer token required when set; without one only direct
+# requests from loopback or private addresses are served, unless CRM_METRICS_PUBLIC is True
+CRM_METRICS_TOKEN = os.getenv('CRM_METRICS_TOKEN', '')
+CRM_METRICS_PUBLIC = os.getenv('CRM_METRICS_PUBLIC', 'False') == 'True'
+
+# On-demand profiler (?__profile=1 from a superuser): stack sampling interval and where profiles are stored
+CRM_PROFILE_INTERVAL_MS = float(os.getenv('CRM_PROFILE_INTERVAL_MS', 5))
+CRM_PROFILE_DIR = os.getenv('CRM_PROFILE_DIR', str(BASE_DIR / 'media' / 'profiles'))
+
+# Facebook Graph transport: "http" (graph.facebook.com), "record" (http, saving every response
+# under FACEBOOK_GRAPH_FIXTURES) or "replay" (serve those fixtures offline, with injected
+# latency, page size and share of rate-limited calls)
+FACEBOOK_GRAPH_BACKEND = os.getenv('FACEBOOK_GRAPH_BACKEND', 'http')
+FACEBOOK_GRAPH_FIXTURES = os.getenv('FACEBOOK_GRAPH_FIXTURES', str(BASE_DIR / 'media' / 'graph_fixtures'))
+FACEBOOK_GRAPH_REPLAY_LATENCY_MS = float(os.getenv('FACEBOOK_GRAPH_REPLAY_LATENCY_MS', 0))
+FACEBOOK_GRAPH_REPLAY_PAGE_SIZE = int(os.getenv('FACEBOOK_GRAPH_REPLAY_PAGE_SIZE', 100))
+FACEBOOK_GRAPH_REPLAY_THROTTLE_RATE = float(os.getenv('FACEBOOK_GRAPH_REPLAY_THROTTLE_RATE', 0))
+
+# Rate-limited Graph calls are retried this many times, waiting backoff * 2**attempt seconds
+FACEBOOK_GRAPH_MAX_RETRIES = int(os.getenv('FACEBOOK_GRAPH_MAX_RETRIES', 3))
+FACEBOOK_GRAPH_RETRY_BACKOFF = float(os.getenv('FACEBOOK_GRAPH_RETRY_BACKOFF', 1.0))
+
+# Read replicas (CRM_DB_REPLICAS): safe requests under these paths read from a replica, unless the
+# user wrote within CRM_DB_STICKY_SECONDS or its lag, checked every CRM_DB_REPLICA_LAG_CHECK_SECONDS,
+# exceeds CRM_DB_MAX_REPLICA_LAG_SECONDS
+CRM_DB_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica')]
+CRM_DB_REPLICA_PATHS = [p for p in os.getenv('CRM_DB_REPLICA_PATHS', '/api/').split(',') if p]
+CRM_DB_STICKY_SECONDS = int(os.getenv('CRM_DB_STICKY_SECONDS', 10))
+CRM_DB_MAX_REPLICA_LAG_SECONDS = float(os.getenv('CRM_DB_MAX_REPLICA_LAG_SECONDS', 5))
+CRM_DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv('CRM_DB_REPLICA_LAG_CHECK_SECONDS', 5))
+
+# Refresh token blacklist: per-process Bloom filter in front of the table lookup, rebuilt every
+# CRM_TOKEN_FILTER_REBUILD_SECONDS and synced with new blacklist rows every CRM_TOKEN_FILTER_SYNC_SECONDS.
+# A token revoked through another process can still be refreshed here for up to that long (the
+# revoking process knows at once); 0 syncs before every check, i.e. one query per refresh as without
+# the filter. Expired tokens are deleted at most every CRM_TOKEN_COMPACTION_SECONDS
+# (0 disables; manage.py compact_tokens does it on demand)
+CRM_TOKEN_FILTER_ERROR_RATE = float(os.getenv('CRM_TOKEN_FILTER_ERROR_RATE', 0.001))
+CRM_TOKEN_FILTER_REBUILD_SECONDS = int(os.getenv('CRM_TOKEN_FILTER_REBUILD_SECONDS', 3600))
+CRM_TOKEN_FILTER_SYNC_SECONDS = float(os.getenv('CRM_TOKEN_FILTER_SYNC_SECONDS', 5))
+CRM_TOKEN_COMPACTION_SECONDS = int(os.getenv('CRM_TOKEN_COMPACTION_SECONDS', 86400))
+
+# Password hashing: PBKDF2 work factor (Django's default unless set); hashes at another count are
+# upgraded transparently on the next login. The other hashers only verify legacy hashes.
+CRM_PASSWORD_ITERATIONS = int(os.getenv('CRM_PASSWORD_ITERATIONS', 1_000_000))
+PASSWORD_HASHERS = [
+    'CRMBackend.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Login (/api/auth/login/): also start a Django session unless the client sends "session": false.
+# Sessions are read from the cache and written through to the database; with a shared cache
+# SESSION_ENGINE=django.contrib.sessions.backends.cache skips the database entirely.
+CRM_LOGIN_SESSION = os.getenv('CRM_LOGIN_SESSION', 'True') == 'True'
+SESSION_ENGINE = os.getenv('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
+
+# Email outbox: messages are queued in the database and delivered by manage.py send_outbox
+# (CRM_OUTBOX_BATCH_SIZE per SMTP connection). Failures are retried after CRM_OUTBOX_RETRY_BACKOFF
+# seconds, doubling each time, up to CRM_OUTBOX_MAX_ATTEMPTS. A batch not finished within
+# CRM_OUTBOX_CLAIM_SECONDS is picked up by another worker; sent messages are kept CRM_OUTBOX_RETENTION_DAYS
+CRM_OUTBOX_BATCH_SIZE = int(os.getenv('CRM_OUTBOX_BATCH_SIZE', 100))
+CRM_OUTBOX_MAX_ATTEMPTS = int(os.getenv('CRM_OUTBOX_MAX_ATTEMPTS', 8))
+CRM_OUTBOX_RETRY_BACKOFF = float(os.getenv('CRM_OUTBOX_RETRY_BACKOFF', 30))
+CRM_OUTBOX_CLAIM_SECONDS = int(os.getenv('CRM_OUTBOX_CLAIM_SECONDS', 900))
+CRM_OUTBOX_RETENTION_DAYS = int(os.getenv('CRM_OUTBOX_RETENTION_DAYS', 7))
+
+# Page shells (/dashboard/...): embed the first page of the list and the dropdown lookups, fetched for
+# the session user, as JSON so the first render needs no API round trip. Off by default (opt-in).
+CRM_EMBED_INITIAL_DATA = os.getenv('CRM_EMBED_INITIAL_DATA', 'False') == 'True'
+
+# Pipeline analytics (/api/analytics/pipeline/): daily rollups of the deal stage history, refreshed in the
+# background at most every CRM_PIPELINE_ROLLUP_SECONDS (0 = only by manage.py rollup_pipeline), each time
+# recomputing the days since the last rolled-up day minus CRM_PIPELINE_ROLLUP_REFRESH_DAYS
+CRM_PIPELINE_ROLLUP_SECONDS = int(os.getenv('CRM_PIPELINE_ROLLUP_SECONDS', 300))
+CRM_PIPELINE_ROLLUP_REFRESH_DAYS = int(os.getenv('CRM_PIPELINE_ROLLUP_REFRESH_DAYS', 1))
+
+# Revenue forecast (/api/forecast/): win probability per deal stage as STAGE:p pairs (requests may
+# override some with ?probabilities=), and how long ?snapshot=1 serves a cached aggregate
+CRM_FORECAST_STAGE_PROBABILITIES = {
+    stage.strip().upper(): float(p)
+    for stage, _, p in (
+        part.partition(':') for part in os.getenv(
+            'CRM_FORECAST_STAGE_PROBABILITIES',
+            'PROSPECT:0.1,QUALIFICATION:0.25,PROPOSAL:0.5,NEGOTIATION:0.75,WON:1,LOST:0',
+        ).split(',') if part.strip()
+    )
+}
+CRM_FORECAST_SNAPSHOT_SECONDS = int(os.getenv('CRM_FORECAST_SNAPSHOT_SECONDS', 300))
+
+# Contact deduplication: country calling code (digits, e.g. '1' or '49') assumed for phone numbers without
+# one when building E.164 match keys (empty = keep national numbers as digits), and the largest group of
+# contacts sharing a key that is compared pairwise (larger groups, e.g. a switchboard number, are skipped)
+CRM_DEFAULT_PHONE_COUNTRY_CODE = os.getenv('CRM_DEFAULT_PHONE_COUNTRY_CODE', '')
+CRM_DEDUP_MAX_BLOCK = int(os.getenv('CRM_DEDUP_MAX_BLOCK', 50))
+CRM_DEDUP_THRESHOLD = float(os.getenv('CRM_DEDUP_THRESHOLD', 0.6))
+
+# Lead scoring (?ordering=-score on /api/leads/): new and changed leads are scored in the background at most
+# every CRM_LEAD_SCORE_SECONDS (0 = only by manage.py score_leads), CRM_LEAD_SCORE_BATCH_SIZE leads per batch
+CRM_LEAD_SCORE_SECONDS = int(os.getenv('CRM_LEAD_SCORE_SECONDS', 300))
+CRM_LEAD_SCORE_BATCH_SIZE = int(os.getenv('CRM_LEAD_SCORE_BATCH_SIZE', 50000))
+
+# Facebook insights (/api/analytics/campaigns/ and /api/analytics/pages/): manage.py ingest_facebook_insights
+# and the integration sync fetch only the days after the newest stored one, re-fetching the last
+# CRM_FACEBOOK_INSIGHTS_REFRESH_DAYS that Facebook still revises; new objects start CRM_FACEBOOK_INSIGHTS_BACKFILL_DAYS back
+CRM_FACEBOOK_INSIGHTS_REFRESH_DAYS = int(os.getenv('CRM_FACEBOOK_INSIGHTS_REFRESH_DAYS', 3))
+CRM_FACEBOOK_INSIGHTS_BACKFILL_DAYS = int(os.getenv('CRM_FACEBOOK_INSIGHTS_BACKFILL_DAYS', 90))
@@ -18,6 +18,12 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
 from CRMBackend import views, views_auth, facebook_views
+from CRMBackend.changes import ChangesView
+from CRMBackend.events import EventTicketView, events_view
+from CRMBackend.forecast import ForecastView
+from CRMBackend.insights import CampaignPerformanceView, PagePerformanceView
+from CRMBackend.pipeline import PipelineAnalyticsView
+from CRMBackend.metrics import metrics_view
 from CRMBackend.facebook_oauth_callback import FacebookOAuthCallbackView
 from CRMFrontend import urls as CRMFrontendUrls
 from rest_framework_simplejwt.views import TokenRefreshView
@@ -34,6 +40,7 @@ router.register(r'facebook/integrations', facebook_views.FacebookIntegrationView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/auth/register/', views_auth.RegisterView.as_view(), name='auth-register'),
     path('api/auth/login/', views_auth.LoginView.as_view(), name='token_obtain_pair'),
     path('api/auth/logout/', views_auth.LogoutView.as_view(), name='auth-logout'),
@@ -41,6 +48,17 @@ urlpatterns = [
     path('api/auth/password-reset-confirm/', views_auth.PasswordResetConfirmView.as_view(), name='password-reset-confirm'),
     path('api/dashboard/', views_auth.DashboardView.as_view(), name='dashboard'),
     path('api/settings/', views_auth.SettingsView.as_view(), name='api-settings'),
+    path('api/changes/', ChangesView.as_view(), name='changes'),
+    path('api/events/', events_view, name='events'),
+    path('api/events/ticket/', EventTicketView.as_view(), name='events-ticket'),
+    path('api/forecast/', ForecastView.as_view(), name='forecast'),
+    path('api/analytics/pipeline/', PipelineAnalyticsView.as_view(), name='pipeline-analytics'),
+    path('api/analytics/campaigns/', CampaignPerformanceView.as_view(), name='campaign-performance'),
+    path('api/analytics/pages/', PagePerformanceView.as_view(), name='page-performance'),
+    # Async Graph relays; listed before the router, which no longer has these actions
+    path('api/facebook/integrations/<int:pk>/pages/', facebook_views.FacebookPagesView.as_view(), name='facebook-integration-pages'),
+    path('api/facebook/integrations/<int:pk>/ad_accounts/', facebook_views.FacebookAdAccountsView.as_view(), name='facebook-integration-ad-accounts'),
+    path('api/facebook/integrations/<int:pk>/leads/', facebook_views.FacebookLeadsView.as_view(), name='facebook-integration-leads'),
 
     path('', include(CRMFrontendUrls)),
     path('api/', include(router.urls)),